@@ -0,0 +1,235 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
+"""Content-addressed cache for the output files of a translation.
+
+An entry is addressed by a key, the hash of everything that determines the outputs of
+a translation: the expanded input statements, the preprocessor definitions, the resolved
+config values, the GPUFORT sources and the consulted GPUFORT module files (see: make_key).
+Each entry stores a copy of the output files of the translation plus a manifest with
+their original paths. A cache hit restores the files by copying or hardlinking them.
+
+Layout of the cache directory:
+
+  <CACHE_DIR>/entries/<key[0:2]>/<key>/{manifest.json,0,1,...}
+  <CACHE_DIR>/stats.json  -- size of the cache and hit/miss counters
+  <CACHE_DIR>/lock        -- guards 'stats.json' and eviction
+
+The modification time of an entry's manifest is its last access time.
+If the cache outgrows MAX_SIZE, the least recently used entries are evicted.
+Entries are created in a temporary directory and then renamed, so concurrent
+gpufort processes never see partially written entries.
+"""
+import os
+import json
+import time
+import shutil
+import fcntl
+import marshal
+import hashlib
+import contextlib
+
+import utils.codecache
+import utils.logging
+
+utils.codecache.exec_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_options.py.in"),globals())
+
+__MANIFEST    = "manifest.json"
+__STATS       = "stats.json"
+__LOCK        = "lock"
+__COUNTERS    = ["hits","misses","stores","evictions"]
+__EVICT_RATIO = 0.9 # evict down to this fraction of MAX_SIZE so that not every store triggers an eviction
+
+def _intrnl_canonicalize(value):
+    """:return: A JSON-serializable representation of 'value' that does not depend on set or dict ordering."""
+    if value is None or isinstance(value,(bool,int,float,str)):
+        return value
+    elif isinstance(value,dict):
+        return sorted([[str(key),_intrnl_canonicalize(item)] for key,item in value.items()])
+    elif isinstance(value,(list,tuple)):
+        return [_intrnl_canonicalize(item) for item in value]
+    elif isinstance(value,(set,frozenset)):
+        return sorted([_intrnl_canonicalize(item) for item in value],key=repr)
+    elif hasattr(value,"__code__"): # e.g. hooks in config files
+        return hashlib.sha256(marshal.dumps(value.__code__)).hexdigest()
+    else:
+        return type(value).__name__
+
+def _intrnl_entry_dir(key):
+    return os.path.join(CACHE_DIR,"entries",key[0:2],key)
+
+def _intrnl_list_entries():
+    """:return: List of tuples of last access time, entry directory and size of all entries."""
+    entries = []
+    entries_dir = os.path.join(CACHE_DIR,"entries")
+    if os.path.isdir(entries_dir):
+        for prefix in os.listdir(entries_dir):
+            for key in os.listdir(os.path.join(entries_dir,prefix)):
+                entry_dir = os.path.join(entries_dir,prefix,key)
+                try:
+                    atime = os.stat(os.path.join(entry_dir,__MANIFEST)).st_mtime
+                    size  = sum(os.stat(os.path.join(entry_dir,name)).st_size for name in os.listdir(entry_dir))
+                    entries.append((atime,entry_dir,size))
+                except OSError:
+                    pass # concurrently evicted
+    return entries
+
+def _intrnl_read_stats():
+    try:
+        with open(os.path.join(CACHE_DIR,__STATS),"r") as infile:
+            return json.load(infile)
+    except (OSError,ValueError):
+        entries = _intrnl_list_entries()
+        stats = { "size": sum(entry[2] for entry in entries), "entries": len(entries) }
+        stats.update({ counter: 0 for counter in __COUNTERS })
+        return stats
+
+def _intrnl_write_stats(stats):
+    tmp_filepath = os.path.join(CACHE_DIR,"{}.{}".format(__STATS,os.getpid()))
+    with open(tmp_filepath,"w") as outfile:
+        json.dump(stats,outfile)
+    os.replace(tmp_filepath,os.path.join(CACHE_DIR,__STATS))
+
+@contextlib.contextmanager
+def _intrnl_locked_stats():
+    """Yields the stats, which can be modified in-place, while holding the cache lock."""
+    os.makedirs(CACHE_DIR,exist_ok=True)
+    with open(os.path.join(CACHE_DIR,__LOCK),"a") as lockfile:
+        fcntl.flock(lockfile,fcntl.LOCK_EX)
+        try:
+            stats = _intrnl_read_stats()
+            yield stats
+            _intrnl_write_stats(stats)
+        finally:
+            fcntl.flock(lockfile,fcntl.LOCK_UN)
+
+def _intrnl_evict(stats):
+    """Evict the least recently used entries until the cache fits into its budget. Caller must hold the lock."""
+    entries = sorted(_intrnl_list_entries())
+    stats["size"]    = sum(entry[2] for entry in entries)
+    stats["entries"] = len(entries)
+    for _, entry_dir, size in entries:
+        if stats["size"] <= __EVICT_RATIO*MAX_SIZE:
+            break
+        shutil.rmtree(entry_dir,ignore_errors=True)
+        stats["size"]      -= size
+        stats["entries"]   -= 1
+        stats["evictions"] += 1
+        utils.logging.log_debug(LOG_PREFIX,"_intrnl_evict","evicted entry '{}'".format(entry_dir))
+
+def _intrnl_restore_file(src,dest):
+    if os.path.lexists(dest):
+        os.unlink(dest) # never write through an existing (hard)link
+    if RESTORE_MODE == "hardlink":
+        try:
+            os.link(src,dest)
+            return
+        except OSError:
+            pass # e.g. different file system
+    shutil.copyfile(src,dest)
+
+# API
+def make_key(components):
+    """
+    :param dict components: Everything that determines the outputs of a translation.
+                            Values are canonicalized, i.e. the ordering of dicts and sets does not matter,
+                            functions are represented by their bytecode and other objects by their type name.
+    :return: Hex digest that addresses the cache entry.
+    """
+    canonical = json.dumps(_intrnl_canonicalize(components),separators=(",",":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def source_fingerprint(source_dir):
+    """
+    :return: Hex digest over path, size and modification time of all Python sources and
+             templates in 'source_dir'. Used as version of the GPUFORT installation.
+    """
+    hasher = hashlib.sha256()
+    for root, dirs, files in os.walk(source_dir):
+        dirs[:] = sorted(d for d in dirs if d not in ["__pycache__","test"])
+        for name in sorted(files):
+            if name.endswith((".py",".py.in")) or ".template." in name:
+                filepath = os.path.join(root,name)
+                stat = os.stat(filepath)
+                hasher.update("{}:{}:{};".format(os.path.relpath(filepath,source_dir),
+                  stat.st_size,stat.st_mtime_ns).encode())
+    return hasher.hexdigest()
+
+def restore(key):
+    """
+    Restore the output files of the entry with the given key.
+
+    :return: List of the restored file paths or None if there is no (complete) entry for the key.
+    """
+    utils.logging.log_enter_function(LOG_PREFIX,"restore",{"key":key})
+
+    entry_dir = _intrnl_entry_dir(key)
+    filepaths = None
+    try:
+        with open(os.path.join(entry_dir,__MANIFEST),"r") as infile:
+            manifest = json.load(infile)
+        for i, filepath in enumerate(manifest["files"]):
+            _intrnl_restore_file(os.path.join(entry_dir,str(i)),filepath)
+        os.utime(os.path.join(entry_dir,__MANIFEST)) # mark as recently used
+        filepaths = manifest["files"]
+    except (OSError,ValueError,KeyError):
+        pass # no entry or concurrently evicted
+    with _intrnl_locked_stats() as stats:
+        stats["hits" if filepaths != None else "misses"] += 1
+    if filepaths != None:
+        for filepath in filepaths:
+            msg = "restored from cache: ".ljust(40) + filepath
+            utils.logging.log_info(LOG_PREFIX,"restore",msg)
+
+    utils.logging.log_leave_function(LOG_PREFIX,"restore")
+    return filepaths
+
+def store(key,filepaths):
+    """
+    Store copies of the given output files under the given key.
+    Evicts least recently used entries if the cache outgrows MAX_SIZE.
+
+    :param list filepaths: Absolute paths of the output files.
+    """
+    utils.logging.log_enter_function(LOG_PREFIX,"store",{"key":key,"filepaths":" ".join(filepaths)})
+
+    filepaths = list(dict.fromkeys(filepaths)) # files may have been written more than once
+    size      = sum(os.stat(filepath).st_size for filepath in filepaths)
+    entry_dir = _intrnl_entry_dir(key)
+    if size > MAX_SIZE:
+        msg = "outputs ({} bytes) exceed the maximum cache size; not cached".format(size)
+        utils.logging.log_warning(LOG_PREFIX,"store",msg)
+    elif not os.path.exists(entry_dir):
+        tmp_dir = os.path.join(CACHE_DIR,"tmp","{}.{}".format(key,os.getpid()))
+        os.makedirs(tmp_dir,exist_ok=True)
+        for i, filepath in enumerate(filepaths):
+            shutil.copyfile(filepath,os.path.join(tmp_dir,str(i)))
+        with open(os.path.join(tmp_dir,__MANIFEST),"w") as outfile:
+            json.dump({ "files": filepaths, "created": time.time() },outfile)
+        size += os.stat(os.path.join(tmp_dir,__MANIFEST)).st_size
+        os.makedirs(os.path.dirname(entry_dir),exist_ok=True)
+        try:
+            os.rename(tmp_dir,entry_dir)
+            stored = True
+        except OSError: # stored concurrently by another process
+            shutil.rmtree(tmp_dir,ignore_errors=True)
+            stored = False
+        if stored:
+            with _intrnl_locked_stats() as stats:
+                stats["size"]    += size
+                stats["entries"] += 1
+                stats["stores"]  += 1
+                if stats["size"] > MAX_SIZE:
+                    _intrnl_evict(stats)
+            utils.logging.log_info(LOG_PREFIX,"store","stored {} files in cache entry '{}'".format(len(filepaths),entry_dir))
+
+    utils.logging.log_leave_function(LOG_PREFIX,"store")
+
+def stats():
+    """
+    :return: Dict with the cache directory, the maximum and current size in bytes, the number of entries and
+             the number of hits, misses, stores and evictions since the cache was created.
+    """
+    with _intrnl_locked_stats() as locked_stats:
+        result = dict(locked_stats)
+    result.update(cache_dir=CACHE_DIR,max_size=MAX_SIZE)
+    return result
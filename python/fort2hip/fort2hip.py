@@ -10,8 +10,10 @@ import translator.translator as translator
 import indexer.indexer as indexer
 import indexer.scoper as scoper
 import scanner.scanner as scanner
+import utils.codecache
 import utils.logging
 import utils.fileutils
+import utils.timing
 
 INDEXER_ERROR_CODE = 1000
 
@@ -23,7 +25,7 @@ def GET_DEFAULT_LAUNCH_BOUNDS(kernel_name):
     return None
 
 fort2hip_dir = os.path.dirname(__file__)
-exec(open("{0}/fort2hip_options.py.in".format(fort2hip_dir)).read())
+utils.codecache.exec_file(os.path.join(fort2hip_dir,"fort2hip_options.py.in"),globals())
 
 def _intrnl_convert_dim3(dim3,dimensions,do_filter=True):
      result = []
@@ -287,12 +289,13 @@ def _intrnl_update_context_from_loop_kernels(loop_kernels,index,hip_context,f_co
     generate_cpu_launcher = generate_launcher and EMIT_CPU_IMPLEMENTATION
     
     hip_context["have_reductions"] = False
-    for stkernel in loop_kernels:
+    for stkernel in utils.timing.timed_iterations(loop_kernels,"fort2hip.process_loop_kernel","kernel",_intrnl_kernel_timing_args):
         parent_tag = stkernel._parent.tag()
         scope     = scoper.create_scope(index,parent_tag)
    
         # translate and analyze kernels
-        parse_result = translator.parse_loop_kernel(stkernel.code,scope)
+        with utils.timing.timed("translator.parse_loop_kernel","kernel",_intrnl_kernel_timing_args(stkernel)):
+            parse_result = translator.parse_loop_kernel(stkernel.code,scope)
 
         kernel_args, c_kernel_local_vars, macros, input_arrays, local_cpu_routine_args =\
           _intrnl_derive_kernel_arguments(scope,\
@@ -332,7 +335,7 @@ def _intrnl_update_context_from_loop_kernels(loop_kernels,index,hip_context,f_co
                     is_reduction_var = True
             if not is_reduction_var:
                 kernel_call_arg_names.append(name)
-                if type(stkernel) is scanner.STAccLoopKernel:
+                if "acc" in scanner.SOURCE_DIALECTS and type(stkernel) is scanner.STAccLoopKernel:
                     if len(arg["c_size"]):
                         stkernel.append_default_present_var(name)
             hip_context["have_reductions"] |= is_reduction_var
@@ -481,7 +484,7 @@ def _intrnl_update_context_from_device_procedures(device_procedures,index,hip_co
 
     utils.logging.log_enter_function(LOG_PREFIX,"_intrnl_update_context_from_device_procedures")
     
-    for stprocedure in device_procedures:
+    for stprocedure in utils.timing.timed_iterations(device_procedures,"fort2hip.process_device_procedure","kernel",_intrnl_kernel_timing_args):
         scope       = scoper.create_scope(index,stprocedure.tag())
         iprocedure  = stprocedure.index_record
         is_function  = iprocedure["kind"] == "function"
@@ -494,14 +497,16 @@ def _intrnl_update_context_from_device_procedures(device_procedures,index,hip_co
             ivar_result = next([var for var in iprocedure["variables"] if var["name"] == iprocedure["result_name"]],None)
             if ivar_result != None:
                 result_type = ivar_result["c_type"]
-                parse_result = translator.parse_procedure_body(stprocedure.code,scope,ivar_result["name"])
+                with utils.timing.timed("translator.parse_procedure_body","kernel",_intrnl_kernel_timing_args(stprocedure)):
+                    parse_result = translator.parse_procedure_body(stprocedure.code,scope,ivar_result["name"])
             else:
                 msg = "could not identify return value for function ''"
                 utils.logging.log_error(msg)
                 sys.exit(INDEXER_ERROR_CODE)
         else:
             result_type = "void"
-            parse_result = translator.parse_procedure_body(stprocedure.code,scope)
+            with utils.timing.timed("translator.parse_procedure_body","kernel",_intrnl_kernel_timing_args(stprocedure)):
+                parse_result = translator.parse_procedure_body(stprocedure.code,scope)
         utils.logging.log_debug3(LOG_PREFIX,"_intrnl_update_context_from_device_procedures","parse result:\n```"+parse_result.c_str().rstrip()+"\n```")
 
         # TODO: look up functions and subroutines called internally and supply to parse_result before calling c_str()
@@ -583,24 +588,32 @@ def _intrnl_update_context_from_device_procedures(device_procedures,index,hip_co
     
     utils.logging.log_enter_function(LOG_PREFIX,"_intrnl_update_context_from_device_procedures")
 
+def _intrnl_kernel_timing_args(stkernel):
+    """:return: Args of the timing events of a loop kernel or device procedure (see: utils.timing)."""
+    if isinstance(stkernel,scanner.STLoopKernel):
+        return {"kernel":stkernel.kernel_name(),"lineno":stkernel.min_lineno()}
+    else:
+        return {"kernel":stkernel.name,"lineno":stkernel.min_lineno()}
+
 def _intrnl_write_file(outfile_path,kind,content):
+    """:param content: A string or an iterable of strings, e.g. the chunks generated by a model."""
     utils.logging.log_enter_function(LOG_PREFIX,"_intrnl_write_file")
     
-    with open(outfile_path,"w") as outfile:
-        outfile.write(content)
-        msg = "created {}: ".format(kind).ljust(40) + outfile_path
-        utils.logging.log_info(LOG_PREFIX,"_intrnl_write_file",msg)
+    utils.fileutils.prepare_output_file(outfile_path)
+    utils.fileutils.write_output_file(outfile_path,content)
+    msg = "created {}: ".format(kind).ljust(40) + outfile_path
+    utils.logging.log_info(LOG_PREFIX,"_intrnl_write_file",msg)
     
     utils.logging.log_leave_function(LOG_PREFIX,"_intrnl_write_file")
 
 
 def _intrnl_create_includes_from_used_modules(index_record,index):
     """Create include statement for a module's/subprogram's used modules that are present in the index."""
-    used_modules  = [irecord["name"] for irecord in index_record["used_modules"]]
     includes     = []
-    for iuse in index:
-        if iuse["name"] in used_modules:
-            includes.append(iuse["name"] + HIP_FILE_EXT)
+    for irecord in index_record["used_modules"]:
+        include = irecord["name"] + HIP_FILE_EXT
+        if index.find(irecord["name"]) is not None and include not in includes:
+            includes.append(include)
     return includes
 # API
 
@@ -625,6 +638,7 @@ def generate_gpufort_headers(output_dir):
 def generate_hip_files(stree,index,kernels_to_convert_to_hip,translation_source_path,generate_code):
     """
     :param stree:        [inout] the scanner tree holds nodes that store the Fortran code lines of the kernels
+    :param index:        [in] scoper.Index or list of module/program index records
     :param generate_code: generate code or just feed kernel signature information
                          back to the scanner tree.
     :note The signatures of the identified kernels must be fed back to the 
@@ -642,6 +656,8 @@ def generate_hip_files(stree,index,kernels_to_convert_to_hip,translation_source_
       {"kernels_to_convert_to_hip":" ".join(kernels_to_convert_to_hip),\
        "translation_source_path": translation_source_path,\
        "generate_code":generate_code})
+    if not isinstance(index,scoper.Index):
+        index = scoper.Index(index)
     def select_(kernel):
         nonlocal kernels_to_convert_to_hip
         if not len(kernels_to_convert_to_hip):
@@ -665,7 +681,7 @@ def generate_hip_files(stree,index,kernels_to_convert_to_hip,translation_source_
    
     have_reductions     = False
     hip_module_filenames = []
-    fortran_modules     = []
+    fortran_module_contexts = []
     program_or_modules = stree.find_all(filter=lambda child: type(child) in [scanner.STProgram,scanner.STModule], recursively=False)
     for stmodule in program_or_modules:
         # file names & paths
@@ -681,8 +697,8 @@ def generate_hip_files(stree,index,kernels_to_convert_to_hip,translation_source_
         # derivedtypes = ....
         
         # TODO handle includes
-        imodule = next((ilinemap for ilinemap in index if ilinemap["name"] == module_name),None)
-        if imodule == None:
+        imodule = index.find(module_name)
+        if imodule is None:
             utils.logging.log_error(LOG_PREFIX,"generate_hip_files","could not find linemap for module '{}'.".format(module_name))
             sys.exit() # TODO add error code
 
@@ -719,14 +735,14 @@ def generate_hip_files(stree,index,kernels_to_convert_to_hip,translation_source_
             if generate_code:
                 have_reductions = have_reductions or hip_context["have_reductions"]
 
-                _intrnl_write_file(\
-                   hip_module_filepath,"HIP C++ implementation file",\
-                   model.HipImplementationModel().generate_code(hip_context))
+                with utils.timing.timed("fort2hip.render",args={"module":module_name,"file":hip_module_filepath}):
+                    _intrnl_write_file(\
+                       hip_module_filepath,"HIP C++ implementation file",\
+                       model.HipImplementationModel().generate_chunks(hip_context))
                 if PRETTIFY_EMITTED_C_CODE:
                     utils.fileutils.prettify_c_file(hip_module_filepath,CLANG_FORMAT_STYLE)
                 if len(f_context["interfaces"]):
-                   fortran_modules.append(\
-                     model.InterfaceModuleModel().generate_code(f_context))
+                   fortran_module_contexts.append(f_context)
         else:
             content = "\n".join(["#include \"{}\"".format(filename) for filename in includes])
             if len(content):
@@ -742,12 +758,17 @@ def generate_hip_files(stree,index,kernels_to_convert_to_hip,translation_source_
         _intrnl_write_file(main_hip_filepath,"main HIP C++ file",content)
 
         # Fortran module file
-        if len(fortran_modules):
+        if len(fortran_module_contexts):
+            def fortran_module_chunks_():
+                if len(FORTRAN_MODULE_PREAMBLE):
+                    yield FORTRAN_MODULE_PREAMBLE + "\n"
+                for i,f_context in enumerate(fortran_module_contexts):
+                    if i > 0:
+                        yield "\n"
+                    yield from model.InterfaceModuleModel().generate_chunks(f_context)
             fortran_module_filepath = translation_source_path + FORTRAN_MODULE_FILE_EXT
-            content               = "\n".join(fortran_modules)
-            if len(FORTRAN_MODULE_PREAMBLE):
-                content = FORTRAN_MODULE_PREAMBLE + "\n" + content
-            _intrnl_write_file(fortran_module_filepath,"interface/testing module",content)
+            with utils.timing.timed("fort2hip.render",args={"file":fortran_module_filepath}):
+                _intrnl_write_file(fortran_module_filepath,"interface/testing module",fortran_module_chunks_())
             if PRETTIFY_EMITTED_FORTRAN_CODE:
                 utils.fileutils.prettify_f_file(fortran_module_filepath)
     
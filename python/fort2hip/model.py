@@ -1,29 +1,73 @@
-# SPDX-License-Identifier: MIT                                                
+# SPDX-License-Identifier: MIT
 # Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
+"""
+Models that render the Jinja2 templates in the 'templates' directory.
+
+All models share one process-wide environment, which caches the compiled templates
+(keyed on their name, reloaded if a template file changes). The bytecode of compiled
+templates is further stored in 'templates/__pycache__' so that new processes, e.g.
+the workers of a batch translation, do not need to compile the templates again.
+"""
 import os
+import sys
 import pprint
 
 import jinja2
 
 import addtoplevelpath
 import utils.logging
-    
+import utils.fileutils
+
+__TEMPLATE_DIR = os.path.realpath(os.path.dirname(__file__))
+__env          = None # created on first use
+
+class _intrnl_BytecodeCache(jinja2.FileSystemBytecodeCache):
+    """Ignores errors when writing the cache, e.g. due to a read-only installation."""
+    def dump_bytecode(self,bucket):
+        try:
+            jinja2.FileSystemBytecodeCache.dump_bytecode(self,bucket)
+        except OSError:
+            pass
+
+def _intrnl_get_environment():
+    global __env
+    if __env == None:
+        bytecode_cache = None
+        if not sys.dont_write_bytecode:
+            cache_dir = os.path.join(__TEMPLATE_DIR,"templates","__pycache__")
+            try:
+                os.makedirs(cache_dir,exist_ok=True)
+                bytecode_cache = _intrnl_BytecodeCache(cache_dir,"%s.jinja2.cache")
+            except OSError:
+                pass
+        __env = jinja2.Environment(loader=jinja2.FileSystemLoader(__TEMPLATE_DIR),
+                  trim_blocks=True, lstrip_blocks=True, undefined=jinja2.StrictUndefined,
+                  bytecode_cache=bytecode_cache)
+    return __env
+
+def load_templates():
+    """Compile all templates so that processes forked from this one do not need to."""
+    for model_class in [HipImplementationModel,InterfaceModuleModel,InterfaceModuleTestModel,
+                        GpufortHeaderModel,GpufortReductionsHeaderModel]:
+        model_class().get_template()
+
 class BaseModel():
     def __init__(self,template):
         self._template = template
-    def generate_code(self,context={}):
-        LOADER = jinja2.FileSystemLoader(os.path.realpath(os.path.dirname(__file__)))
-        ENV    = jinja2.Environment(loader=LOADER, trim_blocks=True, lstrip_blocks=True, undefined=jinja2.StrictUndefined)
-
-        template = ENV.get_template(self._template)
+    def get_template(self):
+        """:return: The compiled template, which is cached by the shared environment."""
+        return _intrnl_get_environment().get_template(self._template)
+    def generate_chunks(self,context={}):
+        """:return: Generator that renders the template piece by piece."""
         try:
-            return template.render(context)
+            yield from self.get_template().generate(context)
         except Exception as e:
-            utils.logging.log_error("fort2hip.model","BaseModel.generate_code","could not render template '%s'" % self._template)
+            utils.logging.log_error("fort2hip.model","BaseModel.generate_chunks","could not render template '%s'" % self._template)
             raise e
+    def generate_code(self,context={}):
+        return "".join(self.generate_chunks(context))
     def generate_file(self,output_file_path,context={}):
-        with open(output_file_path, "w") as output:
-            output.write(self.generate_code(context))
+        utils.fileutils.write_output_file(output_file_path,self.generate_chunks(context))
 
 class HipImplementationModel(BaseModel):
     def __init__(self):
@@ -48,4 +92,4 @@ class GpufortReductionsHeaderModel(BaseModel):
 #model = GpufortHeaderModel()
 #model.generate_file("gpufort.h")
 #model = GpufortReductionsHeaderModel()
-#model.generate_file("gpufort_reductions.h")
\ No newline at end of file
+#model.generate_file("gpufort_reductions.h")
@@ -1,24 +1,48 @@
 #!/usr/bin/env python3
 # SPDX-License-Identifier: MIT                                                
 # Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
-import os, sys
+import os, sys, traceback
 import argparse
+import multiprocessing
 import hashlib
+import tempfile
+import shutil
+import pickle
 import cProfile,pstats,io
 
+import orjson
+
 # local imports
 import addtoplevelpath
+import utils.codecache
 import utils.logging
 import utils.fileutils
+import utils.timing
+import utils.prefetch
 import scanner.scanner as scanner
 import indexer.indexer as indexer
+import indexer.scoper as scoper
 import linemapper.linemapper as linemapper
 import translator.translator as translator
 import fort2hip.fort2hip as fort2hip
+import server.server as server
+import cache.cache as cache
 
 __GPUFORT_PYTHON_DIR = os.path.dirname(os.path.abspath(__file__))
 __GPUFORT_ROOT_DIR   = os.path.abspath(os.path.join(__GPUFORT_PYTHON_DIR,".."))
-exec(open(os.path.join(__GPUFORT_PYTHON_DIR, "gpufort_options.py.in")).read())
+utils.codecache.exec_file(os.path.join(__GPUFORT_PYTHON_DIR, "gpufort_options.py.in"),globals())
+
+# options that determine the outputs of a translation, see: _intrnl_cache_key
+__CACHE_KEY_OPTIONS = [
+  ("gpufort",    "gpufort_options.py.in"),
+  ("scanner",    "scanner/scanner_options.py.in"),
+  ("translator", "translator/translator_options.py.in"),
+  ("fort2hip",   "fort2hip/fort2hip_options.py.in"),
+  ("indexer",    "indexer/indexer_options.py.in"),
+  ("scoper",     "indexer/scoper_options.py.in"),
+  ("linemapper", "linemapper/linemapper_options.py.in"),
+]
+__CACHE_KEY_ARGS = ["emit_cpu_implementation","emit_debug_code"] # not reflected by options 
 
 # arg for kernel generator
 # array is split into multiple args
@@ -33,16 +57,17 @@ def create_index(search_dirs,options,filepath,linemaps=None):
 
     options_as_str = " ".join(options)
     
-    index = []
-    if not SKIP_CREATE_GPUFORT_MODULE_FILES:
-        if linemaps != None:
-            indexer.update_index_from_linemaps(linemaps,index)
-        else:
-            indexer.scan_file(filepath,options_as_str,index)
-        output_dir = os.path.dirname(filepath)
-        indexer.write_gpufort_module_files(index,output_dir)
-    index.clear()
-    indexer.load_gpufort_module_files(search_dirs,index)
+    index = scoper.Index()
+    with utils.timing.timed("create_index",args={"input":filepath}):
+        if not SKIP_CREATE_GPUFORT_MODULE_FILES:
+            if linemaps != None:
+                indexer.update_index_from_linemaps(linemaps,index)
+            else:
+                indexer.scan_file(filepath,options_as_str,index)
+            output_dir = os.path.dirname(filepath)
+            indexer.write_gpufort_module_files(index,output_dir)
+        index.clear()
+        indexer.load_gpufort_module_files(search_dirs,index,linemaps)
     
     utils.logging.log_leave_function(LOG_PREFIX,"create_index")
     return index
@@ -66,7 +91,8 @@ def _intrnl_translate_source(infilepath,stree,linemaps,index,preamble):
 
     # write the file
     outfilepath = infilepath + MODIFIED_FILE_EXT
-    linemapper.write_modified_file(outfilepath,infilepath,linemaps,preamble)
+    with utils.timing.timed("linemapper.write_modified_file",args={"input":infilepath}):
+        linemapper.write_modified_file(outfilepath,infilepath,linemaps,preamble)
 
     # prettify the file
     if PRETTIFY_MODIFIED_TRANSLATION_SOURCE:
@@ -76,6 +102,25 @@ def _intrnl_translate_source(infilepath,stree,linemaps,index,preamble):
     
     utils.logging.log_leave_function(LOG_PREFIX,"_intrnl_translate_source")
 
+def _intrnl_expand_response_files(argv):
+    """
+    Replace every argument '@<file>' in-place by the arguments listed in the response file,
+    one per line. Empty lines and lines starting with '#' are ignored.
+    """
+    i = 1
+    while i < len(argv):
+        if argv[i].startswith("@") and len(argv[i]) > 1:
+            try:
+                with open(argv[i][1:],"r") as infile:
+                    expanded = [line.strip() for line in infile.readlines()]
+            except OSError:
+                msg = "response file '{}' cannot be read".format(argv[i][1:])
+                print("ERROR: "+msg,file=sys.stderr)
+                sys.exit(2)
+            argv[i:i+1] = [arg for arg in expanded if len(arg) and not arg.startswith("#")]
+        else:
+            i += 1
+
 def parse_raw_command_line_arguments():
     """
     Parse command line arguments before using argparse.
@@ -87,6 +132,7 @@ def parse_raw_command_line_arguments():
     working_dir_path = os.getcwd()
     include_dirs    = []
     defines        = []
+    _intrnl_expand_response_files(sys.argv)
     options = sys.argv[1:]
     for i,opt in enumerate(list(options)):
         if opt == "--working-dir":
@@ -164,10 +210,12 @@ def parse_command_line_arguments():
     parser = argparse.ArgumentParser(description="S2S translation tool for CUDA Fortran and Fortran+X")
     
     # General options
-    parser.add_argument("input",help="The input file.",type=str,nargs="?",default=None)
+    parser.add_argument("input",help="The input file(s). Multiple input files are translated in a batch by a pool of processes (see '-j').",type=str,nargs="*",default=[])
     parser.add_argument("-c","--only-create-mod-files",dest="only_create_gpufort_module_files",action="store_true",help="Only create GPUFORT modules files. No other output is created.")
+    parser.add_argument("--index-project",dest="index_project",action="store_true",help="Treat the inputs as project root directories: Discover the Fortran files below the roots, order them by their module dependencies, and write the GPUFORT module files of all files with a pool of processes (see '-j'). Dependency cycles and missing modules are reported first. No other output is created.")
     parser.add_argument("-s","--skip-create-mod-files",dest="skip_create_gpufort_module_files",action="store_true",help="Skip creating GPUFORT modules, e.g. if they already exist. Mutually exclusive with '-c' option.")
     parser.add_argument("-o","--output", help="The output file. Interface module and HIP C++ implementation are named accordingly. GPUFORT module files are created too.", default=sys.stdout, required=False, type=argparse.FileType("w"))
+    parser.add_argument("-j","--jobs",dest="num_processes",default=BATCH_NUM_PROCESSES,type=int,help="Number of processes that translate input files in parallel if multiple input files are specified [default: {}].".format(BATCH_NUM_PROCESSES))
     parser.add_argument("--working-dir",dest="working_dir",default=os.getcwd(),type=str,help="Set working directory.") # shadow arg
     parser.add_argument("-d","--search-dirs", dest="search_dirs", help="Module search dir. Alternative -I<path> can be used (multiple times).", nargs="*",  required=False, default=[], type=str)
     parser.add_argument("-w","--wrap-in-ifdef",dest="wrap_in_ifdef",action="store_true",help="Wrap converted lines into ifdef in host code.")
@@ -181,6 +229,14 @@ def parse_command_line_arguments():
             "Config values can be overriden by providing a config file. A number of config values can be overwritten via this CLI.")
     group_config.add_argument("--config-file",default=None,type=argparse.FileType("r"),dest="config_file",help="Provide a config file.")
     
+    # translation cache
+    group_cache = parser.add_argument_group('Translation cache')
+    group_cache.add_argument("--cache",dest="cache_enable",action="store_true",help="Restore the outputs from the translation cache if the input file, config and used GPUFORT module files have not changed; store them otherwise [default: {}].".format(cache.ENABLED))
+    group_cache.add_argument("--no-cache",dest="cache_disable",action="store_true",help="Do not use the translation cache.")
+    group_cache.add_argument("--cache-dir",dest="cache_dir",default=None,type=str,help="Directory of the translation cache [default: {}].".format(cache.CACHE_DIR))
+    group_cache.add_argument("--cache-stats",dest="print_cache_stats",action="store_true",help="Print statistics of the translation cache.")
+    group_cache.add_argument("--incremental",dest="incremental",action="store_true",help="Keep a snapshot of the linemaps and the scanner tree in the cache directory and only re-normalize and re-scan the regions of the input file that have changed since the last translation with this switch. Requires a single input file.")
+    
     # fort2hip
     group_fort2hip = parser.add_argument_group('Fortran-to-HIP')
     group_fort2hip.add_argument("-m","--only-modify-host-code",dest="only_modify_translation_source",action="store_true",help="Only modify host code; do not generate kernels [default: False].")
@@ -198,9 +254,12 @@ def parse_command_line_arguments():
     group_developer.add_argument("-v","--verbose",dest="verbose",required=False,action="store_true",help="Print all log messages to error output stream too.")
     group_developer.add_argument("--log-level",dest="log_level",required=False,type=str,default="",help="Set log level. Overrides config value.")
     group_developer.add_argument("--log-filter",dest="log_filter",required=False,type=str,default=None,help="Filter the log output according to a regular expression.")
+    group_developer.add_argument("--log-async",dest="log_async",required=False,action="store_true",help="Write the log file from a background thread.")
     group_developer.add_argument("--log-traceback",dest="log_traceback",required=False,action="store_true",help="Append gpufort traceback information to the log when encountering warning/error.")
     group_developer.add_argument("--prof",dest="profiling_enable",required=False,action="store_true",help="Profile gpufort.")
     group_developer.add_argument("--prof-num-functions",dest="profiling_num_functions",required=False,type=int,default=50,help="The number of python functions to include into the summary [default=50].")
+    group_developer.add_argument("--timings",dest="timings_filepath",required=False,type=str,default=None,help="Write wall-clock and CPU time of the pipeline stages and kernels to the given JSON file.")
+    group_developer.add_argument("--trace",dest="trace_filepath",required=False,type=str,default=None,help="Write a timeline of the pipeline stages and kernels of all processes to the given Chrome trace file (chrome://tracing, ui.perfetto.dev).")
     group_developer.add_argument("--create-gpufort-headers",dest="create_gpufort_headers",action="store_true",help="Generate the GPUFORT header files.")
 
     parser.set_defaults(print_config_defaults=False,dump_index=False,\
@@ -208,8 +267,9 @@ def parse_command_line_arguments():
       only_emit_kernels_and_launchers=False,only_emit_kernels=False,only_modify_translation_source=False,\
       emit_cpu_implementation=False,emit_debug_code=False,\
       create_gpufort_headers=False,print_gfortran_config=False,print_cpp_config=False,\
-      only_create_gpufort_module_files=False,skip_create_gpufort_module_files=False,verbose=False,\
-      log_traceback=False,profiling_enable=False)
+      only_create_gpufort_module_files=False,skip_create_gpufort_module_files=False,index_project=False,verbose=False,\
+      log_traceback=False,log_async=False,profiling_enable=False,\
+      cache_enable=False,cache_disable=False,print_cache_stats=False)
     args, unknown_args = parser.parse_known_args()
 
     ## Simple output commands
@@ -230,6 +290,11 @@ def parse_command_line_arguments():
     if args.create_gpufort_headers:
         fort2hip.generate_gpufort_headers(os.getcwd())
         sys.exit()
+    if args.cache_dir != None:
+        cache.CACHE_DIR = os.path.join(args.working_dir,args.cache_dir)
+    if args.print_cache_stats:
+        _intrnl_print_cache_stats()
+        sys.exit()
     if args.print_config_defaults:
         gpufort_python_dir=os.path.dirname(os.path.realpath(__file__))
         options_files = [
@@ -240,12 +305,15 @@ def parse_command_line_arguments():
           "indexer/indexer_options.py.in",
           "indexer/scoper_options.py.in",
           "linemapper/linemapper_options.py.in",
-          "utils/logging_options.py.in"
+          "cache/cache_options.py.in",
+          "server/server_options.py.in",
+          "utils/logging_options.py.in",
+          "utils/prefetch_options.py.in"
         ]
         print("\nCONFIGURABLE GPUFORT OPTIONS (DEFAULT VALUES):")
         for options_file in options_files:
             prefix = options_file.split("/")[1].split("_")[0]
-            prefix = prefix.replace("logging","utils.logging") # hack
+            prefix = prefix.replace("logging","utils.logging").replace("prefetch","utils.prefetch") # hack
             print("\n---- "+prefix+" -----------------------------")
             with open(gpufort_python_dir+"/"+options_file) as f:
                 for line in f.readlines():
@@ -269,6 +337,18 @@ def parse_command_line_arguments():
         msg = "switches '--only-create-mod-files' and '--skip-generate-mod-files' are mutually exclusive."
         print("ERROR: "+msg,file=sys.stderr)
         sys.exit(2)
+    if args.index_project and args.skip_create_gpufort_module_files:
+        msg = "switches '--index-project' and '--skip-create-mod-files' are mutually exclusive."
+        print("ERROR: "+msg,file=sys.stderr)
+        sys.exit(2)
+    if args.index_project and args.incremental:
+        msg = "switches '--index-project' and '--incremental' are mutually exclusive."
+        print("ERROR: "+msg,file=sys.stderr)
+        sys.exit(2)
+    if args.cache_enable and args.cache_disable:
+        msg = "switches '--cache' and '--no-cache' are mutually exclusive."
+        print("ERROR: "+msg,file=sys.stderr)
+        sys.exit(2)
     # mutually exclusive arguments
     if ( int(args.only_emit_kernels_and_launchers) +\
          int(args.only_emit_kernels) +\
@@ -281,14 +361,27 @@ def parse_command_line_arguments():
         msg = "unknown arguments (may be used by registered actions): {}".format(" ".join(unknown_args))
         print("WARNING: "+msg,file=sys.stderr)
     # check if input is set
-    if args.input is None:
+    if not len(args.input):
         msg = "no input file"
         print("ERROR: "+msg,file=sys.stderr)
         sys.exit(2)
-    if args.input[0] != "/":
-        args.input = args.working_dir + "/" + args.input 
-    if not os.path.exists(args.input):
-        msg = "input file '{}' cannot be found".format(args.input)
+    for i,input_filepath in enumerate(args.input):
+        if input_filepath[0] != "/":
+            args.input[i] = args.working_dir + "/" + input_filepath 
+        if not os.path.exists(args.input[i]):
+            msg = "input file '{}' cannot be found".format(args.input[i])
+            print("ERROR: "+msg,file=sys.stderr)
+            sys.exit(2)
+        if args.index_project and not os.path.isdir(args.input[i]):
+            msg = "project root '{}' is not a directory".format(args.input[i])
+            print("ERROR: "+msg,file=sys.stderr)
+            sys.exit(2)
+    if args.num_processes < 1:
+        msg = "number of processes must be at least 1"
+        print("ERROR: "+msg,file=sys.stderr)
+        sys.exit(2)
+    if args.incremental and len(args.input) > 1:
+        msg = "switch '--incremental' requires a single input file"
         print("ERROR: "+msg,file=sys.stderr)
         sys.exit(2)
     ## OVERWRITE CONFIG VALUES
@@ -309,6 +402,11 @@ def parse_command_line_arguments():
         ONLY_EMIT_KERNELS = True
     if args.only_modify_translation_source:
         ONLY_MODIFY_TRANSLATION_SOURCE = True
+    # translation cache
+    if args.cache_enable:
+        cache.ENABLED = True
+    if args.cache_disable:
+        cache.ENABLED = False
     # wrap modified lines in ifdef
     if args.wrap_in_ifdef:
         linemapper.LINE_GROUPING_WRAP_IN_IFDEF = True
@@ -319,8 +417,16 @@ def parse_command_line_arguments():
         utils.logging.VERBOSE = True
     if args.log_traceback:
         utils.logging.TRACEBACK = True
+    if args.log_async:
+        utils.logging.ASYNC = True
     if args.log_filter != None:
         utils.logging.LOG_FILTER = args.log_filter
+    # developer: timings
+    if args.timings_filepath != None:
+        args.timings_filepath = os.path.join(args.working_dir,args.timings_filepath)
+    if args.trace_filepath != None:
+        args.trace_filepath = os.path.join(args.working_dir,args.trace_filepath)
+    utils.timing.ENABLED = args.timings_filepath != None or args.trace_filepath != None
     # developer: profiling:
     if args.profiling_enable:
         PROFILING_ENABLE = True
@@ -331,7 +437,10 @@ def parse_command_line_arguments():
         translator.CUBLAS_VERSION = 2
     return args, unknown_args
 
-def init_logging(input_filepath):
+def init_logging(input_filepath,append=False):
+    """
+    :param bool append: Append to the log file of the input file instead of starting a new one.
+    """
     global LOG_LEVEL
     global LOG_FORMAT
 
@@ -339,7 +448,9 @@ def init_logging(input_filepath):
     logfile_basename = "log-{}.log".format(input_filepath_hash)
    
     log_format   = LOG_FORMAT.replace("%(filename)s",input_filepath)
-    log_filepath = utils.logging.init_logging(logfile_basename,log_format,LOG_LEVEL)
+    log_filepath = utils.logging.init_logging(logfile_basename,log_format,LOG_LEVEL,append)
+    if append:
+        return log_filepath
  
     msg = "input file: {0} (log id: {1})".format(input_filepath,input_filepath_hash)
     utils.logging.log_info(LOG_PREFIX,"init_logging",msg)
@@ -347,7 +458,425 @@ def init_logging(input_filepath):
     utils.logging.log_info(LOG_PREFIX,"init_logging",msg)
     return log_filepath
 
-if __name__ == "__main__":
+def _intrnl_print_cache_stats():
+    stats = cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    print("cache directory: {}".format(stats["cache_dir"]))
+    print("entries:         {}".format(stats["entries"]))
+    print("size:            {:.1f} MiB of {:.1f} MiB ({:.1f}%)".format(
+      stats["size"]/1024**2,stats["max_size"]/1024**2,100.0*stats["size"]/stats["max_size"]))
+    print("hits:            {}".format(stats["hits"]))
+    print("misses:          {}".format(stats["misses"]))
+    print("hit rate:        {:.1f}%".format(100.0*stats["hits"]/lookups if lookups else 0.0))
+    print("stores:          {}".format(stats["stores"]))
+    print("evictions:       {}".format(stats["evictions"]))
+
+def _intrnl_resolved_config_values():
+    """
+    :return: Dict with the current values of all config options (see: --print-config-defaults) 
+             except logging and profiling options.
+    """
+    modules = {"gpufort": sys.modules[__name__], "scanner": scanner, "translator": translator,
+               "fort2hip": fort2hip, "indexer": indexer, "scoper": scoper, "linemapper": linemapper}
+    result = {}
+    for prefix, options_file in __CACHE_KEY_OPTIONS:
+        with open(os.path.join(__GPUFORT_PYTHON_DIR,options_file),"r") as infile:
+            for line in infile.readlines():
+                if line[0:1].isalpha() and line[0].isupper() and "=" in line:
+                    name = line.split("=")[0].strip()
+                    if not name.startswith(("LOG_","PROFILING_")) and hasattr(modules[prefix],name):
+                        result[prefix+"."+name] = getattr(modules[prefix],name)
+    return result
+
+def _intrnl_cache_key(input_filepath,linemaps,defines,args):
+    """
+    :return: Translation cache key for the input file. Covers the linemaps (and thus the expanded statements),
+             the preprocessor definitions, the resolved config values, the GPUFORT sources,
+             and the content of all GPUFORT module files that are consulted via 'used_modules'.
+    """
+    module_filepaths = indexer.find_consulted_gpufort_module_files(linemaps,INCLUDE_DIRS,
+                         skip_defined_modules=not SKIP_CREATE_GPUFORT_MODULE_FILES)
+    module_file_hashes = {}
+    for module_filepath in module_filepaths:
+        with open(module_filepath,"rb") as infile:
+            module_file_hashes[module_filepath] = hashlib.sha256(infile.read()).hexdigest()
+    return cache.make_key({
+      "version":      cache.source_fingerprint(__GPUFORT_PYTHON_DIR),
+      "input":        input_filepath,
+      "linemaps":     hashlib.sha256(orjson.dumps(linemaps,default=linemapper.Linemap.to_dict)).hexdigest(),
+      "defines":      defines,
+      "config":       _intrnl_resolved_config_values(),
+      "args":         {name: getattr(args,name) for name in __CACHE_KEY_ARGS},
+      "module_files": module_file_hashes,
+    })
+
+def _intrnl_restore_or_translate(cache_key,translate,output_filepaths):
+    """
+    Restore the outputs of a translation from the translation cache or
+    run the translation and store the output files that it has written.
+
+    :param str cache_key: Cache key of the translation or None if the cache is disabled.
+    :param translate: Callable without arguments that writes the output files.
+    :param list output_filepaths: Output files that have already been written, e.g. the module files in batch mode.
+                                  Files written by 'translate' are appended.
+    """
+    if cache_key != None:
+        with utils.timing.timed("cache.restore"):
+            if cache.restore(cache_key) != None:
+                return
+    utils.fileutils.record_output_files(output_filepaths)
+    try:
+        translate()
+    finally:
+        utils.fileutils.record_output_files(None)
+    if cache_key != None:
+        with utils.timing.timed("cache.store"):
+            cache.store(cache_key,output_filepaths)
+
+def _intrnl_incremental_context(input_filepath,defines,args):
+    """:return: Key of the options under which the snapshot of an incremental translation can be reused."""
+    return cache.make_key({
+      "version": cache.source_fingerprint(__GPUFORT_PYTHON_DIR),
+      "input":   input_filepath,
+      "defines": defines,
+      "config":  _intrnl_resolved_config_values(),
+      "args":    {name: getattr(args,name) for name in __CACHE_KEY_ARGS},
+    })
+
+def _intrnl_incremental_snapshot_filepath(input_filepath):
+    return os.path.join(cache.CACHE_DIR,"incremental",hashlib.sha1(input_filepath.encode("utf-8")).hexdigest()+".pickle")
+
+def _intrnl_load_incremental_snapshot(input_filepath,context):
+    """:return: The snapshot of the last incremental translation of the input file if it has been created with the same options, or an empty dict."""
+    try:
+        with open(_intrnl_incremental_snapshot_filepath(input_filepath),"rb") as infile:
+            snapshot = pickle.load(infile)
+    except (OSError,pickle.PickleError,EOFError,AttributeError):
+        return {}
+    return snapshot if snapshot["context"] == context else {}
+
+def _intrnl_store_incremental_snapshot(input_filepath,snapshot):
+    """Write the snapshot to a temporary file first so that concurrent translations never read partial files."""
+    filepath = _intrnl_incremental_snapshot_filepath(input_filepath)
+    try:
+        os.makedirs(os.path.dirname(filepath),exist_ok=True)
+        with open(filepath+".{}.tmp".format(os.getpid()),"wb") as outfile:
+            pickle.dump(snapshot,outfile,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(filepath+".{}.tmp".format(os.getpid()),filepath)
+    except OSError:
+        pass
+
+def _intrnl_translate(input_filepath,linemaps,index,args,incremental=None):
+    """
+    Translate a single input file for which the linemaps and the index
+    have already been created.
+    :param dict incremental: Scanner snapshot of the previous translation ('previous'), the linemaps 
+                             reused from it ('reused'), and the fingerprint of the index ('index_fingerprint'),
+                             see: scanner.parse_file_incrementally. The new snapshot is stored as 'snapshot'. 
+                             None if the translation is not incremental.
+    """
+    if not ONLY_CREATE_GPUFORT_MODULE_FILES:
+        # configure fort2hip
+        if ONLY_EMIT_KERNELS_AND_LAUNCHERS:
+            fort2hip.EMIT_KERNEL_LAUNCHER = True
+        if ONLY_EMIT_KERNELS:
+            fort2hip.EMIT_KERNEL_LAUNCHER = False
+        if args.emit_cpu_implementation:
+            fort2hip.EMIT_CPU_IMPLEMENTATION = True
+        if args.emit_debug_code:
+            fort2hip.EMIT_DEBUG_CODE = True
+        with utils.timing.timed("scanner.parse_file",args={"input":input_filepath}):
+            if incremental != None:
+                stree, incremental["snapshot"] = scanner.parse_file_incrementally(linemaps,index,input_filepath,
+                                                   incremental["previous"],incremental["reused"],incremental["index_fingerprint"])
+            else:
+                stree = scanner.parse_file(linemaps,index,input_filepath)    
+ 
+        # extract kernels
+        if "hip" in scanner.DESTINATION_DIALECT: 
+            kernels_to_convert_to_hip = ["*"]
+        else:
+            kernels_to_convert_to_hip = scanner.KERNELS_TO_CONVERT_TO_HIP
+        with utils.timing.timed("fort2hip.generate_hip_files",args={"input":input_filepath}):
+            fortran_module_filepath, main_hip_filepath =\
+              fort2hip.generate_hip_files(stree,index,kernels_to_convert_to_hip,input_filepath,\
+               generate_code=not ONLY_MODIFY_TRANSLATION_SOURCE)
+        # modify original file
+        if fortran_module_filepath != None:
+            preamble = "#include \"{}\"".format(\
+              os.path.basename(fortran_module_filepath))
+        else:
+            preamble = None
+        if not (ONLY_EMIT_KERNELS or ONLY_EMIT_KERNELS_AND_LAUNCHERS):
+            with utils.timing.timed("_intrnl_translate_source",args={"input":input_filepath}):
+                _intrnl_translate_source(input_filepath,stree,linemaps,index,preamble) 
+
+def _intrnl_write_timings(args):
+    """Write the timing events of this process and of all worker processes; called after logging has been shut down."""
+    if args.timings_filepath != None:
+        utils.timing.write_timings(args.timings_filepath)
+    if args.trace_filepath != None:
+        utils.timing.write_trace(args.trace_filepath)
+
+def _intrnl_print_profile(profiler):
+    profiler.disable() 
+    s = io.StringIO()
+    sortby = 'cumulative'
+    stats = pstats.Stats(profiler, stream=s).sort_stats(sortby)
+    stats.print_stats(PROFILING_OUTPUT_NUM_FUNCTIONS)
+    print(s.getvalue())
+
+def _intrnl_shutdown_logging(log_filepath):
+    msg = "log file:   {0} (log level: {1}) ".format(log_filepath,LOG_LEVEL)
+    utils.logging.log_info(LOG_PREFIX,"__main__",msg)
+    utils.logging.shutdown()
+
+def _intrnl_translate_single_file(input_filepath,log_filepath,defines,args):
+    # scanner must be invoked after index creation
+    if PROFILING_ENABLE:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    #
+    indexer.prefetch_used_gpufort_module_files(input_filepath,INCLUDE_DIRS) # while the file is linemapped
+    incremental = None
+    if args.incremental:
+        context  = _intrnl_incremental_context(input_filepath,defines,args)
+        previous = _intrnl_load_incremental_snapshot(input_filepath,context)
+        with utils.timing.timed("linemapper.read_file_incrementally",args={"input":input_filepath}):
+            linemaps, linemapper_snapshot, reused = linemapper.read_file_incrementally(input_filepath,defines,previous.get("linemapper"))
+        incremental = { "previous": previous.get("scanner"), "reused": reused, "index_fingerprint": None, "snapshot": None }
+    else:
+        with utils.timing.timed("linemapper.read_file",args={"input":input_filepath}):
+            linemaps = linemapper.read_file(input_filepath,defines)
+    def translate_():
+        index = create_index(INCLUDE_DIRS,defines,input_filepath,linemaps)
+        if incremental != None:
+            incremental["index_fingerprint"] = indexer.fingerprint_gpufort_module_files(linemaps,INCLUDE_DIRS)
+        _intrnl_translate(input_filepath,linemaps,index,args,incremental)
+    cache_key = None
+    if cache.ENABLED:
+        with utils.timing.timed("_intrnl_cache_key"):
+            cache_key = _intrnl_cache_key(input_filepath,linemaps,defines,args)
+    _intrnl_restore_or_translate(cache_key,translate_,[])
+    if incremental != None: # no scanner snapshot if the outputs have been restored from the translation cache
+        _intrnl_store_incremental_snapshot(input_filepath,{ "context": context, 
+          "linemapper": linemapper_snapshot, "scanner": incremental["snapshot"] })
+    #
+    if PROFILING_ENABLE:
+        _intrnl_print_profile(profiler)
+    _intrnl_shutdown_logging(log_filepath)
+
+# batch mode
+__batch = {} # State of a batch run; inherited by the forked worker processes.
+
+def _intrnl_run_batch_task(task,*task_args):
+    """
+    Run a task in a worker process.
+    :return: Tuple of exit code, the result of the task and the timing events recorded by the task.
+    """
+    utils.timing.clear() # events of the parent process
+    try:
+        return 0, task(*task_args), utils.timing.events()
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code,int):
+            return e.code or 0, None, utils.timing.events()
+        print(e.code,file=sys.stderr)
+        return 1, None, utils.timing.events()
+    except Exception:
+        traceback.print_exc()
+        return 1, None, utils.timing.events()
+    finally:
+        utils.logging.shutdown() # worker processes exit without running exit handlers
+
+def _intrnl_batch_read_file(i):
+    """
+    First batch phase: Read the i-th input file and write its GPUFORT module files.
+    :return: The linemaps of the file and the paths of the written module files.
+    """
+    input_filepath = __batch["input_filepaths"][i]
+    init_logging(input_filepath)
+    with utils.timing.timed("linemapper.read_file",args={"input":input_filepath}):
+        linemaps = linemapper.read_file(input_filepath,__batch["defines"])
+    module_filepaths = []
+    if not SKIP_CREATE_GPUFORT_MODULE_FILES:
+        module_filepaths = _intrnl_write_gpufort_module_files(input_filepath,linemaps)
+    utils.logging.shutdown()
+    return linemaps, module_filepaths
+
+def _intrnl_batch_index_file(i):
+    """
+    Project indexing: Read the i-th input file and write its GPUFORT module files.
+    """
+    input_filepath = __batch["input_filepaths"][i]
+    init_logging(input_filepath)
+    with utils.timing.timed("linemapper.read_file",args={"input":input_filepath}):
+        linemaps = linemapper.read_file(input_filepath,__batch["defines"])
+    _intrnl_write_gpufort_module_files(input_filepath,linemaps)
+    utils.logging.shutdown()
+
+def _intrnl_write_gpufort_module_files(input_filepath,linemaps):
+    """
+    Write the GPUFORT module files of an input file next to the file.
+    :return: The paths of the written module files.
+    """
+    module_filepaths = []
+    with utils.timing.timed("indexer.write_gpufort_module_files",args={"input":input_filepath}):
+        index = []
+        indexer.update_index_from_linemaps(linemaps,index)
+        utils.fileutils.record_output_files(module_filepaths)
+        indexer.write_gpufort_module_files(index,os.path.dirname(input_filepath))
+        utils.fileutils.record_output_files(None)
+    return module_filepaths
+
+def _intrnl_batch_translate_file(i):
+    """
+    Second batch phase: Translate the i-th input file. Appends to the file's log.
+    """
+    input_filepath = __batch["input_filepaths"][i]
+    log_filepath   = init_logging(input_filepath,append=True)
+    if PROFILING_ENABLE:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    linemaps, module_filepaths = __batch["read_files"][i]
+    def translate_():
+        index = scoper.Index()
+        indexer.load_shared_gpufort_module_files(__batch["shared_module_files"],index)
+        _intrnl_translate(input_filepath,linemaps,index,__batch["args"])
+    cache_key = None
+    if cache.ENABLED:
+        with utils.timing.timed("_intrnl_cache_key"):
+            cache_key = _intrnl_cache_key(input_filepath,linemaps,__batch["defines"],__batch["args"])
+    _intrnl_restore_or_translate(cache_key,translate_,module_filepaths)
+    if PROFILING_ENABLE:
+        _intrnl_print_profile(profiler)
+    _intrnl_shutdown_logging(log_filepath)
+
+def _intrnl_run_batch_phase(task,indices,num_processes):
+    """
+    Run the task for the given input file indices in a pool of forked processes.
+    Each worker process translates only a single file so that option changes and logging
+    setup of one file do not affect the next one.
+    :return: Dict that maps the indices to tuples of exit code and result.
+    """
+    context = multiprocessing.get_context("fork")
+    with context.Pool(min(num_processes,len(indices)),maxtasksperchild=1) as pool:
+        results = pool.starmap(_intrnl_run_batch_task,[(task,i) for i in indices],chunksize=1)
+    for _, _, events in results:
+        utils.timing.add_events(events)
+    return dict(zip(indices,[(exit_code,result) for exit_code, result, _ in results]))
+
+def _intrnl_run_with_shared_include_cache(task,*task_args):
+    """Run a task whose worker processes share the normalized include files."""
+    include_cache_dir = None
+    if linemapper.INCLUDE_CACHE_DIR == None:
+        include_cache_dir = tempfile.mkdtemp(prefix="gpufort-includes-")
+        linemapper.INCLUDE_CACHE_DIR = include_cache_dir
+    try:
+        return task(*task_args)
+    finally:
+        if include_cache_dir != None:
+            linemapper.INCLUDE_CACHE_DIR = None
+            shutil.rmtree(include_cache_dir,ignore_errors=True)
+
+def _intrnl_translate_batch(input_filepaths,log_filepath,defines,args):
+    """
+    Translate multiple input files. 
+    The module files of all inputs are written first so that the files can be translated in any order.
+    The module files are mapped into memory only once and shared with the worker processes,
+    which decode the records that they access.
+    :return: Exit code; the first nonzero exit code of a file, or 0.
+    """
+    global __batch
+    
+    msg = "translate {} input files with {} processes".format(len(input_filepaths),args.num_processes)
+    utils.logging.log_info(LOG_PREFIX,"_intrnl_translate_batch",msg)
+    __batch.update(input_filepaths=input_filepaths,defines=defines,args=args)
+    
+    exit_code, results = _intrnl_run_with_shared_include_cache(_intrnl_translate_batch_phases,input_filepaths,args)
+    for i, (file_exit_code, _) in sorted(results.items()):
+        if file_exit_code:
+            msg = "failed to translate '{}' (exit code: {})".format(input_filepaths[i],file_exit_code)
+            utils.logging.log_error(LOG_PREFIX,"_intrnl_translate_batch",msg)
+    __batch.clear()
+    _intrnl_shutdown_logging(log_filepath)
+    return exit_code
+
+def _intrnl_index_project(project_dirs,log_filepath,defines,args):
+    """
+    Write the GPUFORT module files of all Fortran files below the project directories.
+    The files are indexed in waves that follow the module dependency graph;
+    the files of a wave are indexed by a pool of processes.
+    Dependency cycles are errors, missing and multiply defined modules are warnings;
+    both are reported before any file is indexed.
+    :return: Exit code; 2 if there are dependency cycles, else the first nonzero exit code of a file, or 0.
+    """
+    global __batch
+    
+    with utils.timing.timed("indexer.create_module_graph"):
+        input_filepaths = indexer.discover_input_files(project_dirs)
+        graph           = indexer.create_module_graph(input_filepaths,INCLUDE_DIRS)
+        waves, cycles   = indexer.schedule_in_waves(graph["dependencies"])
+    for filepath, module_names in sorted(graph["missing"].items()):
+        msg = "'{}' uses module(s) not found in project or search directories: {}".format(filepath,", ".join(module_names))
+        utils.logging.log_warning(LOG_PREFIX,"_intrnl_index_project",msg)
+    for name, filepaths in sorted(graph["duplicates"].items()):
+        msg = "module '{}' is defined in multiple files: {}".format(name,", ".join(filepaths))
+        utils.logging.log_warning(LOG_PREFIX,"_intrnl_index_project",msg)
+    if len(cycles):
+        for cycle in cycles:
+            msg = "module dependency cycle: {}".format(" -> ".join(cycle))
+            utils.logging.log_error(LOG_PREFIX,"_intrnl_index_project",msg)
+        _intrnl_shutdown_logging(log_filepath)
+        return 2
+    
+    msg = "index {} files in {} waves with {} processes".format(len(input_filepaths),len(waves),args.num_processes)
+    utils.logging.log_info(LOG_PREFIX,"_intrnl_index_project",msg)
+    __batch.update(input_filepaths=input_filepaths,defines=defines,args=args)
+    position = { filepath: i for i,filepath in enumerate(input_filepaths) }
+    def index_waves_():
+        exit_code = 0
+        for wave in waves:
+            results = _intrnl_run_batch_phase(_intrnl_batch_index_file,
+                        [position[filepath] for filepath in wave],args.num_processes)
+            for i, (file_exit_code, _) in sorted(results.items()):
+                if file_exit_code:
+                    msg = "failed to index '{}' (exit code: {})".format(input_filepaths[i],file_exit_code)
+                    utils.logging.log_error(LOG_PREFIX,"_intrnl_index_project",msg)
+                    exit_code = exit_code or file_exit_code
+        return exit_code
+    exit_code = _intrnl_run_with_shared_include_cache(index_waves_)
+    __batch.clear()
+    _intrnl_shutdown_logging(log_filepath)
+    return exit_code
+
+def _intrnl_translate_batch_phases(input_filepaths,args):
+    """
+    Read all input files and write their module files, then translate the files that could be read.
+    :return: Exit code and results of the last phase.
+    """
+    exit_code = 0
+    results   = _intrnl_run_batch_phase(_intrnl_batch_read_file,
+                  list(range(len(input_filepaths))),args.num_processes)
+    __batch["read_files"] = {}
+    for i, (file_exit_code, read_file) in results.items():
+        if file_exit_code:
+            exit_code = exit_code or file_exit_code
+        else:
+            __batch["read_files"][i] = read_file
+    if not ONLY_CREATE_GPUFORT_MODULE_FILES and len(__batch["read_files"]):
+        with utils.timing.timed("indexer.share_gpufort_module_files"):
+            __batch["shared_module_files"] = indexer.share_gpufort_module_files(INCLUDE_DIRS)
+        results = _intrnl_run_batch_phase(_intrnl_batch_translate_file,
+                    sorted(__batch["read_files"].keys()),args.num_processes)
+        for file_exit_code, _ in results.values():
+            exit_code = exit_code or file_exit_code
+    return exit_code, results
+
+def run_gpufort():
+    """
+    Translate the input file(s) as specified by the command line arguments (sys.argv). 
+    """
+    global INCLUDE_DIRS
     # read config and command line arguments
     config_filepath, include_dirs, defines = parse_raw_command_line_arguments()
     if config_filepath != None:
@@ -361,8 +890,8 @@ if __name__ == "__main__":
                 action(args,unknown_args)
 
     # init logging
-    input_filepath = os.path.abspath(args.input)
-    log_filepath   = init_logging(input_filepath)
+    input_filepaths = [os.path.abspath(input_filepath) for input_filepath in args.input]
+    log_filepath    = init_logging(" ".join(input_filepaths))
     
     # Update INCLUDE_DIRS from all sources    
     INCLUDE_DIRS += args.search_dirs
@@ -379,51 +908,46 @@ if __name__ == "__main__":
     if one_or_more_search_dirs_not_found:
         sys.exit(2)
 
-    # scanner must be invoked after index creation
-    if PROFILING_ENABLE:
-        profiler = cProfile.Profile()
-        profiler.enable()
-    #
-    linemaps = linemapper.read_file(input_filepath,defines)
-    index   = create_index(INCLUDE_DIRS,defines,input_filepath,linemaps)
-    if not ONLY_CREATE_GPUFORT_MODULE_FILES:
-        # configure fort2hip
-        if ONLY_EMIT_KERNELS_AND_LAUNCHERS:
-            fort2hip.EMIT_KERNEL_LAUNCHER = True
-        if ONLY_EMIT_KERNELS:
-            fort2hip.EMIT_KERNEL_LAUNCHER = False
-        if args.emit_cpu_implementation:
-            fort2hip.EMIT_CPU_IMPLEMENTATION = True
-        if args.emit_debug_code:
-            fort2hip.EMIT_DEBUG_CODE = True
-        stree   = scanner.parse_file(linemaps,index,input_filepath)    
- 
-        # extract kernels
-        if "hip" in scanner.DESTINATION_DIALECT: 
-            kernels_to_convert_to_hip = ["*"]
-        else:
-            kernels_to_convert_to_hip = scanner.KERNELS_TO_CONVERT_TO_HIP
-        fortran_module_filepath, main_hip_filepath =\
-          fort2hip.generate_hip_files(stree,index,kernels_to_convert_to_hip,input_filepath,\
-           generate_code=not ONLY_MODIFY_TRANSLATION_SOURCE)
-        # modify original file
-        if fortran_module_filepath != None:
-            preamble = "#include \"{}\"".format(\
-              os.path.basename(fortran_module_filepath))
+    try:
+        if args.index_project:
+            exit_code = _intrnl_index_project(input_filepaths,log_filepath,defines,args)
+            if exit_code:
+                sys.exit(exit_code)
+        elif len(input_filepaths) == 1:
+            _intrnl_translate_single_file(input_filepaths[0],log_filepath,defines,args)
         else:
-            preamble = None
-        if not (ONLY_EMIT_KERNELS or ONLY_EMIT_KERNELS_AND_LAUNCHERS):
-            _intrnl_translate_source(input_filepath,stree,linemaps,index,preamble) 
-    #
-    if PROFILING_ENABLE:
-        profiler.disable() 
-        s = io.StringIO()
-        sortby = 'cumulative'
-        stats = pstats.Stats(profiler, stream=s).sort_stats(sortby)
-        stats.print_stats(PROFILING_OUTPUT_NUM_FUNCTIONS)
-        print(s.getvalue())
-
-    # shutdown logging
-    msg = "log file:   {0} (log level: {1}) ".format(log_filepath,LOG_LEVEL)
-    utils.logging.log_info(LOG_PREFIX,"__main__",msg)
-    utils.logging.shutdown()
+            exit_code = _intrnl_translate_batch(input_filepaths,log_filepath,defines,args)
+            if exit_code:
+                sys.exit(exit_code)
+    finally:
+        _intrnl_write_timings(args)
+
+def serve():
+    """
+    Run a translation server that keeps the imported modules and built grammars warm
+    and translates files on behalf of clients (see: server.server).
+    """
+    parser = argparse.ArgumentParser(description="Run a GPUFORT translation server.",prog="gpufort --serve")
+    parser.add_argument("--serve",action="store_true",help="Run as translation server.")
+    parser.add_argument("--socket",dest="socket_path",default=server.SOCKET_PATH,type=str,
+        help="Unix domain socket the server listens on, defaults to: '{}'. Clients read it from the environment variable GPUFORT_SERVER_SOCKET.".format(server.SOCKET_PATH))
+    parser.add_argument("-j","--jobs",dest="max_concurrent_jobs",default=server.MAX_CONCURRENT_JOBS,type=int,
+        help="Maximum number of translation jobs that run at the same time, defaults to: {}".format(server.MAX_CONCURRENT_JOBS))
+    args, _ = parser.parse_known_args()
+    # load everything that would otherwise be loaded on demand by each job
+    for source_dialect in scanner.SUPPORTED_SOURCE_DIALECTS:
+        for destination_dialect in scanner.SUPPORTED_DESTINATION_DIALECTS:
+            scanner.load_dialect(source_dialect,destination_dialect)
+    fort2hip.model.load_templates()
+    def job_():
+        try:
+            run_gpufort()
+        finally:
+            utils.logging.shutdown() # the job's process exits without running exit handlers
+    server.serve(job_,args.socket_path,args.max_concurrent_jobs)
+
+if __name__ == "__main__":
+    if "--serve" in sys.argv:
+        serve()
+    else:
+        run_gpufort()
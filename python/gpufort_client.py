@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
+"""
+Thin client for a running GPUFORT translation server (see: gpufort --serve).
+Takes the same arguments as 'gpufort.py' and forwards them to the server.
+Exits with server.CLIENT_ERROR_CODE_NO_SERVER if no server is listening.
+"""
+import sys
+
+# local imports
+import addtoplevelpath
+import server.server as server
+
+if __name__ == "__main__":
+    exit_code = server.run_client_request(server.SOCKET_PATH,sys.argv[1:])
+    if exit_code == None:
+        exit_code = server.CLIENT_ERROR_CODE_NO_SERVER
+    sys.exit(exit_code)
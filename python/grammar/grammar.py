@@ -1,54 +1,156 @@
-# SPDX-License-Identifier: MIT                                                
+# SPDX-License-Identifier: MIT
 # Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
+"""Process-wide grammar module.
+
+The expression graph of every grammar variant (caseless or case-sensitive)
+is built at most once per process and only when it is requested for the first time.
+Consumers (scanner, indexer, translator) obtain the shared expressions via
+`get_grammar`. As all consumers of a variant share the same expressions,
+consumers do not attach their parse actions directly but register them
+via `set_parse_action`. The expression then only runs the actions of the
+consumer that is currently active (see `active_consumer`).
+"""
 import os, sys
 import re
+import threading
+import contextlib
 
 # third-party modules
 from pyparsing import *
+from pyparsing import _trim_arity
 
 # local modules
 from grammar.cudafor import *
+import utils.codecache
 
-# The module executes the content of this module can set
-# the GRAMMAR_DIR global variable beforehand.
-if not 'GRAMMAR_DIR' in globals():
-    GRAMMAR_DIR = os.path.dirname(os.path.abspath(__file__))
-if not 'CASELESS' in globals():
-    CASELESS = False
-if CASELESS == True:
-    CASELESS_LITERAL = CaselessLiteral
-else:
-    CASELESS_LITERAL = Literal
+GRAMMAR_DIR = os.path.dirname(os.path.abspath(__file__))
 
 # Performance Tips:
 # - try using enablePackrat()
 # - use MatchFirst(|) instead of Or(^)
 ParserElement.setDefaultWhitespaceChars("\r\n\t &;")
-ParserElement.enablePackrat() 
+ParserElement.enablePackrat()
 
 # helper functions
-def makeCaselessLiteral(commaSeparatedList,suppress=False,forceCaseLess=False):
-     if forceCaseLess:
-        result1 = map(CaselessLiteral, commaSeparatedList.split(","))
-     else: # can be overwritten via options
-        result1 = map(CASELESS_LITERAL, commaSeparatedList.split(","))
-     if suppress:
-        result2 = []
-        for element in result1:
-             result2.append(element.suppress())
-        return result2
-     else:
-        return result1
-
 def separatedSequence(tokens,separator=Suppress(",")):
     result = tokens[0]
     for token in tokens[1:]:
          result += separator + token
     return result
 
-exec(open(os.path.join(GRAMMAR_DIR, "grammar_f03.py.in")).read())
-exec(open(os.path.join(GRAMMAR_DIR, "grammar_directives.py.in")).read())
-exec(open(os.path.join(GRAMMAR_DIR, "grammar_cuf.py.in")).read())
-exec(open(os.path.join(GRAMMAR_DIR, "grammar_acc.py.in")).read())
-exec(open(os.path.join(GRAMMAR_DIR, "grammar_gpufort_control.py.in")).read())
-exec(open(os.path.join(GRAMMAR_DIR, "grammar_epilog.py.in")).read())
\ No newline at end of file
+# Everything defined so far is visible to the grammar definitions
+__BASE_NAMESPACE = { key: value for key,value in globals().items() if not key.startswith("__") }
+
+__GRAMMAR_FILES = [
+  "grammar_f03.py.in",
+  "grammar_directives.py.in",
+  "grammar_cuf.py.in",
+  "grammar_acc.py.in",
+  "grammar_gpufort_control.py.in",
+  "grammar_epilog.py.in",
+]
+
+__grammars = {} # caseless (bool) -> namespace (dict)
+
+DEFAULT_CONSUMER = "translator"
+
+__active = threading.local()
+
+def _intrnl_create_make_caseless_literal(caseless_literal):
+    def makeCaselessLiteral(commaSeparatedList,suppress=False,forceCaseLess=False):
+         if forceCaseLess:
+            result1 = map(CaselessLiteral, commaSeparatedList.split(","))
+         else: # can be overwritten via options
+            result1 = map(caseless_literal, commaSeparatedList.split(","))
+         if suppress:
+            result2 = []
+            for element in result1:
+                 result2.append(element.suppress())
+            return result2
+         else:
+            return result1
+    return makeCaselessLiteral
+
+def _intrnl_build_grammar(caseless):
+    namespace = dict(__BASE_NAMESPACE)
+    namespace["CASELESS"]            = caseless
+    namespace["CASELESS_LITERAL"]    = CaselessLiteral if caseless else Literal
+    namespace["makeCaselessLiteral"] = _intrnl_create_make_caseless_literal(namespace["CASELESS_LITERAL"])
+    for filename in __GRAMMAR_FILES:
+        utils.codecache.exec_file(os.path.join(GRAMMAR_DIR,filename),namespace)
+    namespace.pop("__builtins__",None)
+    return namespace
+
+def _intrnl_active_consumer():
+    return getattr(__active,"consumer",DEFAULT_CONSUMER)
+
+def _intrnl_run_parse_actions(expression,actions,s,loc,tokens):
+    """Run the actions like pyparsing runs the parse actions of an expression."""
+    for action in actions:
+        result = action(s,loc,tokens)
+        if result is not None and result is not tokens:
+            tokens = ParseResults(result,expression.resultsName,\
+              asList=expression.saveAsList and isinstance(result,(ParseResults,list)),\
+              modal=expression.modalResults)
+    return tokens
+
+def _intrnl_create_dispatcher(expression,actions):
+    def dispatch_(s,loc,tokens):
+        consumer = _intrnl_active_consumer()
+        if consumer in actions:
+            # actions of a consumer may parse with the default consumer's actions, e.g. 
+            # the scanner may use the translator to analyze a statement
+            with active_consumer(DEFAULT_CONSUMER):
+                return _intrnl_run_parse_actions(expression,actions[consumer],s,loc,tokens)
+        else:
+            return _intrnl_run_parse_actions(expression,actions[None],s,loc,tokens)
+    return dispatch_
+
+# API
+def get_grammar(caseless=False):
+    """
+    :return: The shared namespace (dict) that contains the expressions of the requested grammar variant.
+             The variant is built when it is requested for the first time.
+    :param bool caseless: If keywords should be matched independent of their case.
+    :note: Consumers must register parse actions via `set_parse_action`. 
+    """
+    key = bool(caseless)
+    if key not in __grammars:
+        __grammars[key] = _intrnl_build_grammar(key)
+    return __grammars[key]
+
+def set_parse_action(consumer,expression,*actions):
+    """Register parse actions that the expression runs if the given consumer is active.
+    Actions that have been attached to the expression while building the grammar 
+    are run for consumers that have not registered any action.
+    :param str consumer: Name of the consumer, e.g. 'translator' or 'scanner'.
+    :param expression: A pyparsing expression of a grammar variant.
+    :param actions: Parse actions with any of the signatures that pyparsing supports.
+    :return: The expression.
+    """
+    if not hasattr(expression,"_gpufort_parse_actions"):
+        consumer_actions = { None: list(expression.parseAction) }
+        expression.setParseAction(_intrnl_create_dispatcher(expression,consumer_actions))
+        expression._gpufort_parse_actions = consumer_actions
+    expression._gpufort_parse_actions[consumer] = [_trim_arity(action) for action in actions]
+    return expression
+
+@contextlib.contextmanager
+def active_consumer(consumer):
+    """Make the consumer's parse actions the active ones in the current thread 
+    while the context is entered.
+    :param str consumer: Name of the consumer, e.g. 'translator' or 'scanner'.
+    """
+    previous = _intrnl_active_consumer()
+    __active.consumer = consumer
+    try:
+        yield
+    finally:
+        __active.consumer = previous
+
+def __getattr__(name):
+    """Module attribute access falls back to the (default) case-sensitive grammar."""
+    try:
+        return get_grammar()[name]
+    except KeyError:
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__,name))
@@ -5,25 +5,39 @@ import addtoplevelpath
 import os,sys,subprocess
 import re
 import threading
+import multiprocessing
 import concurrent.futures
+import contextlib
+import hashlib
+import fcntl
+import tempfile
+import mmap
 
 import orjson
+import pyparsing
 
+import grammar.grammar as grammar
 import translator.translator as translator
+import indexer.modfile as modfile
+import linemapper.linemapper as linemapper
+import utils.codecache
 import utils.logging
+import utils.fileutils
+import utils.prefetch
 
 GPUFORT_MODULE_FILE_SUFFIX=".gpufort_mod"
-
-CASELESS    = False
-GRAMMAR_DIR = os.path.join(os.path.dirname(__file__),"../grammar")
-exec(open("{0}/grammar.py".format(GRAMMAR_DIR)).read())
+GPUFORT_MODULE_CATALOG_FILENAME="gpufort_mod.catalog"
+GPUFORT_MODULE_CATALOG_VERSION=1
 
 # configurable parameters
 indexer_dir = os.path.dirname(__file__)
-exec(open("{0}/indexer_options.py.in".format(indexer_dir)).read())
+utils.codecache.exec_file(os.path.join(indexer_dir,"indexer_options.py.in"),globals())
     
 p_filter       = re.compile(FILTER) 
 p_continuation = re.compile(CONTINUATION_FILTER)
+p_use          = re.compile(r"use\b\s*(?:,\s*(?:non_)?intrinsic\s*)?(?:::)?\s*(\w+)")
+p_program_unit = re.compile(r"(?:module|program)\s+(?!procedure\b)(\w+)\s*$")
+p_use_in_file  = re.compile(r"^[ \t]*use\b\s*(?:,\s*(?:non_)?intrinsic\s*)?(?:::)?\s*(\w+)",re.MULTILINE|re.IGNORECASE)
 
 def _intrnl_read_fortran_file(filepath,preproc_options):
     """
@@ -54,18 +68,20 @@ def _intrnl_read_fortran_file(filepath,preproc_options):
        for line in output.split("\n"):
            stripped_statement = line.strip(" \t\n")
            if consider_statement(stripped_statement):
-               utils.logging.log_debug3(LOG_PREFIX,"_intrnl_read_fortran_file","select statement '{}'".format(stripped_statement))
+               utils.logging.log_debug3(LOG_PREFIX,"_intrnl_read_fortran_file","select statement '{}'",stripped_statement)
                filtered_statements.append(stripped_statement)
            else:
-               utils.logging.log_debug3(LOG_PREFIX,"_intrnl_read_fortran_file","ignore statement '{}'".format(stripped_statement))
+               utils.logging.log_debug3(LOG_PREFIX,"_intrnl_read_fortran_file","ignore statement '{}'",stripped_statement)
     except subprocess.CalledProcessError as cpe:
         raise cpe
     
     utils.logging.log_leave_function(LOG_PREFIX,"_intrnl_read_fortran_file")
     return filtered_statements
 
-def _intrnl_collect_statements(linemaps):
+def _intrnl_collect_statements(linemaps,descend_into_includes=False):
     """Filter out relevant statements from linemaps.
+    :param bool descend_into_includes: Also collect the statements of included files,
+                                       like a preprocessor that expands the include directives.
     @see linemapper
     """
     global PREPROCESS_FORTRAN_FILE
@@ -80,15 +96,19 @@ def _intrnl_collect_statements(linemaps):
         return passes_filter
     # filter statements
     filtered_statements = []
-    for linemap in linemaps:
-        if linemap["is_active"]:
-            for stmt in linemap["statements"]:
-                stripped_statement = stmt.lower().strip(" \t\n")
-                if consider_statement(stripped_statement):
-                    utils.logging.log_debug3(LOG_PREFIX,"_intrnl_collect_statements","select statement '{}'".format(stripped_statement))
-                    filtered_statements.append(stripped_statement)
-                else:
-                    utils.logging.log_debug3(LOG_PREFIX,"_intrnl_collect_statements","ignore statement '{}'".format(stripped_statement))
+    def collect_(linemaps):
+        for linemap in linemaps:
+            if linemap.is_active:
+                if descend_into_includes:
+                    collect_(linemap.included_linemaps)
+                for stmt in linemap.statements:
+                    stripped_statement = stmt.lower().strip(" \t\n")
+                    if consider_statement(stripped_statement):
+                        utils.logging.log_debug3(LOG_PREFIX,"_intrnl_collect_statements","select statement '{}'",stripped_statement)
+                        filtered_statements.append(stripped_statement)
+                    else:
+                        utils.logging.log_debug3(LOG_PREFIX,"_intrnl_collect_statements","ignore statement '{}'",stripped_statement)
+    collect_(linemaps)
     
     utils.logging.log_leave_function(LOG_PREFIX,"_intrnl_collect_statements")
     return filtered_statements
@@ -103,56 +123,80 @@ class __Node():
         return "{}: {}".format(self._name,self._data)
     __repr__ = __str__
 
-def _intrnl_parse_statements(file_statements,filepath):
+def _intrnl_parse_declarations(declarations):
+    """
+    Parse a chunk of variable declarations; run by the worker processes.
+    :return: A list of index records per declaration.
+    """
+    global LOG_PREFIX
+    result = []
+    for input_text in declarations:
+        utils.logging.log_debug3(LOG_PREFIX,"_intrnl_parse_declarations","[pid={}] begin to parse variable declaration '{}'",os.getpid(),input_text)
+        try:
+            ttdeclaration = translator.parse_declaration(input_text)
+            result.append(translator.create_index_records_from_declaration(ttdeclaration))
+        except Exception as e:
+            utils.logging.log_exception(LOG_PREFIX,"_intrnl_parse_declarations","failed: "+str(e))
+            sys.exit(2)
+    return result
+
+def _intrnl_parse_declarations_in_chunks(declarations):
+    """
+    Parse the variable declarations; in chunks on a process pool 
+    if there is more than one chunk and more than one worker.
+    Daemonic processes, e.g. the worker processes of a batch run, cannot have
+    child processes and parse the declarations themselves.
+    :return: A list of index records per declaration, in the order of the declarations.
+    """
     global PARSE_VARIABLE_DECLARATIONS_WORKER_POOL_SIZE
+    global PARSE_VARIABLE_DECLARATIONS_CHUNK_SIZE
+    chunk_size = max(1,PARSE_VARIABLE_DECLARATIONS_CHUNK_SIZE)
+    if PARSE_VARIABLE_DECLARATIONS_WORKER_POOL_SIZE < 2 or len(declarations) <= chunk_size or\
+       multiprocessing.current_process().daemon:
+        return _intrnl_parse_declarations(declarations)
+    chunks = [declarations[i:i+chunk_size] for i in range(0,len(declarations),chunk_size)]
+    utils.logging.log_debug1(LOG_PREFIX,"_intrnl_parse_declarations_in_chunks","submit {} chunks of variable declarations to process pool of size {}",\
+      len(chunks),PARSE_VARIABLE_DECLARATIONS_WORKER_POOL_SIZE)
+    result = []
+    with concurrent.futures.ProcessPoolExecutor(\
+        max_workers=min(len(chunks),PARSE_VARIABLE_DECLARATIONS_WORKER_POOL_SIZE)) as task_executor:
+        for records_per_declaration in task_executor.map(_intrnl_parse_declarations,chunks):
+            result += records_per_declaration
+    return result
+
+def _intrnl_parse_statements(file_statements,filepath):
     global PARSE_VARIABLE_MODIFICATION_STATEMENTS_WORKER_POOL_SIZE 
 
     utils.logging.log_enter_function(LOG_PREFIX,"_intrnl_parse_statements",{"filepath":filepath})
+    # The case-sensitive grammar is built on first use;
+    # parse actions are attached to private copies of its expressions
+    expressions = grammar.get_grammar(caseless=False)
+    module_start     = expressions["module_start"].copy()
+    type_start       = expressions["type_start"].copy()
+    program_start    = expressions["program_start"].copy()
+    function_start   = expressions["function_start"].copy()
+    subroutine_start = expressions["subroutine_start"].copy()
+    type_end         = expressions["type_end"].copy()
+    structure_end    = expressions["structure_end"].copy()
+    use              = expressions["use"].copy()
+    attributes       = expressions["attributes"].copy()
     # Regex
-    datatype_reg = Regex(r"\b(type\s*\(|character|integer|logical|real|complex|double\s+precision)\b")
+    datatype_reg = pyparsing.Regex(r"\b(type\s*\(|character|integer|logical|real|complex|double\s+precision)\b")
 
     index = []
 
     access_lock   = threading.Lock()
-    utils.logging.log_debug(LOG_PREFIX,"_intrnl_parse_statements","create thread pool of size {} for process variable declarations".format(\
-      PARSE_VARIABLE_DECLARATIONS_WORKER_POOL_SIZE))
-    task_executor = concurrent.futures.ThreadPoolExecutor(\
-      max_workers=PARSE_VARIABLE_DECLARATIONS_WORKER_POOL_SIZE)
-    # statistics
-    total_num_tasks = 0
+    declarations  = [] # (parent_node,statement), parsed after the file was parsed statement by statement
  
     def log_enter_job_or_task_(parent_node,msg):
-        utils.logging.log_debug3(LOG_PREFIX,"_intrnl_parse_statements","[thread-id={3}][parent-node={0}:{1}] {2}".format(\
+        utils.logging.log_debug3(LOG_PREFIX,"_intrnl_parse_statements","[thread-id={3}][parent-node={0}:{1}] {2}",\
               parent_node._kind, parent_node._name, msg,\
-              threading.get_ident()))
+              threading.get_ident())
         
     def log_leave_job_or_task_(parent_node,msg):
-        utils.logging.log_debug2(LOG_PREFIX+"_intrnl_parse_statements","[thread-id={3}][parent-node={0}:{1}] {2}".format(\
+        utils.logging.log_debug2(LOG_PREFIX+"_intrnl_parse_statements","[thread-id={3}][parent-node={0}:{1}] {2}",\
               parent_node._kind, parent_node._name, msg,\
-              threading.get_ident()))
-    
-    def ParseDeclarationTask_(parent_node,input_text):
-        """
-        :note: the term 'task' should highlight that this is a function
-        that is directly submitted to a thread in the worker pool.
-        """
-        global LOG_PREFIX
-        nonlocal access_lock
-        msg = "begin to parse variable declaration '{}'".format(input_text)
-        log_enter_job_or_task_(parent_node, msg)
-        #
-        try:
-            ttdeclaration = translator.parse_declaration(input_text)
-            variables = translator.create_index_records_from_declaration(ttdeclaration)
-        except Exception as e:
-            utils.logging.log_exception(LOG_PREFIX,"_intrnl_parse_statements.ParseDeclarationTask_","failed: "+str(e))
-            sys.exit(2)
-        access_lock.acquire()
-        parent_node._data["variables"] += variables
-        access_lock.release()
-        #
-        msg = "parsed variable declaration '{}'".format(input_text)
-        log_leave_job_or_task_(parent_node, msg)
+              threading.get_ident())
     
     post_parsing_jobs = [] # jobs to run after the file was parsed statement by statement
     class ParseAttributesJob_:
@@ -234,21 +278,21 @@ def _intrnl_parse_statements(file_statements,filepath):
     def log_enter_node_():
         nonlocal current_node
         nonlocal current_statement
-        utils.logging.log_debug(LOG_PREFIX,"_intrnl_parse_statements","[current-node={0}:{1}] enter {2} '{3}' in statement: '{4}'".format(\
+        utils.logging.log_debug1(LOG_PREFIX,"_intrnl_parse_statements","[current-node={0}:{1}] enter {2} '{3}' in statement: '{4}'",\
           current_node._parent._kind,current_node._parent._name,
           current_node._kind,current_node._name,\
-          current_statement))
+          current_statement)
     def log_leave_node_():
         nonlocal current_node
         nonlocal current_statement
-        utils.logging.log_debug(LOG_PREFIX,"_intrnl_parse_statements","[current-node={0}:{1}] leave {0} '{1}' in statement: '{2}'".format(\
+        utils.logging.log_debug1(LOG_PREFIX,"_intrnl_parse_statements","[current-node={0}:{1}] leave {0} '{1}' in statement: '{2}'",\
           current_node._data["kind"],current_node._data["name"],\
-          current_statement))
+          current_statement)
     def log_detection_(kind):
         nonlocal current_node
         nonlocal current_statement
-        utils.logging.log_debug2(LOG_PREFIX,"_intrnl_parse_statements","[current-node={}:{}] found {} in statement: '{}'".format(\
-                current_node._kind,current_node._name,kind,current_statement))
+        utils.logging.log_debug2(LOG_PREFIX,"_intrnl_parse_statements","[current-node={}:{}] found {} in statement: '{}'",\
+                current_node._kind,current_node._name,kind,current_statement)
    
     # direct parsing
     def End():
@@ -356,13 +400,10 @@ def _intrnl_parse_statements(file_statements,filepath):
         nonlocal root
         nonlocal current_node
         nonlocal current_statement
-        nonlocal task_executor
-        nonlocal total_num_tasks
         #print(current_statement)
         log_detection_("declaration")
         if current_node != root:
-            total_num_tasks += 1
-            task_executor.submit(ParseDeclarationTask_,current_node,current_statement) 
+            declarations.append((current_node,current_statement))
     def Attributes(tokens):
         """
         Add attributes to previously declared variables in same scope/declaration list.
@@ -387,6 +428,7 @@ def _intrnl_parse_statements(file_statements,filepath):
         nonlocal current_statement
         log_detection_("acc declare directive")
         if current_node != root:
+            translator.load_dialect("acc") # before the job is run by a worker thread
             job = ParseAccDeclareJob_(current_node,current_statement) 
             post_parsing_jobs.append(job)
     
@@ -401,6 +443,7 @@ def _intrnl_parse_statements(file_statements,filepath):
         nonlocal current_statement
         log_detection_("acc routine directive")
         if current_node != root:
+            translator.load_dialect("acc")
             parse_result = translator.acc_routine.parseString(current_statement)[0]
             if parse_result.parallelism() == "seq":
                 current_node._data["attributes"] += ["host","device"]
@@ -428,9 +471,9 @@ def _intrnl_parse_statements(file_statements,filepath):
         try:
            expression.parseString(current_statement)
            return True
-        except ParseBaseException as e: 
-           utils.logging.log_debug3(LOG_PREFIX,"_intrnl_parse_statements","did not find expression '{}' in statement '{}'".format(expression_name,current_statement))
-           utils.logging.log_debug4(LOG_PREFIX,"_intrnl_parse_statements",str(e))
+        except pyparsing.ParseBaseException as e: 
+           utils.logging.log_debug3(LOG_PREFIX,"_intrnl_parse_statements","did not find expression '{}' in statement '{}'",expression_name,current_statement)
+           utils.logging.log_debug4(LOG_PREFIX,"_intrnl_parse_statements","{}",e)
            return False
 
     def is_end_statement_(tokens,kind):
@@ -440,7 +483,7 @@ def _intrnl_parse_statements(file_statements,filepath):
         return result
 
     for current_statement in file_statements:
-        utils.logging.log_debug3(LOG_PREFIX,"_intrnl_parse_statements","process statement '{}'".format(current_statement))
+        utils.logging.log_debug3(LOG_PREFIX,"_intrnl_parse_statements","process statement '{}'",current_statement)
         current_tokens              = re.split(r"\s+|\t+",current_statement.lower().strip(" \t"))
         current_statement_stripped  = "".join(current_tokens)
         for expr in ["program","module","subroutine","function","type"]:
@@ -475,13 +518,18 @@ def _intrnl_parse_statements(file_statements,filepath):
                break
         #try_to_parse_string("declaration|type_start|use|attributes|module_start|program_start|function_start|subroutine_start",\
         #  datatype_reg|type_start|use|attributes|module_start|program_start|function_start|subroutine_start)
-    task_executor.shutdown(wait=True) # waits till all tasks have been completed
+
+    # parse variable declarations and add the variables to their scopes in declaration order
+    records_per_declaration = _intrnl_parse_declarations_in_chunks([statement for _,statement in declarations])
+    for (parent_node,_), variables in zip(declarations,records_per_declaration):
+        parent_node._data["variables"] += variables
+    declarations.clear()
 
     # apply attributes and acc variable modifications
     num_post_parsing_jobs = len(post_parsing_jobs)
     if num_post_parsing_jobs > 0:
-        utils.logging.log_debug(LOG_PREFIX,"_intrnl_parse_statements","apply variable modifications (submit {} jobs to worker pool of size {})".format(\
-          num_post_parsing_jobs,PARSE_VARIABLE_MODIFICATION_STATEMENTS_WORKER_POOL_SIZE))
+        utils.logging.log_debug1(LOG_PREFIX,"_intrnl_parse_statements","apply variable modifications (submit {} jobs to worker pool of size {})",\
+          num_post_parsing_jobs,PARSE_VARIABLE_MODIFICATION_STATEMENTS_WORKER_POOL_SIZE)
         with concurrent.futures.ThreadPoolExecutor(\
             max_workers=PARSE_VARIABLE_MODIFICATION_STATEMENTS_WORKER_POOL_SIZE)\
                 as job_executor:
@@ -498,33 +546,344 @@ def _intrnl_write_json_file(index,filepath):
     global LOG_PREFIX    
     utils.logging.log_enter_function(LOG_PREFIX,"_intrnl_write_json_file",{"filepath":filepath}) 
     
-    with open(filepath,"wb") as outfile:
-         if PRETTY_PRINT_INDEX_FILE:
-             outfile.write(orjson.dumps(index,option=orjson.OPT_INDENT_2))
-         else:
-             outfile.write(orjson.dumps(index))
+    utils.fileutils.prepare_output_file(filepath)
+    if PRETTY_PRINT_INDEX_FILE:
+        content = orjson.dumps(index,option=orjson.OPT_INDENT_2)
+    else:
+        content = orjson.dumps(index)
+    utils.fileutils.write_output_file(filepath,content)
     
     utils.logging.log_leave_function(LOG_PREFIX,"_intrnl_write_json_file") 
+    return content
 
-def _intrnl_read_json_file(filepath):
+def _intrnl_write_module_file(record,filepath):
+    """:return: The written content."""
+    global MODULE_FILE_FORMAT
     global LOG_PREFIX    
-    utils.logging.log_enter_function(LOG_PREFIX,"_intrnl_read_json_file",{"filepath":filepath}) 
-    
+    if MODULE_FILE_FORMAT == "json":
+        return _intrnl_write_json_file(record,filepath)
+    elif MODULE_FILE_FORMAT == "binary":
+        utils.logging.log_enter_function(LOG_PREFIX,"_intrnl_write_module_file",{"filepath":filepath}) 
+        
+        utils.fileutils.prepare_output_file(filepath)
+        content = modfile.dumps(record)
+        utils.fileutils.write_output_file(filepath,content)
+        
+        utils.logging.log_leave_function(LOG_PREFIX,"_intrnl_write_module_file") 
+        return content
+    else:
+        msg = "unknown module file format '{}'; expected one of: binary, json".format(MODULE_FILE_FORMAT)
+        utils.logging.log_error(LOG_PREFIX,"_intrnl_write_module_file",msg)
+        sys.exit(2)
+
+def _intrnl_collect_used_module_names(record,result):
+    """Collect the names of the modules used by an index record and its subprograms."""
+    for used_module in record.get("used_modules",[]):
+        result.add(used_module["name"].lower())
+    for subprogram in record.get("subprograms",[]):
+        _intrnl_collect_used_module_names(subprogram,result)
+
+def _intrnl_load_module_file(filepath):
+    """:return: The record of a binary (see: indexer.modfile) or JSON module file."""
     with open(filepath,"rb") as infile:
-         utils.logging.log_leave_function(LOG_PREFIX,"_intrnl_read_json_file") 
-         return orjson.loads(infile.read())
+         content = infile.read()
+    if modfile.is_binary(content):
+        return modfile.loads(content)
+    return orjson.loads(content)
+
+def _intrnl_load_binary_module_file(filepath):
+    """:return: The content of a module file in the binary format; JSON module files are converted."""
+    with open(filepath,"rb") as infile:
+         content = infile.read()
+    if modfile.is_binary(content):
+        return content
+    return modfile.dumps(orjson.loads(content))
+
+def _intrnl_read_module_file(filepath):
+    global LOG_PREFIX    
+    utils.logging.log_enter_function(LOG_PREFIX,"_intrnl_read_module_file",{"filepath":filepath}) 
+    
+    result = utils.prefetch.read(filepath,_intrnl_load_module_file)
+    utils.logging.log_leave_function(LOG_PREFIX,"_intrnl_read_module_file") 
+    return result
+
+def _intrnl_prefetch_used_gpufort_module_files(filepath,search_dirs):
+    with open(filepath,"r") as infile:
+        module_names = set(name.lower() for name in p_use_in_file.findall(infile.read()))
+    prefetch_gpufort_module_files(search_dirs,module_names)
+
+def _intrnl_create_catalog_entry(filepath,content,record,stat=None):
+    """
+    :return: Catalog entry of a module file: file name, size, modification time and SHA-256 hash,
+             plus the kind of the record and the modules used by it and its subprograms, so that
+             the modules reachable from a file can be determined without opening module files.
+    """
+    if stat == None:
+        stat = os.stat(filepath)
+    used_modules = set()
+    _intrnl_collect_used_module_names(record,used_modules)
+    return { "file": os.path.basename(filepath), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+             "sha256": hashlib.sha256(content).hexdigest(), "kind": record["kind"], "used_modules": sorted(used_modules) }
+
+def _intrnl_read_catalog_file(search_dir):
+    """:return: Dict that maps module names to catalog entries; empty if there is no valid catalog file."""
+    try:
+        with open(os.path.join(search_dir,GPUFORT_MODULE_CATALOG_FILENAME),"rb") as infile:
+            catalog = orjson.loads(infile.read())
+        if catalog.get("version") == GPUFORT_MODULE_CATALOG_VERSION:
+            return catalog["modules"]
+    except (OSError,ValueError,KeyError,AttributeError):
+        pass
+    return {}
+
+def _intrnl_write_catalog_file(search_dir,modules):
+    catalog_filepath = os.path.join(search_dir,GPUFORT_MODULE_CATALOG_FILENAME)
+    tmp_filepath     = "{}.{}.{}.tmp".format(catalog_filepath,os.getpid(),threading.get_ident())
+    with open(tmp_filepath,"wb") as outfile:
+        outfile.write(orjson.dumps({ "version": GPUFORT_MODULE_CATALOG_VERSION, "modules": modules },option=orjson.OPT_SORT_KEYS))
+    os.replace(tmp_filepath,catalog_filepath)
+
+@contextlib.contextmanager
+def _intrnl_locked_catalog(search_dir):
+    """Yields the catalog of the directory, which can be modified in-place, while holding the catalog lock."""
+    dir_fd = os.open(search_dir,os.O_RDONLY) # lock the directory; no extra lock file
+    try:
+        fcntl.flock(dir_fd,fcntl.LOCK_EX)
+        modules = _intrnl_read_catalog_file(search_dir)
+        yield modules
+        _intrnl_write_catalog_file(search_dir,modules)
+    finally:
+        os.close(dir_fd) # releases the lock
+
+def _intrnl_validated_catalog(search_dir):
+    """
+    :return: Dict that maps the names of the modules in the search directory to their catalog entries.
+    :note: Entries of module files whose size or modification time have changed, e.g. because
+           they were written by other tools, are recreated and stored back if the directory is writable.
+           Module files that cannot be read or decoded are skipped and get no entry.
+    """
+    global LOG_PREFIX
+    try:
+        children = sorted((entry for entry in os.scandir(search_dir)\
+                     if entry.name.endswith(GPUFORT_MODULE_FILE_SUFFIX)),key=lambda entry: entry.name)
+    except OSError:
+        return {}
+    catalog  = _intrnl_read_catalog_file(search_dir)
+    modules  = {}
+    outdated = {}
+    for child in children:
+        name  = child.name[:-len(GPUFORT_MODULE_FILE_SUFFIX)]
+        stat  = child.stat()
+        entry = catalog.get(name)
+        if entry != None and entry["file"] == child.name and\
+           entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            modules[name] = entry
+        else:
+            try:
+                with open(child.path,"rb") as infile:
+                    content = infile.read()
+                record = modfile.loads(content) if modfile.is_binary(content) else orjson.loads(content)
+                modules[name] = outdated[name] = _intrnl_create_catalog_entry(child.path,content,record,stat)
+            except (OSError,ValueError,EOFError,TypeError,KeyError,IndexError,AttributeError) as e:
+                utils.logging.log_warning(LOG_PREFIX,"_intrnl_validated_catalog","skip module file '{}' that cannot be decoded: {}".format(child.path,e))
+    if len(outdated) or len(modules) != len(catalog):
+        utils.logging.log_debug1(LOG_PREFIX,"_intrnl_validated_catalog","update catalog of '{}' ({} outdated entries)",search_dir,len(outdated))
+        try:
+            with _intrnl_locked_catalog(search_dir) as locked_modules:
+                locked_modules.update(outdated)
+                for name in [name for name in locked_modules if name not in modules]:
+                    del locked_modules[name]
+        except OSError:
+            pass # e.g. read-only directory
+    return modules
+
+def _intrnl_available_module_files(search_dirs):
+    """
+    :return: Dict that maps module names to the path and catalog entry of their module file.
+             If a module file exists in multiple search directories, the first one is taken.
+    """
+    available = {}
+    for search_dir in search_dirs:
+        for name, entry in sorted(_intrnl_validated_catalog(search_dir).items()):
+            if name not in available:
+                available[name] = (os.path.join(search_dir,entry["file"]),entry)
+    return available
+
+def _intrnl_module_closure(available,module_names,visited=set()):
+    """
+    :return: Paths of the module files of the given modules and the modules they use, directly or 
+             indirectly, in breadth-first order, followed by the files of all top-level subprograms.
+    """
+    result  = []
+    visited = set(visited)
+    pending = sorted(set(module_names) - visited)
+    while len(pending):
+        name = pending.pop(0)
+        if name not in visited and name in available:
+            visited.add(name)
+            filepath, entry = available[name]
+            result.append(filepath)
+            pending += [used_name for used_name in entry["used_modules"] if used_name not in visited]
+    for name in sorted(set(available.keys()) - visited):
+        filepath, entry = available[name]
+        if entry["kind"] in ["subroutine","function"]:
+            result.append(filepath)
+    return result
+
+def _intrnl_consulted_module_files(linemaps,available,skip_defined_modules):
+    """:return: Paths of the available module files that are consulted when translating the linemaps (see: find_consulted_gpufort_module_files)."""
+    defined_modules = set()
+    used_modules    = set()
+    def collect_(linemaps):
+        for linemap in linemaps:
+            if linemap.is_active:
+                for stmt in linemap.statements:
+                    stripped_statement = stmt.lower().strip(" \t\n")
+                    for pattern, names in [(p_use,used_modules),(p_program_unit,defined_modules)]:
+                        result = pattern.match(stripped_statement)
+                        if result != None:
+                            names.add(result.group(1))
+            collect_(linemap.included_linemaps)
+    collect_(linemaps)
+    if skip_defined_modules:
+        return _intrnl_module_closure(available,used_modules,visited=defined_modules)
+    else:
+        return _intrnl_module_closure(available,used_modules|defined_modules)
+
+def _intrnl_prescan_file(filepath):
+    """
+    Cheap scan of a raw Fortran file for module definitions and use statements.
+    The file is not preprocessed; statements spanning multiple lines are not joined.
+    :return: Tuple of the sets of defined and used module names.
+    """
+    defined_modules = set()
+    used_modules    = set()
+    with open(filepath,"r",errors="replace") as infile:
+        for line in infile:
+            stripped_line = line.split("!",1)[0].lower().strip(" \t\n;&")
+            result = p_use.match(stripped_line)
+            if result != None:
+                used_modules.add(result.group(1))
+            elif stripped_line.startswith("module"):
+                result = p_program_unit.match(stripped_line)
+                if result != None:
+                    defined_modules.add(result.group(1))
+    return defined_modules, used_modules - defined_modules
+
+def _intrnl_find_cycle(filepath,dependencies,remaining):
+    """:return: A dependency cycle among the remaining files that is reachable from 'filepath'."""
+    path = []
+    while filepath not in path:
+        path.append(filepath)
+        filepath = next(dependency for dependency in dependencies[filepath] if dependency in remaining)
+    return path[path.index(filepath):] + [filepath]
 
 # API
+def discover_input_files(search_dirs):
+    """
+    Find the Fortran files in the search directories and their subdirectories (see: DISCOVER_INPUT_FILES).
+    
+    :param list search_dirs: [in] List of search directories (as strings).
+    :return: Sorted list of the absolute paths of the found files.
+    """
+    global DISCOVER_INPUT_FILES
+    global LOG_PREFIX
+    utils.logging.log_enter_function(LOG_PREFIX,"discover_input_files",{"search_dirs":",".join(search_dirs)})
+    
+    result = set()
+    for search_dir in search_dirs:
+        command = DISCOVER_INPUT_FILES.format(search_dir=search_dir)
+        output  = subprocess.run(command,shell=True,stdout=subprocess.PIPE,check=False).stdout.decode("UTF-8")
+        result.update(os.path.abspath(line) for line in output.split("\n") if len(line))
+    
+    utils.logging.log_leave_function(LOG_PREFIX,"discover_input_files")
+    return sorted(result)
+
+def create_module_graph(input_filepaths,search_dirs=[]):
+    """
+    Create the module dependency graph of a project from a prescan of the raw input files.
+    
+    :param list input_filepaths: [in] Fortran files of the project.
+    :param list search_dirs:     [in] Directories with GPUFORT module files of modules that are not defined by the project.
+    :return: Dict with the entries 'modules' (module name -> defining file), 
+             'dependencies' (file -> sorted list of the files that define the modules it uses),
+             'missing' (file -> sorted list of used modules that are neither defined by the project,
+             nor available as GPUFORT module file nor listed in IGNORED_MODULES),
+             and 'duplicates' (module name -> all files that define the module). 
+    """
+    global IGNORED_MODULES
+    global LOG_PREFIX
+    utils.logging.log_enter_function(LOG_PREFIX,"create_module_graph")
+    
+    available = set(IGNORED_MODULES) | set(_intrnl_available_module_files(search_dirs).keys())
+    prescans = dict(zip(input_filepaths,map(_intrnl_prescan_file,input_filepaths)))
+    modules    = {}
+    duplicates = {}
+    for filepath in input_filepaths:
+        for name in sorted(prescans[filepath][0]):
+            if name in modules:
+                duplicates.setdefault(name,[modules[name]]).append(filepath)
+            else:
+                modules[name] = filepath
+    dependencies = {}
+    missing      = {}
+    for filepath in input_filepaths:
+        used_modules = prescans[filepath][1]
+        dependencies[filepath] = sorted(set(modules[name] for name in used_modules if name in modules) - {filepath})
+        missing_modules = sorted(name for name in used_modules if name not in modules and name not in available)
+        if len(missing_modules):
+            missing[filepath] = missing_modules
+    
+    utils.logging.log_leave_function(LOG_PREFIX,"create_module_graph")
+    return { "modules": modules, "dependencies": dependencies, "missing": missing, "duplicates": duplicates }
+
+def schedule_in_waves(dependencies):
+    """
+    Order the files of a module dependency graph in waves. The files of a wave
+    only depend on files of previous waves and can be processed in parallel.
+    
+    :param dict dependencies: [in] Maps each file to the files it depends on (see: create_module_graph).
+    :return: Tuple of the list of waves (sorted lists of files) and the list of dependency cycles,
+             each given as list of files whose first and last entry are the same.
+             Files that are part of or depend on a cycle are not scheduled.
+    """
+    waves     = []
+    remaining = set(dependencies.keys())
+    while len(remaining):
+        wave = sorted(filepath for filepath in remaining\
+                 if not any(dependency in remaining for dependency in dependencies[filepath]))
+        if not len(wave):
+            break
+        waves.append(wave)
+        remaining.difference_update(wave)
+    cycles = []
+    on_cycle = set()
+    for filepath in sorted(remaining):
+        cycle = _intrnl_find_cycle(filepath,dependencies,remaining)
+        if not on_cycle.intersection(cycle):
+            cycles.append(cycle)
+            on_cycle.update(cycle)
+    return waves, cycles
+
 def scan_file(filepath,preproc_options,index):
     """
     Creates an index from a single file.
+    The file is preprocessed in-process by the linemapper unless
+    USE_EXTERNAL_PREPROCESSOR is set, in which case PREPROCESS_FORTRAN_FILE is run.
+    
+    :param str preproc_options: Preprocessor options, e.g. '-DCUDA -DN=10'.
     """
     global LOG_PREFIX
+    global USE_EXTERNAL_PREPROCESSOR
     utils.logging.log_enter_function(LOG_PREFIX,"scan_file",{"filepath":filepath,"preproc_options":preproc_options}) 
     
-    filtered_statements = _intrnl_read_fortran_file(filepath,preproc_options)
-    utils.logging.log_debug2(LOG_PREFIX,"scan_file","extracted the following statements:\n>>>\n{}\n<<<".format(\
-        "\n".join(filtered_statements)))
+    if USE_EXTERNAL_PREPROCESSOR:
+        filtered_statements = _intrnl_read_fortran_file(filepath,preproc_options)
+    else:
+        linemaps = linemapper.read_file(filepath,preproc_options)
+        filtered_statements = _intrnl_collect_statements(linemaps,descend_into_includes=True)
+    if utils.logging.debug_level_enabled(2):
+        utils.logging.log_debug2(LOG_PREFIX,"scan_file","extracted the following statements:\n>>>\n{}\n<<<","\n".join(filtered_statements))
     index += _intrnl_parse_statements(filtered_statements,filepath)
     
     utils.logging.log_leave_function(LOG_PREFIX,"scan_file") 
@@ -535,10 +894,10 @@ def update_index_from_linemaps(linemaps,index):
     utils.logging.log_enter_function(LOG_PREFIX,"update_index_from_linemaps") 
     
     filtered_statements = _intrnl_collect_statements(linemaps)
-    utils.logging.log_debug2(LOG_PREFIX,"update_index_from_linemaps","extracted the following statements:\n>>>\n{}\n<<<".format(\
-        "\n".join(filtered_statements)))
+    if utils.logging.debug_level_enabled(2):
+        utils.logging.log_debug2(LOG_PREFIX,"update_index_from_linemaps","extracted the following statements:\n>>>\n{}\n<<<","\n".join(filtered_statements))
     if len(linemaps):
-        index += _intrnl_parse_statements(filtered_statements,filepath=linemaps[0]["file"])
+        index += _intrnl_parse_statements(filtered_statements,filepath=linemaps[0].file)
     
     utils.logging.log_leave_function(LOG_PREFIX,"update_index_from_linemaps") 
 
@@ -553,32 +912,163 @@ def write_gpufort_module_files(index,output_dir):
     global LOG_PREFIX
     utils.logging.log_enter_function(LOG_PREFIX,"write_gpufort_module_files",{"output_dir":output_dir})
     
+    entries = {}
     for mod in index:
         filepath = output_dir + "/" + mod["name"] + GPUFORT_MODULE_FILE_SUFFIX
-        _intrnl_write_json_file(mod,filepath)
+        content  = _intrnl_write_module_file(mod,filepath)
+        entries[mod["name"]] = _intrnl_create_catalog_entry(filepath,content,mod)
+    if len(entries):
+        with _intrnl_locked_catalog(output_dir) as modules:
+            modules.update(entries)
     
     utils.logging.log_leave_function(LOG_PREFIX,"write_gpufort_module_files")
 
-def load_gpufort_module_files(input_dirs,index):
+def export_gpufort_module_file(filepath,json_filepath):
+    """
+    Write a GPUFORT module file, binary or JSON, as JSON file, e.g. for debugging.
+    Considers PRETTY_PRINT_INDEX_FILE.
+    
+    :param str filepath:      [in] Path of the GPUFORT module file.
+    :param str json_filepath: [in] Path of the JSON file; may be the same as 'filepath'.
+    """
+    record = modfile.materialize(_intrnl_load_module_file(filepath))
+    _intrnl_write_json_file(record,json_filepath)
+
+def prefetch_gpufort_module_files(search_dirs,module_names=None):
+    """
+    Read and decode GPUFORT module files ahead of time (see: utils.prefetch).
+
+    :param list search_dirs:  [in] List of search directories (as strings).
+    :param set module_names: [in] Names of the modules whose files, and the files of the modules
+                             they use plus those of top-level subprograms, should be prefetched,
+                             or None for all module files.
+    """
+    available = _intrnl_available_module_files(search_dirs)
+    if module_names == None:
+        filepaths = [filepath for filepath,_ in available.values()]
+    else:
+        filepaths = _intrnl_module_closure(available,module_names)
+    for filepath in filepaths[:max(1,utils.prefetch.MAX_PREFETCHED_FILES//2)]:
+        utils.prefetch.prefetch(filepath,_intrnl_load_module_file)
+
+def prefetch_used_gpufort_module_files(filepath,search_dirs):
+    """
+    Read and decode the GPUFORT module files of the modules that are used in a Fortran file
+    in the background, e.g. while the file is being linemapped. Use statements are detected
+    in the raw file content.
+    """
+    utils.prefetch.run_in_background(_intrnl_prefetch_used_gpufort_module_files,filepath,search_dirs)
+
+def load_gpufort_module_files(input_dirs,index,linemaps=None):
     """
     Load gpufort module files and append to the index.
+    Modules that are already in the index are not loaded again. If a module file 
+    exists in multiple directories, the first one is loaded.
+    The module files are found via the module catalog of each directory, which is 
+    created or updated if necessary.
 
     :param list input_dirs: [in] List of input directories (as strings).
-    :param list index:     [inout] Empty or non-empty list. Loaded data structure is appended.
+    :param list index:     [inout] Empty or non-empty list or scoper.Index. Loaded data structure is appended.
+    :param list linemaps:  [in] Linemaps of the translated file or None. If specified, only the
+                           module files that are consulted when translating the linemaps are loaded,
+                           including those of the modules and programs defined in the linemaps
+                           (see: find_consulted_gpufort_module_files).
     """
     global LOG_PREFIX
     utils.logging.log_enter_function(LOG_PREFIX,"load_gpufort_module_files",{"input_dirs":",".join(input_dirs)})
     
-    for input_dir in input_dirs:
-         for child in os.listdir(input_dir):
-             if child.endswith(GPUFORT_MODULE_FILE_SUFFIX):
-                 module_already_exists = False
-                 for mod in index:
-                     if mod == child.replace(GPUFORT_MODULE_FILE_SUFFIX,""):
-                         module_already_exists = True
-                         break
-                 if not module_already_exists:
-                     mod_index = _intrnl_read_json_file(os.path.join(input_dir, child))
-                     index.append(mod_index)
-    
-    utils.logging.log_leave_function(LOG_PREFIX,"load_gpufort_module_files")
\ No newline at end of file
+    if linemaps != None:
+        filepaths = find_consulted_gpufort_module_files(linemaps,input_dirs,skip_defined_modules=False)
+    else:
+        filepaths = [filepath for filepath,_ in _intrnl_available_module_files(input_dirs).values()]
+    loaded_modules = set(mod["name"] for mod in index)
+    filepaths      = [filepath for filepath in filepaths\
+                       if os.path.basename(filepath)[:-len(GPUFORT_MODULE_FILE_SUFFIX)] not in loaded_modules]
+    # read and decode the files on the I/O threads
+    for mod_index in utils.prefetch.read_all(filepaths,_intrnl_load_module_file):
+        index.append(mod_index)
+    
+    utils.logging.log_leave_function(LOG_PREFIX,"load_gpufort_module_files")
+
+def share_gpufort_module_files(input_dirs):
+    """
+    Copy the gpufort module files into a single read-only memory mapping that is shared
+    with the processes forked afterwards, e.g. the worker processes of a batch run.
+    The module files are not decoded; JSON module files are converted to the binary format. 
+    If a module file exists in multiple directories, the first one is taken.
+
+    :param list input_dirs: [in] List of input directories (as strings).
+    :return: The memory mapping and the name, kind, offset and size of each module file in it
+             (see: load_shared_gpufort_module_files).
+    """
+    global LOG_PREFIX
+    utils.logging.log_enter_function(LOG_PREFIX,"share_gpufort_module_files",{"input_dirs":",".join(input_dirs)})
+    
+    available = _intrnl_available_module_files(input_dirs)
+    modules   = []
+    offset    = 0
+    with tempfile.TemporaryFile(prefix="gpufort-index-") as outfile:
+        contents = utils.prefetch.read_all([filepath for filepath,_ in available.values()],_intrnl_load_binary_module_file)
+        for (name,(_,entry)), content in zip(available.items(),contents):
+            outfile.write(content)
+            modules.append((name,entry["kind"],offset,len(content)))
+            offset += len(content)
+        outfile.flush()
+        mapping = mmap.mmap(outfile.fileno(),offset,access=mmap.ACCESS_READ) if offset else b""
+    
+    utils.logging.log_leave_function(LOG_PREFIX,"share_gpufort_module_files")
+    return mapping, modules
+
+def load_shared_gpufort_module_files(shared_module_files,index):
+    """
+    Append the records of shared gpufort module files to the index without copying them.
+    Modules that are already in the index are skipped. A record is decoded from the
+    memory mapping on first access to its content and only in the accessing process; 
+    records appended to the index afterwards are private to the process too.
+
+    :param tuple shared_module_files: [in] Result of share_gpufort_module_files.
+    :param list index:     [inout] Empty or non-empty list or scoper.Index. Records are appended.
+    """
+    mapping, modules = shared_module_files
+    data           = memoryview(mapping)
+    loaded_modules = set(mod["name"] for mod in index)
+    for name, kind, offset, size in modules:
+        if name not in loaded_modules:
+            index.append(modfile.loads_deferred(data[offset:offset+size],name,kind))
+
+def find_consulted_gpufort_module_files(linemaps,search_dirs,skip_defined_modules=True):
+    """
+    Find the GPUFORT module files that are loaded from the search directories and consulted 
+    when translating the linemaps: the files of the modules used by the linemaps, directly 
+    or through the 'used_modules' of other module files, plus the files of top-level subprograms.
+    If a module file exists in multiple search directories, the first one is taken 
+    as done by 'load_gpufort_module_files'.
+
+    :param list linemaps:            [in] Linemaps of the translated file.
+    :param list search_dirs:         [in] List of search directories (as strings).
+    :param bool skip_defined_modules: [in] Skip modules and programs that are defined in the linemaps,
+                                     as their module files are created from the linemaps.
+                                     Otherwise, their files are included like those of used modules.
+    :return: List of module file paths, in the order in which they were found.
+    """
+    global LOG_PREFIX
+    utils.logging.log_enter_function(LOG_PREFIX,"find_consulted_gpufort_module_files",{"search_dirs":",".join(search_dirs)})
+    
+    result = _intrnl_consulted_module_files(linemaps,_intrnl_available_module_files(search_dirs),skip_defined_modules)
+    
+    utils.logging.log_leave_function(LOG_PREFIX,"find_consulted_gpufort_module_files")
+    return result
+
+def fingerprint_gpufort_module_files(linemaps,search_dirs):
+    """
+    Fingerprint the GPUFORT module files that 'load_gpufort_module_files' loads for the linemaps
+    via the SHA-256 hashes stored in the module catalogs. The module files are neither read nor decoded.
+
+    :param list linemaps:    [in] Linemaps of the translated file.
+    :param list search_dirs: [in] List of search directories (as strings).
+    :return: List of path and SHA-256 hash (hex string) per module file.
+    """
+    available = _intrnl_available_module_files(search_dirs)
+    entries   = { filepath: entry for filepath, entry in available.values() }
+    return [(filepath,entries[filepath]["sha256"])\
+             for filepath in _intrnl_consulted_module_files(linemaps,available,skip_defined_modules=False)]
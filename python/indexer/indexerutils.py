@@ -8,7 +8,7 @@ def update_index_from_snippet(index,snippet,preproc_options=""):
     indexer.update_index_from_linemaps(linemaps,index)
 
 def create_index_from_snippet(snippet,preproc_options):
-    index       = []
+    index       = scoper.Index()
     update_index_from_snippet(index,snippet,preproc_options="")
     return index
 
@@ -0,0 +1,252 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
+"""Compact binary format of GPUFORT module files.
+
+A module file stores a single index record, i.e. a module, program or top-level
+subprogram with its subprograms, types and variables. Layout:
+
+    magic (8 bytes) | version (uint32) | header size (uint32) | header | record section
+
+The header is the marshalled tuple of the string table and the symbol directory.
+The string table stores every key, name and string value once. The symbol directory
+has one entry (parent entry, list key, name, kind, offset, size) per record, where
+the list key is the key of the parent's list that contains the record, e.g. 'variables',
+and the kind is only stored for modules, programs, subprograms and types.
+A record body in the record section is the marshalled flat list of the record's keys
+and values in their original order. Strings are replaced by string table indices,
+integers by 1-tuples, and lists of child records by an empty tuple.
+
+'loads' only decodes the header. Records are returned as LazyRecord objects that
+know their name (and kind) and decode their body on first access to any other key.
+'loads_deferred' postpones decoding the header too.
+"""
+import struct
+import marshal
+import copy
+
+MAGIC   = b"GPUFORT\x00"
+VERSION = 1
+
+__PREAMBLE        = struct.Struct("<8sII")
+__MARSHAL_VERSION = 4
+__CHILD_LISTS     = ("variables","types","subprograms")
+__CHILDREN        = ()
+
+def _intrnl_is_child_list(key,value):
+    return key in __CHILD_LISTS and isinstance(value,list)
+
+def _intrnl_decode(value,strings):
+    value_type = type(value)
+    if value_type is int:
+        return strings[value]
+    elif value_type is list:
+        return [_intrnl_decode(item,strings) for item in value]
+    elif value_type is tuple:
+        return value[0]
+    elif value_type is dict:
+        return { strings[key]: _intrnl_decode(item,strings) for key,item in value.items() }
+    return value # None, bool, float
+
+def _intrnl_check_preamble(data):
+    """:return: The size of the header."""
+    if len(data) < __PREAMBLE.size:
+        raise ValueError("not a binary GPUFORT module file")
+    magic, version, header_size = __PREAMBLE.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not a binary GPUFORT module file")
+    if version != VERSION:
+        raise ValueError("unsupported binary GPUFORT module file version {} (expected: {})".format(version,VERSION))
+    return header_size
+
+def _intrnl_decode_header(data):
+    """:return: The source of the records: string table, symbol directory, record section and children per entry."""
+    begin = __PREAMBLE.size + _intrnl_check_preamble(data)
+    strings, directory = marshal.loads(data[__PREAMBLE.size:begin])
+    children = [[] for _ in directory]
+    for entry, (parent,*_) in enumerate(directory):
+        if parent >= 0:
+            children[parent].append(entry)
+    return (strings,directory,memoryview(data)[begin:],children)
+
+def _intrnl_load(record):
+    """Decode the body of a record; keeps the values that have been assigned before."""
+    source, entry = record._source, record._entry
+    record._source = None
+    if entry is None: # header not decoded yet, see: loads_deferred
+        source, entry = _intrnl_decode_header(source), 0
+    strings, directory, section, children = source
+    offset, size = directory[entry][4:6]
+    body = marshal.loads(section[offset:offset+size])
+    child_lists = {}
+    for child in children[entry]:
+        child_lists.setdefault(strings[directory[child][1]],[]).append(LazyRecord(source,child))
+    assigned = dict(dict.items(record))
+    dict.clear(record)
+    for i in range(0,len(body),2):
+        key   = strings[body[i]]
+        value = body[i+1]
+        if key in assigned:
+            dict.__setitem__(record,key,assigned.pop(key))
+        elif value == __CHILDREN:
+            dict.__setitem__(record,key,child_lists.get(key,[]))
+        else:
+            dict.__setitem__(record,key,_intrnl_decode(value,strings))
+    dict.update(record,assigned)
+
+def _intrnl_loaded(record):
+    if record._source != None:
+        _intrnl_load(record)
+    return record
+
+class LazyRecord(dict):
+    """
+    Index record whose body is decoded from a module file on first access
+    to a key other than 'name' and, for non-variable records, 'kind'.
+    Behaves like a dict; copies, pickles and 'copy.copy' results are plain dicts,
+    deep copies stay lazy.
+    """
+    __slots__ = ["_source","_entry"]
+    def __init__(self,source,entry):
+        dict.__init__(self)
+        self._source = source
+        self._entry  = entry
+        strings, directory = source[0:2]
+        dict.__setitem__(self,"name",strings[directory[entry][2]])
+        if directory[entry][3] >= 0:
+            dict.__setitem__(self,"kind",strings[directory[entry][3]])
+    def __missing__(self,key):
+        if self._source == None:
+            raise KeyError(key)
+        _intrnl_load(self)
+        return dict.__getitem__(self,key)
+    def __contains__(self,key):
+        return dict.__contains__(_intrnl_loaded(self),key)
+    def __iter__(self):
+        return dict.__iter__(_intrnl_loaded(self))
+    def __len__(self):
+        return dict.__len__(_intrnl_loaded(self))
+    def __eq__(self,other):
+        if isinstance(other,LazyRecord):
+            _intrnl_loaded(other)
+        return dict.__eq__(_intrnl_loaded(self),other)
+    def __ne__(self,other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+    __hash__ = None
+    def __repr__(self):
+        return dict.__repr__(_intrnl_loaded(self))
+    def __reduce_ex__(self,protocol):
+        return (dict,(self.copy(),))
+    def __deepcopy__(self,memo):
+        result = dict.__new__(LazyRecord)
+        result._source = self._source
+        result._entry  = self._entry
+        memo[id(self)] = result
+        for key, value in dict.items(self):
+            dict.__setitem__(result,key,copy.deepcopy(value,memo))
+        return result
+    def get(self,key,default=None):
+        return dict.get(_intrnl_loaded(self),key,default)
+    def keys(self):
+        return dict.keys(_intrnl_loaded(self))
+    def values(self):
+        return dict.values(_intrnl_loaded(self))
+    def items(self):
+        return dict.items(_intrnl_loaded(self))
+    def copy(self):
+        return dict(dict.items(_intrnl_loaded(self)))
+    def pop(self,key,*default):
+        return dict.pop(_intrnl_loaded(self),key,*default)
+    def popitem(self):
+        return dict.popitem(_intrnl_loaded(self))
+    def setdefault(self,key,default=None):
+        return dict.setdefault(_intrnl_loaded(self),key,default)
+    def update(self,*args,**kwargs):
+        dict.update(_intrnl_loaded(self),*args,**kwargs)
+
+# API
+def dumps(record):
+    """
+    :param dict record: Module, program or top-level subprogram index record.
+    :return: The record in the binary module file format.
+    """
+    strings    = []
+    string_ids = {}
+    directory  = []
+    bodies     = []
+    offset     = 0
+    def string_id_(string):
+        string_id = string_ids.get(string)
+        if string_id == None:
+            string_id = string_ids[string] = len(strings)
+            strings.append(string)
+        return string_id
+    def encode_(value):
+        if isinstance(value,str):
+            return string_id_(value)
+        elif isinstance(value,bool) or value == None or isinstance(value,float):
+            return value
+        elif isinstance(value,int):
+            return (value,)
+        elif isinstance(value,(list,tuple)):
+            return [encode_(item) for item in value]
+        elif isinstance(value,dict):
+            return { string_id_(key): encode_(item) for key,item in value.items() }
+        raise TypeError("cannot encode value of type '{}'".format(type(value).__name__))
+    def add_record_(record,parent,list_key):
+        nonlocal offset
+        body = []
+        for key, value in record.items():
+            body.append(string_id_(key))
+            body.append(__CHILDREN if _intrnl_is_child_list(key,value) else encode_(value))
+        body = marshal.dumps(body,__MARSHAL_VERSION)
+        entry = len(directory)
+        kind  = string_id_(record["kind"]) if list_key != "variables" and isinstance(record.get("kind"),str) else -1
+        directory.append((parent,string_id_(list_key),string_id_(record["name"]),kind,offset,len(body)))
+        bodies.append(body)
+        offset += len(body)
+        for key, value in record.items():
+            if _intrnl_is_child_list(key,value):
+                for child in value:
+                    add_record_(child,entry,key)
+    add_record_(record,-1,"")
+    header = marshal.dumps((strings,directory),__MARSHAL_VERSION)
+    return b"".join([__PREAMBLE.pack(MAGIC,VERSION,len(header)),header] + bodies)
+
+def loads(data):
+    """
+    Decode the header of a binary module file.
+    :param bytes data: Content of the module file.
+    :return: LazyRecord of the module, program or top-level subprogram.
+    :throws: ValueError if the data is not in the binary module file format of this version.
+    """
+    return LazyRecord(_intrnl_decode_header(data),0)
+
+def loads_deferred(data,name,kind):
+    """
+    Like 'loads' but does not even decode the header before the first access
+    to a key other than 'name' and 'kind'. The data is not copied; it may be
+    a memoryview of a memory mapping.
+    :param str name: Name of the record in the data.
+    :param str kind: Kind of the record in the data.
+    :throws: ValueError if the data is not in the binary module file format of this version.
+    """
+    _intrnl_check_preamble(data)
+    record = dict.__new__(LazyRecord)
+    record._source = data
+    record._entry  = None
+    dict.__setitem__(record,"name",name)
+    dict.__setitem__(record,"kind",kind)
+    return record
+
+def is_binary(data):
+    """:return: If the data starts like a binary module file."""
+    return data[0:len(MAGIC)] == MAGIC
+
+def materialize(value):
+    """:return: Copy of a (lazy) record, or a list or dict of records, that consists of plain dicts and lists only."""
+    if isinstance(value,dict):
+        return { key: materialize(item) for key,item in value.items() }
+    elif isinstance(value,list):
+        return [materialize(item) for item in value]
+    return value
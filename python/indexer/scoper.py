@@ -8,12 +8,13 @@ import re
 
 import orjson
 
+import utils.codecache
 import utils.logging
 import utils.parsingutils
 
 # configurable parameters
 indexer_dir = os.path.dirname(__file__)
-exec(open("{0}/scoper_options.py.in".format(indexer_dir)).read())
+utils.codecache.exec_file(os.path.join(indexer_dir,"scoper_options.py.in"),globals())
 
 ERR_SCOPER_RESOLVE_DEPENDENCIES_FAILED = 1001
 ERR_SCOPER_LOOKUP_FAILED = 1002
@@ -60,6 +61,101 @@ EMPTY_SCOPE = { "tag": "", "types" : [], "variables" : [], "subprograms" : [] }
 
 __SCOPE_ENTRY_TYPES = ["subprograms","variables","types"]
 
+class Index(list):
+    """
+    List of module, program and top-level subprogram index records with hashed
+    lookup by name and by colon-separated tag, e.g. 'mymod:mysubroutine:inner'.
+    If multiple records have the same name, the first one is found.
+    The lookup tables are updated as records are added via the list interface;
+    the other modifying list operations rehash the whole index.
+    The subprograms of a record are hashed on the first lookup of one of them.
+
+    :note: Call 'rehash' after modifying the 'subprograms' of a record that has been looked up.
+    :note: Pickles and copies contain the records only.
+    """
+    __slots__ = ["_positions","_top_level_subprograms","_children"]
+    def __init__(self,records=[]):
+        list.__init__(self,records)
+        self.rehash()
+    def _add(self,position,record):
+        if record["name"] not in self._positions:
+            self._positions[record["name"]] = position
+        if record["kind"] in ("subroutine","function"):
+            self._top_level_subprograms.append(record)
+    def rehash(self):
+        """Recreate the lookup tables."""
+        self._positions             = {}
+        self._top_level_subprograms = []
+        self._children              = {}
+        for position, record in enumerate(self):
+            self._add(position,record)
+    def append(self,record):
+        list.append(self,record)
+        self._add(len(self)-1,record)
+    def extend(self,records):
+        begin = len(self)
+        list.extend(self,records)
+        for position in range(begin,len(self)):
+            self._add(position,self[position])
+    def __iadd__(self,records):
+        self.extend(records)
+        return self
+    def clear(self):
+        list.clear(self)
+        self.rehash()
+    def insert(self,position,record):
+        list.insert(self,position,record)
+        self.rehash()
+    def remove(self,record):
+        list.remove(self,record)
+        self.rehash()
+    def pop(self,*position):
+        record = list.pop(self,*position)
+        self.rehash()
+        return record
+    def sort(self,*args,**kwargs):
+        list.sort(self,*args,**kwargs)
+        self.rehash()
+    def reverse(self):
+        list.reverse(self)
+        self.rehash()
+    def __setitem__(self,key,value):
+        list.__setitem__(self,key,value)
+        self.rehash()
+    def __delitem__(self,key):
+        list.__delitem__(self,key)
+        self.rehash()
+    def __reduce_ex__(self,protocol):
+        return (Index,(list(self),))
+    def find(self,name):
+        """:return: The first top-level record with the given name or None."""
+        position = self._positions.get(name)
+        return None if position is None else self[position]
+    def find_by_tag(self,tag):
+        """
+        :param str tag: a colon-separated list of names. Ex: mymod:mysubroutine or mymod.
+        :return: The record with the given tag or None.
+        """
+        tag_tokens = tag.split(":")
+        record     = self.find(tag_tokens[0])
+        for depth in range(1,len(tag_tokens)):
+            if record is None:
+                break
+            parent_tag = ":".join(tag_tokens[0:depth])
+            children   = self._children.get(parent_tag)
+            if children is None:
+                children = self._children[parent_tag] = {}
+                for child in record.get("subprograms",[]):
+                    children.setdefault(child["name"],child)
+            record = children.get(tag_tokens[depth])
+        return record
+    def top_level_subprograms(self):
+        """:return: The top-level subroutine and function records in index order."""
+        return self._top_level_subprograms
+
+def _intrnl_as_index(index):
+    return index if isinstance(index,Index) else Index(index)
+
 def _intrnl_resolve_dependencies(scope,index_record,index):
     """
     Include variable, type, and subprogram records from modules used
@@ -67,7 +163,7 @@ def _intrnl_resolve_dependencies(scope,index_record,index):
 
     :param dict scope: the scope that you updated with information from the used modules.
     :param dict index_record: a module/program/subprogram index record
-    :param list index: list of module/program index records
+    :param Index index: module/program index records
 
     TODO must be recursive!!!
     """
@@ -85,30 +181,30 @@ def _intrnl_resolve_dependencies(scope,index_record,index):
         for used_module in imodule["used_modules"]:
             used_module_found = used_module["name"] in MODULE_IGNORE_LIST
             # include definitions from other modules
-            for module in index:
-                if module["name"] == used_module["name"]:
-                    handle_use_statements_(scope,module) # recursivie call
-
-                    used_module_found   = True
-                    include_all_entries = not len(used_module["only"])
-                    if include_all_entries: # simple include
-                        utils.logging.log_debug2(LOG_PREFIX,"_intrnl_resolve_dependencies.handle_use_statements",
-                          "use all definitions from module '{}'".format(imodule["name"]))
+            module = index.find(used_module["name"])
+            if module is not None:
+                handle_use_statements_(scope,module) # recursivie call
+
+                used_module_found   = True
+                include_all_entries = not len(used_module["only"])
+                if include_all_entries: # simple include
+                    utils.logging.log_debug2(LOG_PREFIX,"_intrnl_resolve_dependencies.handle_use_statements",
+                      "use all definitions from module '{}'",imodule["name"])
+                    for entry_type in __SCOPE_ENTRY_TYPES:
+                        scope[entry_type] += module[entry_type]
+                else:
+                    for mapping in used_module["only"]:
                         for entry_type in __SCOPE_ENTRY_TYPES:
-                            scope[entry_type] += module[entry_type]
-                    else:
-                        for mapping in used_module["only"]:
-                            for entry_type in __SCOPE_ENTRY_TYPES:
-                                for entry in module[entry_type]:
-                                    if entry["name"] == mapping["original"]:
-                                        utils.logging.log_debug2(LOG_PREFIX,
-                                          "_intrnl_resolve_dependencies.handle_use_statements",\
-                                          "use {} '{}' as '{}' from module '{}'".format(\
-                                          entry_type[0:-1],mapping["original"],mapping["renamed"],\
-                                          imodule["name"]))
-                                        copied_entry = copy.deepcopy(entry)
-                                        copied_entry["name"] = mapping["renamed"]
-                                        scope[entry_type].append(copied_entry)
+                            for entry in module[entry_type]:
+                                if entry["name"] == mapping["original"]:
+                                    utils.logging.log_debug2(LOG_PREFIX,
+                                      "_intrnl_resolve_dependencies.handle_use_statements",\
+                                      "use {} '{}' as '{}' from module '{}'",\
+                                      entry_type[0:-1],mapping["original"],mapping["renamed"],\
+                                      imodule["name"])
+                                    copied_entry = copy.deepcopy(entry)
+                                    copied_entry["name"] = mapping["renamed"]
+                                    scope[entry_type].append(copied_entry)
             if not used_module_found:
                 msg = "no index record for module '{}' could be found".format(used_module["name"])
                 if ERROR_HANDLING == "strict":
@@ -144,7 +240,7 @@ def _intrnl_search_scope_for_type_or_subprogram(scope,entry_name,entry_type,empt
         return empty_record, False
     else:
         utils.logging.log_debug2(LOG_PREFIX,"_intrnl_search_scope_for_type_or_subprogram",\
-          "entry found for {} '{}'".format(entry_type[:-1],entry_name)) 
+          "entry found for {} '{}'",entry_type[:-1],entry_name) 
         utils.logging.log_leave_function(LOG_PREFIX,"_intrnl_search_scope_for_type_or_subprogram")
         return result, True
 
@@ -158,8 +254,9 @@ def _intrnl_search_index_for_type_or_subprogram(index,parent_tag,entry_name,entr
 
     if parent_tag is None:
         scope = dict(EMPTY_SCOPE) # top-level subroutine/function
-        scope["subprograms"] = [index_entry for index_entry in index\
-          if index_entry["name"]==entry_name and index_entry["kind"] in ["subroutine","function"]]
+        index_entry = _intrnl_as_index(index).find(entry_name)
+        scope["subprograms"] = [index_entry] if index_entry is not None and\
+          index_entry["kind"] in ["subroutine","function"] else []
     else:
         scope = create_scope(index,parent_tag)
     return _intrnl_search_scope_for_type_or_subprogram(scope,entry_name,entry_type,empty_record)
@@ -205,6 +302,7 @@ def create_scope_from_declaration_statements(declaration_statements=[]):
 
 def create_scope(index,tag):
     """
+    :param list index: Index or list of module/program index records.
     :param str tag: a colon-separated list of strings. Ex: mymod:mysubroutine or mymod.
     :note: not thread-safe
     :note: tries to reuse existing scopes.
@@ -217,6 +315,8 @@ def create_scope(index,tag):
     global LOG_PREFIX    
     utils.logging.log_enter_function(LOG_PREFIX,"create_scope",{"tag":tag,"ERROR_HANDLING":ERROR_HANDLING})
     
+    index = _intrnl_as_index(index)
+
     # check if already a scope exists for the tag or if
     # it can be derived from a higher-level scope
     existing_scope   = EMPTY_SCOPE
@@ -231,19 +331,19 @@ def create_scope(index,tag):
             scopes_to_delete.append(s)
     # clean up scopes that are not used anymore 
     if REMOVE_OUTDATED_SCOPES and len(scopes_to_delete):
-        utils.logging.log_debug(LOG_PREFIX,"create_scope",\
-          "delete outdated scopes with tags '{}'".format(\
-            ", ".join([s["tag"] for s in scopes_to_delete])))
+        utils.logging.log_debug1(LOG_PREFIX,"create_scope",\
+          "delete outdated scopes with tags '{}'",", ".join([s["tag"] for s in scopes_to_delete]))
         for s in scopes_to_delete:
             SCOPES.remove(s)
 
     # return existing existing_scope or create it
     tag_tokens = tag.split(":")
     if len(tag_tokens)-1 == nesting_level:
-        utils.logging.log_debug(LOG_PREFIX,"create_scope",\
-          "found existing scope for tag '{}'".format(tag))
-        utils.logging.log_debug4(LOG_PREFIX,"create_scope",\
-          "variables in scope: {}".format(", ".join([var["name"] for var in existing_scope["variables"]])))
+        utils.logging.log_debug1(LOG_PREFIX,"create_scope",\
+          "found existing scope for tag '{}'",tag)
+        if utils.logging.debug_level_enabled(4):
+            utils.logging.log_debug4(LOG_PREFIX,"create_scope",\
+              "variables in scope: {}",", ".join([var["name"] for var in existing_scope["variables"]]))
         utils.logging.log_leave_function(LOG_PREFIX,"create_scope")
         return existing_scope
     else:
@@ -253,36 +353,27 @@ def create_scope(index,tag):
         # we already have a scope for this record
         if nesting_level >= 0:
             base_record_tag = ":".join(tag_tokens[0:nesting_level+1])
-            utils.logging.log_debug(LOG_PREFIX,"create_scope",\
-              "create scope for tag '{}' based on existing scope with tag '{}'".format(tag,base_record_tag))
-            base_record = next((module for module in index if module["name"] == tag_tokens[0]),None)  
-            for l in range(1,nesting_level+1):
-                base_record = next((subprogram for subprogram in base_record["subprograms"] if subprogram["name"] == tag_tokens[l]),None)
-            current_record_list = base_record["subprograms"]
+            utils.logging.log_debug1(LOG_PREFIX,"create_scope",\
+              "create scope for tag '{}' based on existing scope with tag '{}'",tag,base_record_tag)
         else:
-            utils.logging.log_debug(LOG_PREFIX,"create_scope",\
-              "create scope for tag '{}'".format(tag))
-            current_record_list = index
+            utils.logging.log_debug1(LOG_PREFIX,"create_scope",\
+              "create scope for tag '{}'",tag)
             # add top-level subprograms to scope of top-level entry
-            new_scope["subprograms"] += [index_entry for index_entry in index\
-                    if index_entry["kind"] in ["subroutine","function"] and\
-                       index_entry["name"] != tag_tokens[0]]
-            utils.logging.log_debug(LOG_PREFIX,"create_scope",\
-              "add {} top-level subprograms to scope".format(len(new_scope["subprograms"])))
+            new_scope["subprograms"] += [index_entry for index_entry in index.top_level_subprograms()\
+                    if index_entry["name"] != tag_tokens[0]]
+            utils.logging.log_debug1(LOG_PREFIX,"create_scope",\
+              "add {} top-level subprograms to scope",len(new_scope["subprograms"]))
         begin = nesting_level + 1 # 
         
         for d in range(begin,len(tag_tokens)):
-            searched_name = tag_tokens[d]
-            for current_record in current_record_list:
-                if current_record["name"] == searched_name:
-                    # 1. first include variables from included
-                    _intrnl_resolve_dependencies(new_scope,current_record,index) 
-                    # 2. now include the current record's   
-                    for entry_type in __SCOPE_ENTRY_TYPES:
-                        if entry_type in current_record:
-                            new_scope[entry_type] += current_record[entry_type]
-                    current_record_list = current_record["subprograms"]
-                    break
+            current_record = index.find_by_tag(":".join(tag_tokens[0:d+1]))
+            if current_record is not None:
+                # 1. first include variables from included
+                _intrnl_resolve_dependencies(new_scope,current_record,index) 
+                # 2. now include the current record's   
+                for entry_type in __SCOPE_ENTRY_TYPES:
+                    if entry_type in current_record:
+                        new_scope[entry_type] += current_record[entry_type]
         SCOPES.append(new_scope)
         utils.logging.log_leave_function(LOG_PREFIX,"create_scope")
         return new_scope
@@ -360,7 +451,7 @@ def search_scope_for_variable(scope,variable_expression,resolve=False):
                     result[entry] = entry_value
 
         utils.logging.log_debug2(LOG_PREFIX,"search_scope_for_variable",\
-          "entry found for variable '{}'".format(variable_tag)) 
+          "entry found for variable '{}'",variable_tag) 
         utils.logging.log_leave_function(LOG_PREFIX,"search_scope_for_variable")
         return result, True
 
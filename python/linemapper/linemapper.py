@@ -1,65 +1,309 @@
 import os,sys
 import re
+import bisect
+import hashlib
+import pickle
 
 import addtoplevelpath
 import pyparsing as pyp
 
+import utils.codecache
 import utils.logging
+import utils.fileutils
+import utils.prefetch
+from linemapper.grammar import *
 
 ERR_LINEMAPPER_MACRO_DEFINITION_NOT_FOUND = 11001
 
 linemapper_dir = os.path.dirname(__file__)
-exec(open("{0}/linemapper_options.py.in".format(linemapper_dir)).read())
-exec(open("{0}/grammar.py".format(linemapper_dir)).read())
-
-def _intrnl_evaluate_defined(input_string,macro_stack):
-    # expand macro; one at a time
-    result = input_string
-    macro_names = [ macro["name"] for macro in reversed(macro_stack) ]
-    iterate = True
-    while iterate:
-        iterate   = False
-        for match,start,end in pp_defined.scanString(result):
-            substring = result[start:end].strip(" \t\n")
-            subst = "1" if match.name in macro_names else "0"
-            result = result.replace(substring,subst)
-            iterate = True
-            break
+utils.codecache.exec_file(os.path.join(linemapper_dir,"linemapper_options.py.in"),globals())
+
+p_defined    = re.compile(r"defined\(\s*(\w+)\s*\)",re.IGNORECASE)
+p_identifier = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+p_token      = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|[(),]|\s+|[^A-Za-z_(),\s]+") # identifier, parenthesis/comma, whitespace, other
+# we look for a sequence ") <word>" were word != "then".
+p_single_line_if         = re.compile(r"^(?P<indent>[\s\t]*)(?P<head>if\s*\(.+\))\s*\b(?!then)(?P<body>\w.+)",re.IGNORECASE)
+p_directive_continuation = re.compile(r"\n[!c\*]\$\w+\&")
+p_continued_line         = re.compile(r"[&\\][ \t]*$",re.MULTILINE)
+p_split_site             = re.compile(r";|^[^\S\n]*if\s*\(",re.MULTILINE|re.IGNORECASE) # statement separator or (single-line) if statement
+p_include_directive      = re.compile(r"^#\s*include\s+\"([^\"\n]+)\"",re.MULTILINE|re.IGNORECASE)
+
+__EMPTY_HIDE_SET    = frozenset()
+__macro_table_cache = (None,0,None,{}) # macro stack, its length, its last macro, macro table
+
+__MAX_CACHED_CONDITIONS = 10000
+__condition_identifiers = {} # condition -> identifiers in the condition
+__condition_results     = {} # condition and definitions of the macros that it references -> result
+__condition_code        = {} # condition with expanded macros -> code object
+
+__p_line_continuation = None # compiled PATTERN_LINE_CONTINUATION, see: _intrnl_get_line_continuation_pattern
+
+__MAX_CACHED_INCLUDE_VARIANTS = 8
+__include_cache               = {}  # include file path -> normalized variants of the file, see: _intrnl_preprocess_and_normalize_include_file
+__loaded_include_cache_files  = set() # files in INCLUDE_CACHE_DIR that have been loaded into the include cache
+__include_recorders           = []  # per include file that is being normalized: files and identifiers of its nested includes
+
+class Linemap:
+    """
+    A group of lines that contains one or more complete statements, the (normalized) raw statements
+    and the statements with expanded macros.
+
+    The lines are stored as offsets into a buffer that is shared by all linemaps of a file.
+    Raw statements are only stored if they differ from the lines and statements
+    only if they differ from the raw statements.
+
+    :note: Linemaps can still be accessed like the dicts they used to be, e.g. linemap["statements"].
+           In contrast to the attribute linemap.statements, which might return a new list,
+           linemap["statements"] always returns the stored list, which can be modified in place.
+    """
+    __slots__ = ["file","lineno","_buffer","_start","_end","_raw_statements","_statements",
+                 "included_linemaps","is_preprocessor_directive","is_active","modified","prolog","epilog"]
+    KEYS = frozenset(["file","lineno","lines","raw_statements","included_linemaps","is_preprocessor_directive",
+                      "is_active","statements","modified","prolog","epilog"])
+    def __init__(self,file,lineno,buffer,start,end,raw_statements=None,statements=None,
+                 included_linemaps=[],is_preprocessor_directive=False,is_active=True):
+        """
+        :param buffer: Text of the file, or list of its lines if the text cannot be split into the original lines again.
+        :param int start: Offset of the first line in the buffer.
+        :param int end: Offset behind the last line in the buffer.
+        :param list raw_statements: The raw statements or None if they are equal to the lines.
+        :param list statements: The statements or None if they are equal to the raw statements.
+        """
+        self.file                      = file
+        self.lineno                    = lineno
+        self._buffer                   = buffer
+        self._start                    = start
+        self._end                      = end
+        self._raw_statements           = raw_statements
+        self._statements               = statements
+        self.included_linemaps         = included_linemaps
+        self.is_preprocessor_directive = is_preprocessor_directive
+        self.is_active                 = is_active
+        self.modified                  = False
+        self.prolog                    = []
+        self.epilog                    = []
+    @property
+    def lines(self):
+        if isinstance(self._buffer,str):
+            return _intrnl_split_lines(self._buffer[self._start:self._end])
+        else:
+            return self._buffer[self._start:self._end]
+    @property
+    def raw_statements(self):
+        return self.lines if self._raw_statements == None else self._raw_statements
+    @property
+    def statements(self):
+        """:note: Might be a new list; use set_statement to modify a statement."""
+        return self.raw_statements if self._statements == None else self._statements
+    @statements.setter
+    def statements(self,statements):
+        self._statements = statements
+    def set_statement(self,i,statement):
+        if self._statements == None:
+            self._statements = list(self.raw_statements)
+        self._statements[i] = statement
+    def copy(self):
+        """:return: Copy that shares the buffer and the raw statements but not the entries that the scanner modifies."""
+        statements = None if self._statements == None else list(self._statements)
+        linemap = Linemap(self.file,self.lineno,self._buffer,self._start,self._end,self._raw_statements,statements,
+                          [included_linemap.copy() for included_linemap in self.included_linemaps],
+                          self.is_preprocessor_directive,self.is_active)
+        linemap.modified = self.modified
+        linemap.prolog   = list(self.prolog)
+        linemap.epilog   = list(self.epilog)
+        return linemap
+    def to_dict(self):
+        return { key: getattr(self,key) for key in sorted(Linemap.KEYS) }
+    def __getitem__(self,key):
+        if key == "statements":
+            if self._statements == None:
+                self._statements = list(self.raw_statements)
+            return self._statements
+        elif key in Linemap.KEYS:
+            return getattr(self,key)
+        else:
+            raise KeyError(key)
+    def __setitem__(self,key,value):
+        if key not in Linemap.KEYS:
+            raise KeyError(key)
+        setattr(self,key,value)
+    def __contains__(self,key):
+        return key in Linemap.KEYS
+    def get(self,key,default=None):
+        return self[key] if key in Linemap.KEYS else default
+
+def _intrnl_split_lines(text):
+    """Split text into lines that keep their line break character ('\\n'), as done by 'readlines'."""
+    lines = [line+"\n" for line in text.split("\n")]
+    if lines[-1] == "\n":
+        lines.pop()
+    else:
+        lines[-1] = lines[-1][:-1]
+    return lines
+
+def _intrnl_create_buffer(lines):
+    """
+    :return: The text of the lines and the offsets of the line starts plus the length of the text,
+             or the lines and their indices if the text cannot be split into the original lines again.
+    """
+    text = "".join(lines)
+    if _intrnl_split_lines(text) == lines:
+        offsets = [0]
+        for line in lines:
+            offsets.append(offsets[-1]+len(line))
+        return text, offsets
+    else:
+        return list(lines), list(range(len(lines)+1))
+
+def _intrnl_get_macro_table(macro_stack):
+    """
+    :return: Dict that maps macro names to tuples of a dict that maps parameter names to positions,
+             the tokens of the substitution text and a hashable representation of the definition.
+             If a macro is defined more than once, the latest definition is used.
+    :note: The table of the last macro stack is cached. As macros are only appended to or removed from the stack,
+           its length and its last macro identify its state.
+    """
+    global __macro_table_cache
+    cached_macro_stack, cached_len, cached_last_macro, macro_table = __macro_table_cache
+    last_macro = macro_stack[-1] if len(macro_stack) else None
+    if not (cached_macro_stack is macro_stack and cached_len == len(macro_stack) and cached_last_macro is last_macro):
+        macro_table = {}
+        for macro in macro_stack:
+            params = { param: n for n,param in enumerate(macro["args"]) }
+            subst  = (macro["subst"] or "").strip(" \n\t")
+            macro_table[macro["name"]] = (params,p_token.findall(subst),(tuple(macro["args"]),subst))
+        __macro_table_cache = (macro_stack,len(macro_stack),last_macro,macro_table)
+    return macro_table
+
+def _intrnl_evaluate_defined(input_string,macro_table):
+    return p_defined.sub(lambda match: "1" if match.group(1) in macro_table else "0",input_string)
+
+def _intrnl_collect_macro_args(pending):
+    """
+    Collect the arguments of a function-like macro invocation from the top of the 'pending' token stack.
+    :return: List of the token lists of the arguments and the number of tokens of the argument list
+             including the parentheses, or None and 0 if the next non-whitespace token is not an opening parenthesis
+             or the argument list is not closed.
+    """
+    i = len(pending)-1
+    while i >= 0 and pending[i][0].isspace():
+        i -= 1
+    if i < 0 or pending[i][0] != "(":
+        return None, 0
+    args  = [[]]
+    depth = 0
+    for j in range(i-1,-1,-1):
+        text = pending[j][0]
+        if text == ")" and depth == 0:
+            for arg in args: # strip whitespace
+                while len(arg) and arg[-1][0].isspace():
+                    arg.pop()
+                while len(arg) and arg[0][0].isspace():
+                    arg.pop(0)
+            return args, len(pending)-j
+        elif text == "," and depth == 0:
+            args.append([])
+        else:
+            if text == "(":
+                depth += 1
+            elif text == ")":
+                depth -= 1
+            args[-1].append(pending[j])
+    return None, 0
+
+def _intrnl_expand_tokens(tokens,macro_table):
+    """
+    Expands macros in a single pass over the tokens. The expansion of a macro is pushed back onto
+    the stack of pending tokens, i.e. it is rescanned together with the remaining tokens.
+    Arguments of function-like macros are expanded before they are substituted.
+
+    :param list tokens: Tuples of token text and hide set, i.e. the names of the macros whose expansion
+                        produced the token. Macros in the hide set are not expanded again, which prevents
+                        infinite recursion.
+    :return: The tokens of the expanded text.
+    """
+    result  = []
+    pending = tokens[::-1] # next token at the end
+    while len(pending):
+        token = pending.pop()
+        text, hide_set = token
+        macro = macro_table.get(text)
+        if macro == None or text in hide_set:
+            result.append(token)
+            continue
+        params, subst, _ = macro
+        hide_set = hide_set | {text}
+        if len(params):
+            args, num_arg_tokens = _intrnl_collect_macro_args(pending)
+            if args == None or len(args) != len(params): # no invocation
+                result.append(token)
+                continue
+            del pending[len(pending)-num_arg_tokens:]
+            expanded_args = [_intrnl_expand_tokens(arg,macro_table) for arg in args]
+            expansion = []
+            for subst_text in subst:
+                n = params.get(subst_text)
+                if n == None:
+                    expansion.append((subst_text,hide_set))
+                else:
+                    expansion += [(arg_text,arg_hide_set | hide_set) for arg_text,arg_hide_set in expanded_args[n]]
+        else:
+            expansion = [(subst_text,hide_set) for subst_text in subst]
+        pending += reversed(expansion)
     return result
 
 def _intrnl_expand_macros(input_string,macro_stack):
-    # expand defined(...) expressions
-    result = _intrnl_evaluate_defined(input_string,macro_stack)
-    # expand macro; one at a time
-    macro_names = [ macro["name"] for macro in macro_stack ]
-    iterate    = True
-    while iterate:
-        iterate = False
-        # finds all identifiers
-        for parse_result,start,end in pp_macro_eval.scanString(result):
-            name = parse_result[0]
-            if name in macro_names:
-                substring = result[start:end].strip(" \t\n")
-                args      = parse_result[1].asList()
-                macro     = next((macro for macro in macro_stack if macro["name"] == name),None)
-                subst     = macro["subst"].strip(" \n\t")
-                for n,placeholder in enumerate(macro["args"]):
-                    subst = re.sub(r"\b{}\b".format(placeholder),args[n],subst)
-                result  = result.replace(substring,subst)
-                iterate = True
-                break
+    """Evaluate 'defined(<name>)' expressions and expand macros."""
+    macro_table = _intrnl_get_macro_table(macro_stack)
+    result = _intrnl_evaluate_defined(input_string,macro_table)
+    for name in p_identifier.findall(result):
+        if name in macro_table:
+            tokens = [(text,__EMPTY_HIDE_SET) for text in p_token.findall(result)]
+            return "".join([text for text,_ in _intrnl_expand_tokens(tokens,macro_table)])
     return result
 
+def _intrnl_cache_condition(cache,key,value):
+    if len(cache) >= __MAX_CACHED_CONDITIONS:
+        cache.clear()
+    cache[key] = value
+
+def _intrnl_referenced_macros(identifiers,macro_table):
+    """:return: The macros among the identifiers and, transitively, among the identifiers in their substitution texts."""
+    referenced = set()
+    pending    = [name for name in identifiers if name in macro_table]
+    while len(pending):
+        name = pending.pop()
+        if name not in referenced:
+            referenced.add(name)
+            pending += [text for text in macro_table[name][1] if text in macro_table]
+    return referenced
+
 def evaluate_condition(input_string,macro_stack):
     """
     Evaluates preprocessor condition.
     :param str input_string: Expression as text.
     :note: Input validation performed according to:
            https://realpython.com/python-eval-function/#minimizing-the-security-issues-of-eval
+    :note: The result is memoized by the condition and the definitions of the macros that the condition
+           references (directly or via other macros); the compiled expression is cached by the expanded condition.
     """
-    transformed_input_string = pp_ops.transformString(_intrnl_expand_macros(input_string,macro_stack))
-    code = compile(transformed_input_string, "<string>", "eval") 
-    return eval(code, {"__builtins__": {}},{}) > 0
+    macro_table = _intrnl_get_macro_table(macro_stack)
+    identifiers = __condition_identifiers.get(input_string)
+    if identifiers == None:
+        identifiers = frozenset(p_identifier.findall(input_string))
+        _intrnl_cache_condition(__condition_identifiers,input_string,identifiers)
+    key = (input_string,frozenset([(name,macro_table[name][2]) for name in _intrnl_referenced_macros(identifiers,macro_table)]))
+    result = __condition_results.get(key)
+    if result == None:
+        expanded_input_string = _intrnl_expand_macros(input_string,macro_stack)
+        code = __condition_code.get(expanded_input_string)
+        if code == None:
+            transformed_input_string = pp_ops.transformString(expanded_input_string)
+            code = compile(transformed_input_string, "<string>", "eval") 
+            _intrnl_cache_condition(__condition_code,expanded_input_string,code)
+        result = eval(code, {"__builtins__": {}},{}) > 0
+        _intrnl_cache_condition(__condition_results,key,result)
+    return result
 
 def _intrnl_handle_preprocessor_directive(lines,fortran_filepath,macro_stack,region_stack1,region_stack2):
     """
@@ -114,11 +358,8 @@ def _intrnl_handle_preprocessor_directive(lines,fortran_filepath,macro_stack,reg
            elif stripped_first_line.startswith("include"):
                utils.logging.log_debug3(LOG_PREFIX,"_intrnl_handle_preprocessor_directive","found include in line '{}'".format(lines[0].rstrip("\n")))
                result     = pp_dir_include.parseString(single_line_statement,parseAll=True)
-               filename   = result.filename.strip(" \t")
-               current_dir = os.path.dirname(fortran_filepath)
-               if not filename.startswith("/") and len(current_dir):
-                   filename = os.path.dirname(fortran_filepath) + "/" + filename
-               included_linemaps = _intrnl_preprocess_and_normalize_fortran_file(filename,macro_stack,region_stack1,region_stack2)
+               filename   = _intrnl_include_filepath(result.filename,fortran_filepath)
+               included_linemaps = _intrnl_preprocess_and_normalize_include_file(filename,macro_stack,region_stack1,region_stack2)
                handled = True
         # if cond. true, push new region to stack
         if stripped_first_line.startswith("if"):
@@ -174,6 +415,12 @@ def _intrnl_handle_preprocessor_directive(lines,fortran_filepath,macro_stack,reg
 
     return included_linemaps
 
+def _intrnl_get_line_continuation_pattern():
+    global __p_line_continuation
+    if __p_line_continuation == None or __p_line_continuation.pattern != PATTERN_LINE_CONTINUATION:
+        __p_line_continuation = re.compile(PATTERN_LINE_CONTINUATION)
+    return __p_line_continuation
+
 def _intrnl_convert_lines_to_statements(lines):
     """Fortran lines can contain multiple statements that
     are separated by a semicolon.
@@ -181,12 +428,12 @@ def _intrnl_convert_lines_to_statements(lines):
     Additionally, it converts single-line Fortran if statements
     into multi-line if-then-endif statements.
     """
-    global PATTERN_LINE_CONTINUATION
-
-    pContinuation = re.compile(PATTERN_LINE_CONTINUATION)
-    # we look for a sequence ") <word>" were word != "then".
-    p_single_line_if = re.compile(r"^(?P<indent>[\s\t]*)(?P<head>if\s*\(.+\))\s*\b(?!then)(?P<body>\w.+)",re.IGNORECASE)
+    pContinuation = _intrnl_get_line_continuation_pattern()
     
+    # single statement, nothing to convert
+    if len(lines) == 1 and ";" not in lines[0] and not p_single_line_if.search(lines[0]) and not pContinuation.search(lines[0]):
+        return [lines[0]]
+
     # Try to determine indent char and width
     first_line = lines[0]
     num_indent_chars = len(first_line)-len(first_line.lstrip(' '))
@@ -226,8 +473,6 @@ def _intrnl_detect_line_starts(lines):
     The difference between the line numbers of consecutive entries
     is the number of lines the first statement occupies.
     """
-    p_directive_continuation = re.compile(r"\n[!c\*]\$\w+\&")
-
     # 1. save multi-line statements (&) in buffer
     buffering  = False
     line_starts = []
@@ -244,34 +489,51 @@ def _intrnl_detect_line_starts(lines):
     line_starts.append(len(lines))
     return line_starts
 
-def preprocess_and_normalize(fortran_file_lines,fortran_filepath,macro_stack,region_stack1,region_stack2):
-    """:param list file_lines: Lines of a file, terminated with line break characters ('\n').
-    :returns: a list of dicts with keys 'lineno', 'original_lines', 'statements'.
+def _intrnl_scan_buffer(buffer,offsets):
     """
-    global LOG_PREFIX
-    global ERROR_HANDLING
-           
-    global INDENT_WIDTH_WHITESPACE
-    global INDENT_WIDTH_TABS
-           
-    global DEFAULT_INDENT_CHAR
-    global ONLY_APPLY_USER_DEFINED_MACROS
+    Detects the line starts (see: _intrnl_detect_line_starts) and the lines that might contain multiple
+    statements, line continuations or single-line if statements with a single pass per pattern over the whole file buffer.
+    :param buffer: Text of the file or list of its lines, see: _intrnl_create_buffer.
+    :param list offsets: Offsets of the line starts in the buffer.
+    :return: The line starts and the set of indices of the lines that might need to be converted
+             to statements (see: _intrnl_convert_lines_to_statements), or None if all lines need to be converted.
+    :note: As the lines of a text buffer end with a line break, a line cannot start with a directive continuation.
+    """
+    if not isinstance(buffer,str):
+        return _intrnl_detect_line_starts(buffer), None
+    def lineno_(pos):
+        return bisect.bisect_right(offsets,pos)-1
+    num_lines     = len(offsets)-1
+    continued     = set([lineno_(match.start()) for match in p_continued_line.finditer(buffer)])
+    line_starts   = [lineno for lineno in range(num_lines) if lineno-1 not in continued]
+    line_starts.append(num_lines)
+    convert_lines = set()
+    for pattern in [p_split_site,_intrnl_get_line_continuation_pattern()]:
+        for match in pattern.finditer(buffer):
+            convert_lines.update(range(lineno_(match.start()),lineno_(max(match.start(),match.end()-1))+1))
+    return line_starts, convert_lines
 
-    utils.logging.log_enter_function(LOG_PREFIX,"preprocess_and_normalize",{
-      "fortran_filepath":fortran_filepath
-    })
-    
+def _intrnl_generate_linemaps(fortran_file_lines,buffer,offsets,fortran_filepath,macro_stack,region_stack1,region_stack2,first_line=0):
+    """
+    Preprocess and normalize the lines of a file, starting with the linemap that begins in line 'first_line' (index).
+    :param buffer: Text of the file or list of its lines, see: _intrnl_create_buffer.
+    :param list offsets: Offsets of the line starts in the buffer.
+    :return: Generator that yields each linemap together with the index of the line behind it.
+             The macro and region stacks are updated before a linemap is yielded, i.e. they describe
+             the preprocessor state in front of the next linemap.
+    """
     assert DEFAULT_INDENT_CHAR in [' ','\t'], "Indent char must be whitespace ' ' or tab '\\t'"
 
     # 1. detect line starts
-    line_starts = _intrnl_detect_line_starts(fortran_file_lines)
+    line_starts, convert_lines = _intrnl_scan_buffer(buffer,offsets)
+    if not ONLY_APPLY_USER_DEFINED_MACROS:
+        _intrnl_prefetch_include_files(buffer,fortran_filepath)
 
     # 2. go through the blocks of buffered lines
-    linemaps = []
-    for i,_ in enumerate(line_starts[:-1]):
-        line_start     = line_starts[i]
+    for i in range(bisect.bisect_left(line_starts,first_line),len(line_starts)-1):
+        line_start      = line_starts[i]
         next_line_start = line_starts[i+1]
-        lines         = fortran_file_lines[line_start:next_line_start]
+        lines           = fortran_file_lines[line_start:next_line_start]
 
         included_linemaps = []
         is_preprocessor_directive = lines[0].startswith("#")
@@ -284,7 +546,10 @@ def preprocess_and_normalize(fortran_file_lines,fortran_filepath,macro_stack,reg
                 raise e
         elif region_stack1[-1]: # in_active_region
             # Convert line to statememts
-            statements1 = _intrnl_convert_lines_to_statements(lines)
+            if convert_lines != None and next_line_start == line_start+1 and line_start not in convert_lines:
+                statements1 = lines
+            else:
+                statements1 = _intrnl_convert_lines_to_statements(lines)
             # 2. Apply macros to statements
             statements2  = []
             for stmt1 in statements1:
@@ -302,25 +567,99 @@ def preprocess_and_normalize(fortran_file_lines,fortran_filepath,macro_stack,reg
                     # (If we would do this, we can actually also linemap positional information in a next step.)
     
         #if len(included_linemaps) or (not is_preprocessor_directive and region_stack1[-1]):
-        linemap = {
-          "file":                    fortran_filepath,
-          "lineno":                  line_start+1, # key
-          "lines":                   lines,
-          "raw_statements":          statements1,
-          "included_linemaps":         included_linemaps,
-          "is_preprocessor_directive": is_preprocessor_directive,
-          "is_active":                region_stack1[-1],
-          # inout
-          "statements":              statements3,
-          "modified":                False,
-          # out
-          "prolog":                  [],
-          "epilog":                  []
-        }
+        linemap = Linemap(fortran_filepath,line_start+1,buffer,offsets[line_start],offsets[next_line_start],
+          raw_statements=None if statements1 == lines else statements1,
+          statements=None if statements3 == statements1 else statements3,
+          included_linemaps=included_linemaps,
+          is_preprocessor_directive=is_preprocessor_directive,
+          is_active=region_stack1[-1])
+        yield linemap, next_line_start
+
+def _intrnl_checkpoint(line,num_linemaps,macro_stack,region_stack1,region_stack2):
+    """:return: Snapshot of the preprocessor state in front of the given line (index), which is the start of the next linemap."""
+    return { "line": line, "linemap": num_linemaps, "macro_stack": list(macro_stack),
+             "region_stack1": list(region_stack1), "region_stack2": list(region_stack2) }
+
+def _intrnl_preprocessor_state(checkpoint):
+    """:return: Comparable representation of the preprocessor state of a checkpoint."""
+    return ([(macro["name"],tuple(macro["args"]),macro["subst"]) for macro in checkpoint["macro_stack"]],
+            checkpoint["region_stack1"],checkpoint["region_stack2"])
+
+def _intrnl_add_checkpoint(checkpoints,linemap,line,num_linemaps,num_lines,macro_stack,region_stack1,region_stack2):
+    """
+    Checkpoint the preprocessor state behind 'linemap' if it is an include directive, if CHECKPOINT_INTERVAL lines have passed since
+    the last checkpoint, or at the end of the file.
+    Only the state in active regions is checkpointed, as the linemaps of inactive regions depend on the preceding linemaps.
+    """
+    if region_stack1[-1] and (len(linemap.included_linemaps) or line == num_lines or\
+       line - checkpoints[-1]["line"] >= CHECKPOINT_INTERVAL):
+        checkpoints.append(_intrnl_checkpoint(line,num_linemaps,macro_stack,region_stack1,region_stack2))
+
+def _intrnl_shift_linemap(linemap,buffer,offset_delta,lineno_delta):
+    """:return: Copy of the linemap that has been moved by 'lineno_delta' lines, whose lines are taken from 'buffer' if the buffer is of the same kind."""
+    linemap = linemap.copy()
+    linemap.lineno += lineno_delta
+    if type(linemap._buffer) == type(buffer):
+        linemap._buffer = buffer
+        linemap._start += offset_delta
+        linemap._end   += offset_delta
+    return linemap
+
+def _intrnl_renormalize(fortran_file_lines,fortran_filepath,previous):
+    """
+    Re-normalize the part of the file that has changed compared to the lines of a previous snapshot.
+    Normalization restarts at the last checkpoint in front of the first changed line. As soon as a checkpoint behind the
+    last changed line is reached with the same preprocessor state, the remaining linemaps are copied from the snapshot.
+    :return: The linemaps, the checkpoints and per linemap the index of the linemap of the snapshot that it was copied from or None.
+    """
+    old_lines, old_linemaps, old_checkpoints = previous["lines"], previous["linemaps"], previous["checkpoints"]
+    num_old_lines, num_lines = len(old_lines), len(fortran_file_lines)
+    if old_lines == fortran_file_lines:
+        return _intrnl_copy_linemaps(old_linemaps), [dict(checkpoint) for checkpoint in old_checkpoints], list(range(len(old_linemaps)))
+    num_common = min(num_old_lines,num_lines)
+    prefix = 0
+    while prefix < num_common and old_lines[prefix] == fortran_file_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < num_common-prefix and old_lines[num_old_lines-1-suffix] == fortran_file_lines[num_lines-1-suffix]:
+        suffix += 1
+    lineno_delta = num_lines - num_old_lines
+    # the end of the old file is no line start in the new file if its last line is continued
+    k = max([k for k,checkpoint in enumerate(old_checkpoints)
+             if checkpoint["line"] <= prefix and (checkpoint["line"] < num_old_lines or checkpoint["line"] == 0)])
+    restart = old_checkpoints[k]
+    utils.logging.log_debug1(LOG_PREFIX,"_intrnl_renormalize","'{}': lines {} to {} changed, restart in line {}",
+      fortran_filepath,prefix+1,num_lines-suffix,restart["line"]+1)
+
+    linemaps    = _intrnl_copy_linemaps(old_linemaps[:restart["linemap"]])
+    reused      = list(range(restart["linemap"]))
+    checkpoints = [dict(checkpoint) for checkpoint in old_checkpoints[:k+1]]
+    resync      = { checkpoint["line"]+lineno_delta: k for k,checkpoint in enumerate(old_checkpoints)
+                    if checkpoint["line"] >= num_old_lines-suffix and checkpoint["line"] > restart["line"] }
+    macro_stack   = list(restart["macro_stack"])
+    region_stack1 = list(restart["region_stack1"])
+    region_stack2 = list(restart["region_stack2"])
+    buffer, offsets = _intrnl_create_buffer(fortran_file_lines)
+    for linemap, next_line_start in _intrnl_generate_linemaps(fortran_file_lines,buffer,offsets,fortran_filepath,
+                                      macro_stack,region_stack1,region_stack2,first_line=restart["line"]):
         linemaps.append(linemap)
-    
-    utils.logging.log_leave_function(LOG_PREFIX,"preprocess_and_normalize")
-    return linemaps
+        reused.append(None)
+        k = resync.get(next_line_start)
+        if k != None and _intrnl_preprocessor_state(_intrnl_checkpoint(next_line_start,len(linemaps),macro_stack,region_stack1,region_stack2)) ==\
+           _intrnl_preprocessor_state(old_checkpoints[k]):
+            utils.logging.log_debug1(LOG_PREFIX,"_intrnl_renormalize","'{}': reuse linemaps from line {} on",fortran_filepath,next_line_start+1)
+            first = old_checkpoints[k]["linemap"]
+            if first < len(old_linemaps):
+                offset_delta = offsets[next_line_start] - old_linemaps[first]._start
+                for j in range(first,len(old_linemaps)):
+                    linemaps.append(_intrnl_shift_linemap(old_linemaps[j],buffer,offset_delta,lineno_delta))
+                    reused.append(j)
+            linemap_delta = len(linemaps) - len(old_linemaps)
+            for checkpoint in old_checkpoints[k:]:
+                checkpoints.append(dict(checkpoint,line=checkpoint["line"]+lineno_delta,linemap=checkpoint["linemap"]+linemap_delta))
+            break
+        _intrnl_add_checkpoint(checkpoints,linemap,next_line_start,len(linemaps),num_lines,macro_stack,region_stack1,region_stack2)
+    return linemaps, checkpoints, reused
 
 def _intrnl_preprocess_and_normalize_fortran_file(fortran_filepath,macro_stack,region_stack1,region_stack2):
     """
@@ -338,6 +677,150 @@ def _intrnl_preprocess_and_normalize_fortran_file(fortran_filepath,macro_stack,r
     except Exception as e:
             raise e
 
+def _intrnl_copy_linemaps(linemaps):
+    """
+    :return: Copies of the linemaps that share the read-only entries, e.g. 'lines' and 'raw_statements',
+             but not the entries that the scanner modifies ('statements','modified','prolog','epilog').
+    """
+    return [linemap.copy() for linemap in linemaps]
+
+def _intrnl_include_cache_options():
+    return (PATTERN_LINE_CONTINUATION,ONLY_APPLY_USER_DEFINED_MACROS,
+            INDENT_WIDTH_WHITESPACE,INDENT_WIDTH_TABS,DEFAULT_INDENT_CHAR)
+
+def _intrnl_stat_file(filepath):
+    stat = os.stat(filepath)
+    return (filepath,stat.st_mtime_ns,stat.st_size)
+
+def _intrnl_include_filepath(filename,fortran_filepath):
+    """:return: Path of a file included by 'fortran_filepath'; relative paths are relative to the directory of the includer."""
+    filename    = filename.strip(" \t")
+    current_dir = os.path.dirname(fortran_filepath)
+    if not filename.startswith("/") and len(current_dir):
+        filename = current_dir + "/" + filename
+    return filename
+
+def _intrnl_load_include_file(filepath):
+    """:return: Tuple of the file info (see: _intrnl_stat_file) and the lines of the file."""
+    file_info = _intrnl_stat_file(filepath)
+    with open(filepath,"r") as infile:
+        return file_info, infile.readlines()
+
+def _intrnl_prefetch_include_files(buffer,fortran_filepath):
+    """
+    Read the files included by the buffer ahead of time (see: utils.prefetch) unless they are in the include cache. 
+    Include directives in inactive regions are prefetched too.
+    """
+    if isinstance(buffer,str):
+        for filename in p_include_directive.findall(buffer):
+            filepath = _intrnl_include_filepath(filename,fortran_filepath)
+            if filepath not in __include_cache:
+                utils.prefetch.prefetch(filepath,_intrnl_load_include_file)
+
+def _intrnl_include_cache_subdir(filepath):
+    return os.path.join(INCLUDE_CACHE_DIR,hashlib.sha1(filepath.encode("utf-8")).hexdigest())
+
+def _intrnl_add_include_cache_entry(filepath,entry):
+    variants = __include_cache.setdefault(filepath,[])
+    if len(variants) >= __MAX_CACHED_INCLUDE_VARIANTS:
+        variants.pop(0)
+    variants.append(entry)
+
+def _intrnl_load_shared_include_cache_entries(filepath):
+    """Load the variants of the include file that other processes have stored in INCLUDE_CACHE_DIR."""
+    try:
+        subdir = _intrnl_include_cache_subdir(filepath)
+        for filename in sorted(os.listdir(subdir)):
+            entry_filepath = os.path.join(subdir,filename)
+            if filename.endswith(".pickle") and entry_filepath not in __loaded_include_cache_files:
+                __loaded_include_cache_files.add(entry_filepath)
+                with open(entry_filepath,"rb") as infile:
+                    _intrnl_add_include_cache_entry(filepath,pickle.load(infile))
+    except (OSError,pickle.PickleError,EOFError):
+        pass
+
+def _intrnl_store_shared_include_cache_entry(filepath,entry):
+    """Store the variant of the include file in INCLUDE_CACHE_DIR; write to a temporary file first so that readers never see partial files."""
+    try:
+        subdir = _intrnl_include_cache_subdir(filepath)
+        os.makedirs(subdir,exist_ok=True)
+        entry_filepath = os.path.join(subdir,"{}-{}.pickle".format(os.getpid(),len(__loaded_include_cache_files)))
+        with open(entry_filepath+".tmp","wb") as outfile:
+            pickle.dump(entry,outfile,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(entry_filepath+".tmp",entry_filepath)
+        __loaded_include_cache_files.add(entry_filepath)
+    except OSError:
+        pass
+
+def _intrnl_lookup_include_cache(filepath,macro_table):
+    """:return: A variant of the include file whose files are unchanged and that has been normalized with the same options and definitions of the referenced macros, or None."""
+    if INCLUDE_CACHE_DIR != None:
+        _intrnl_load_shared_include_cache_entries(filepath)
+    options = _intrnl_include_cache_options()
+    for entry in reversed(__include_cache.get(filepath,[])):
+        if (entry["options"] == options
+           and entry["macros"] == frozenset([(name,macro_table[name][2]) for name in _intrnl_referenced_macros(entry["identifiers"],macro_table)])):
+            try:
+                if all(_intrnl_stat_file(file_info[0]) == file_info for file_info in entry["files"]):
+                    return entry
+            except OSError:
+                pass
+    return None
+
+def _intrnl_preprocess_and_normalize_include_file(filepath,macro_stack,region_stack1,region_stack2):
+    """
+    Preprocess and normalize an included file. Results are cached per include file path;
+    a cached result is reused if the file and its nested includes are unchanged (mtime,size) and the macros that
+    they reference (directly or via other macros) have the same definitions as when the result was created.
+    The macro definitions/removals of the file are replayed on the macro stack.
+    If INCLUDE_CACHE_DIR is set, results are shared with other processes via this directory.
+    :return: Copies of the cached linemaps, i.e. modifications by the caller do not affect other includers.
+    :throws: IOError if the specified file cannot be found/accessed.
+    """
+    utils.logging.log_enter_function(LOG_PREFIX,"_intrnl_preprocess_and_normalize_include_file",{
+      "filepath":filepath
+    })
+
+    macro_table = _intrnl_get_macro_table(macro_stack)
+    entry = _intrnl_lookup_include_cache(filepath,macro_table)
+    if entry != None:
+        utils.logging.log_debug2(LOG_PREFIX,"_intrnl_preprocess_and_normalize_include_file","reuse cached linemaps of '{}'",filepath)
+        if len(entry["removed_macros"]):
+            macro_stack[:] = [macro for macro in macro_stack if macro["name"] not in entry["removed_macros"]]
+        macro_stack += [dict(macro) for macro in entry["added_macros"]]
+        linemaps = _intrnl_copy_linemaps(entry["linemaps"])
+    else:
+        file_info, lines = utils.prefetch.read(filepath,_intrnl_load_include_file)
+        macro_stack_before   = list(macro_stack)
+        region_stacks_before = (list(region_stack1),list(region_stack2))
+        __include_recorders.append({ "files": [], "identifiers": set() })
+        try:
+            linemaps = preprocess_and_normalize(lines,filepath,macro_stack,region_stack1,region_stack2)
+        finally:
+            recorder = __include_recorders.pop()
+        identifiers = frozenset(p_identifier.findall("".join(lines))) | recorder["identifiers"]
+        macro_ids_before = set(id(macro) for macro in macro_stack_before)
+        macro_ids_after  = set(id(macro) for macro in macro_stack)
+        entry = {
+          "files":          [file_info] + recorder["files"],
+          "options":        _intrnl_include_cache_options(),
+          "identifiers":    identifiers,
+          "macros":         frozenset([(name,macro_table[name][2]) for name in _intrnl_referenced_macros(identifiers,macro_table)]),
+          "removed_macros": frozenset([macro["name"] for macro in macro_stack_before if id(macro) not in macro_ids_after]),
+          "added_macros":   [dict(macro) for macro in macro_stack if id(macro) not in macro_ids_before],
+          "linemaps":       _intrnl_copy_linemaps(linemaps),
+        }
+        if region_stacks_before == (region_stack1,region_stack2): # file does not open/close regions of its includer
+            _intrnl_add_include_cache_entry(filepath,entry)
+            if INCLUDE_CACHE_DIR != None:
+                _intrnl_store_shared_include_cache_entry(filepath,entry)
+    if len(__include_recorders):
+        __include_recorders[-1]["files"]       += entry["files"]
+        __include_recorders[-1]["identifiers"] |= entry["identifiers"]
+    
+    utils.logging.log_leave_function(LOG_PREFIX,"_intrnl_preprocess_and_normalize_include_file")
+    return linemaps
+
 def init_macros(options):
     """init macro stack from compiler options and user-prescribed config values."""
     global USER_DEFINED_MACROS
@@ -347,117 +830,118 @@ def init_macros(options):
     for result,_,__ in pp_compiler_option.scanString(options):
         value = result.value
         if value == None:
-            value == "1"
-        macro = { "name": result.name, "args": [], "subst": result.value }
+            value = "1"
+        macro = { "name": result.name, "args": [], "subst": value }
         macro_stack.append(macro)
     return macro_stack
 
-def _intrnl_group_modified_linemaps(linemaps):
-    """Find contiguous blocks of modified lines and blank lines between them."""
-    global LINE_GROUPING_WRAP_IN_IFDEF
-    global LINE_GROUPING_INCLUDE_BLANK_LINES
-    
-    utils.logging.log_enter_function(LOG_PREFIX,"_intrnl_group_modified_linemaps")
+def _intrnl_modification_flags(linemap):
+    """
+    :return: Tuple of flags that indicate if the linemap or one of its included linemaps has been modified,
+             has a prolog, or has an epilog. Each included linemap is visited once.
+    """
+    modified, has_prolog, has_epilog = linemap.modified, len(linemap.prolog) > 0, len(linemap.epilog) > 0
+    for included_linemap in linemap.included_linemaps:
+        included_modified, included_has_prolog, included_has_epilog = _intrnl_modification_flags(included_linemap)
+        modified   = modified or included_modified
+        has_prolog = has_prolog or included_has_prolog
+        has_epilog = has_epilog or included_has_epilog
+    return modified, has_prolog, has_epilog
 
-    EMPTY_BLOCK    = { "min_lineno": -1, "max_lineno": -1, "orig": "", "subst": "",\
-                       "only_prolog": False, "only_epilog": False}
-    blocks         = []
-    current_linemaps = []
+def _intrnl_contains_blank_line(linemap):
+    return len(linemap.lines) == 1 and not len(linemap.lines[0].lstrip(" \t\n"))
 
-    # auxiliary local functions
-    def max_lineno_(linemap):
-        return linemap["lineno"] + len(linemap["lines"]) - 1
-    def borders_previous_linemap_(linemap):
-        nonlocal current_linemaps
-        if len(current_linemaps):
-            return linemap["lineno"] == max_lineno_(current_linemaps[-1])+1
-        else:
-            return True
-    def contains_blank_line_(linemap):
-        return len(linemap["lines"]) == 1 and not len(linemap["lines"][0].lstrip(" \t\n"))
-    def was_modified_(linemap):
-        modified = linemap["modified"]
-        for linemap in linemap["included_linemaps"]:
-            modified = modified or was_modified_(linemap)
-        return modified
-    def has_prolog_(linemap):
-        result = len(linemap["prolog"])
-        for linemap in linemap["included_linemaps"]:
-            result = result or has_prolog_(linemap)
-        return result
-    def has_epilog_(linemap):
-        result = len(linemap["epilog"])
-        for linemap in linemap["included_linemaps"]:
-            result = result or has_epilog_(linemap)
-        return result
-    def to_string_(list_of_strings):
-        return "\n".join([el.rstrip("\n") for el in list_of_strings if el is not None]) + "\n"
-    def collect_subst_(linemap):
+def _intrnl_join_lines(list_of_strings):
+    return "\n".join([el.rstrip("\n") for el in list_of_strings if el is not None]) + "\n"
+
+def _intrnl_collect_subst(linemap):
+    subst = []
+    if len(linemap.prolog):
+        subst += linemap.prolog
+    if len(linemap.included_linemaps):
+        for included_linemap in linemap.included_linemaps:
+            subst += _intrnl_collect_subst(included_linemap)
+    elif linemap.modified:
+        subst += linemap.statements
+    else: # for included linemaps
+        subst += linemap.lines
+    if len(linemap.epilog):
+        subst += linemap.epilog
+    return subst
+
+def _intrnl_render_block(block_linemaps,first_flags):
+    """
+    :param list block_linemaps: Contiguous linemaps that are replaced by their modified statements, prologs and epilogs.
+    :param tuple first_flags: Modification flags of the first linemap, see: _intrnl_modification_flags.
+    :return: Text that replaces the lines of the block.
+    """
+    original = "".join([_intrnl_join_lines(linemap.lines) for linemap in block_linemaps]).rstrip("\n")
+    # special treatment for single-linemap blocks which are not modified
+    # and are no #include statements but have prolog or epilog
+    only_prolog = only_epilog = False
+    if len(block_linemaps) == 1 and not block_linemaps[0].modified and not\
+       len(block_linemaps[0].included_linemaps):
+        linemap     = block_linemaps[0]
+        only_prolog = first_flags[1] and not first_flags[2] # xor
+        only_epilog = first_flags[2] and not first_flags[1]
+        subst       = _intrnl_join_lines(linemap.prolog + linemap.epilog)
+    else:
         subst = []
-        if len(linemap["prolog"]):
-            subst += linemap["prolog"]
-        if len(linemap["included_linemaps"]):
-            for linemap in linemap["included_linemaps"]:
-                subst += collect_subst_(linemap)
-        elif linemap["modified"]:
-            subst += linemap["statements"]
-        else: # for included linemaps
-            subst += linemap["lines"]
-        if len(linemap["epilog"]):
-            subst += linemap["epilog"]
-        return subst
-
-    def append_current_block_if_non_empty_():
-        # append current block if it is not empty
-        # or does only contain blank lines.
-        nonlocal blocks
+        for linemap in block_linemaps:
+            subst += _intrnl_collect_subst(linemap)
+        subst = _intrnl_join_lines(subst)
+    if LINE_GROUPING_WRAP_IN_IFDEF:
+        if only_epilog:
+            return "{2}\n#ifdef {0}\n{1}\n#endif\n".format(LINE_GROUPING_IFDEF_MACRO,subst.rstrip("\n"),original)
+        elif only_prolog:
+            return "#ifdef {0}\n{1}\n#endif\n{2}\n".format(LINE_GROUPING_IFDEF_MACRO,subst.rstrip("\n"),original)
+        elif len(subst.strip(" \n\t")):
+            return "#ifdef {0}\n{1}\n#else\n{2}\n#endif\n".format(LINE_GROUPING_IFDEF_MACRO,subst.rstrip("\n"),original)
+        else:
+            return "#ifndef {0}\n{1}\n#endif\n".format(LINE_GROUPING_IFDEF_MACRO,original)
+    else:
+        if only_epilog:
+            return original + "\n" + subst.rstrip("\n") + "\n"
+        elif only_prolog:
+            return subst.rstrip("\n") + "\n" + original + "\n"
+        else:
+            return subst.rstrip("\n") + "\n"
+
+def _intrnl_generate_modified_file_chunks(linemaps):
+    """
+    Walks the linemaps once and groups contiguous modified linemaps, linemaps with prolog or epilog, and blank lines 
+    between them into blocks. Blocks must start with such a linemap; trailing blank lines are not part of a block.
+    :return: Generator that yields the original lines of the unmodified linemaps and the rendered blocks in file order.
+    """
+    current_linemaps = [] # current block
+    first_flags      = None
+    
+    def flush_current_block_():
         nonlocal current_linemaps
-        if len(current_linemaps): # remove blank lines
-            while contains_blank_line_(current_linemaps[-1]):
-                current_linemaps.pop()
-        if len(current_linemaps): # len might have changed
-            block = dict(EMPTY_BLOCK) # shallow copy
-            block["min_lineno"] = current_linemaps[0]["lineno"]
-            block["max_lineno"] = max_lineno_(current_linemaps[-1])
-            
-            subst = []
-            for linemap in current_linemaps:
-                block["orig"]  += to_string_(linemap["lines"])
-                subst          += collect_subst_(linemap)
-            # special treatment for single-linemap blocks which are not modified
-            # and are no #include statements but have prolog or epilog
-            if len(current_linemaps) == 1 and not current_linemaps[0]["modified"] and not\
-               len(current_linemaps[0]["included_linemaps"]):
-                linemap = current_linemaps[0]
-                #assert has_prolog_(linemap) or has_prolog_(linemap)
-                block["only_prolog"] = has_prolog_(linemap)
-                block["only_epilog"] = has_epilog_(linemap)
-                if block["only_epilog"]: # xor
-                    block["only_epilog"] = not block["only_prolog"]
-                    block["only_prolog"] = False
-                block["subst"] = to_string_(linemap["prolog"] + linemap["epilog"])
-            else:
-                block["subst"] = to_string_(subst)
-            blocks.append(block)
-
-    # 1. find contiguous blocks of modified or blank lines
-    # 2. blocks must start with modified lines
-    # 3. blank lines must be removed from tail of block
-    for i,linemap in enumerate(linemaps):
-        lineno = linemap["lineno"]
-        if was_modified_(linemap) or has_prolog_(linemap) or has_epilog_(linemap):
-            if not LINE_GROUPING_WRAP_IN_IFDEF or not borders_previous_linemap_(linemap):
-                append_current_block_if_non_empty_()
-                current_linemaps = []
+        num_linemaps = len(current_linemaps)
+        while num_linemaps > 1 and _intrnl_contains_blank_line(current_linemaps[num_linemaps-1]): # first linemap is modified
+            num_linemaps -= 1
+        if num_linemaps:
+            yield _intrnl_render_block(current_linemaps[:num_linemaps],first_flags)
+        for linemap in current_linemaps[num_linemaps:]:
+            yield from linemap.lines
+        current_linemaps = []
+    
+    for linemap in linemaps:
+        flags = _intrnl_modification_flags(linemap)
+        if any(flags):
+            if not LINE_GROUPING_WRAP_IN_IFDEF or not len(current_linemaps) or\
+               linemap.lineno != current_linemaps[-1].lineno + len(current_linemaps[-1].lines):
+                yield from flush_current_block_()
+                first_flags = flags
             current_linemaps.append(linemap)
-        elif LINE_GROUPING_INCLUDE_BLANK_LINES and len(current_linemaps) and contains_blank_line_(linemap) and borders_previous_linemap_(linemap):
+        elif LINE_GROUPING_INCLUDE_BLANK_LINES and len(current_linemaps) and _intrnl_contains_blank_line(linemap) and\
+             linemap.lineno == current_linemaps[-1].lineno + len(current_linemaps[-1].lines):
             current_linemaps.append(linemap)
-    # append last block
-    append_current_block_if_non_empty_()
-    
-    utils.logging.log_leave_function(LOG_PREFIX,"_intrnl_group_modified_linemaps")
-    
-    return blocks
+        else:
+            yield from flush_current_block_()
+            yield from linemap.lines
+    yield from flush_current_block_()
 
 # API
 
@@ -470,85 +954,31 @@ def init_macros(options):
     for result,_,__ in pp_compiler_option.scanString(options):
         value = result.value
         if value == None:
-            value == "1"
-        macro = { "name": result.name, "args": [], "subst": result.value }
+            value = "1"
+        macro = { "name": result.name, "args": [], "subst": value }
         macro_stack.append(macro)
     return macro_stack
 
-def preprocess_and_normalize(fortran_file_lines,fortran_filepath,macro_stack=[],region_stack1=[True],region_stack2=[True]):
+def preprocess_and_normalize(fortran_file_lines,fortran_filepath,macro_stack=[],region_stack1=[True],region_stack2=[True],checkpoints=None):
     """:param list file_lines: Lines of a file, terminated with line break characters ('\n').
-    :returns: a list of dicts with keys 'lineno', 'original_lines', 'statements'.
+    :param list checkpoints: If not None, snapshots of the preprocessor state are appended to this list, see: _intrnl_add_checkpoint.
+    :returns: a list of Linemap objects.
     """
     global LOG_PREFIX
     global ERROR_HANDLING
-           
-    global INDENT_WIDTH_WHITESPACE
-    global INDENT_WIDTH_TABS
-           
-    global DEFAULT_INDENT_CHAR
-    global ONLY_APPLY_USER_DEFINED_MACROS
 
     utils.logging.log_enter_function(LOG_PREFIX,"preprocess_and_normalize",{
       "fortran_filepath":fortran_filepath
     })
     
-    assert DEFAULT_INDENT_CHAR in [' ','\t'], "Indent char must be whitespace ' ' or tab '\\t'"
-
-    # 1. detect line starts
-    line_starts = _intrnl_detect_line_starts(fortran_file_lines)
-
-    # 2. go through the blocks of buffered lines
+    buffer, offsets = _intrnl_create_buffer(fortran_file_lines)
+    if checkpoints != None:
+        checkpoints.append(_intrnl_checkpoint(0,0,macro_stack,region_stack1,region_stack2))
     linemaps = []
-    for i,_ in enumerate(line_starts[:-1]):
-        line_start      = line_starts[i]
-        next_line_start = line_starts[i+1]
-        lines           = fortran_file_lines[line_start:next_line_start]
-
-        included_linemaps = []
-        is_preprocessor_directive = lines[0].startswith("#")
-        if is_preprocessor_directive and not ONLY_APPLY_USER_DEFINED_MACROS:
-            try:
-                included_linemaps = _intrnl_handle_preprocessor_directive(lines,fortran_filepath,macro_stack,region_stack1,region_stack2)
-                statements1 = []
-                statements3 = []
-            except Exception as e:
-                raise e
-        elif region_stack1[-1]: # in_active_region
-            # Convert line to statememts
-            statements1 = _intrnl_convert_lines_to_statements(lines)
-            # 2. Apply macros to statements
-            statements2  = []
-            for stmt1 in statements1:
-                statements2.append(_intrnl_expand_macros(stmt1,macro_stack))
-            # 3. Above processing might introduce multiple statements per line againa.
-            # Hence, convert each element of statements2 to single statements again
-            statements3 = []
-            for stmt2 in statements2:
-                for stmt3 in _intrnl_convert_lines_to_statements([stmt2]):
-                    statements3.append(stmt3)
-                    # TODO(Dominic): In case, we really need to assume that people write Fortran code
-                    # such as `module mymod; integer :: myint; end module` and we therefore might
-                    # require epilog/prolog per line, this will be the place where replace 
-                    # the string stmt3 by a dictionary.
-                    # (If we would do this, we can actually also linemap positional information in a next step.)
-    
-        #if len(included_linemaps) or (not is_preprocessor_directive and region_stack1[-1]):
-        linemap = {
-          "file":                    fortran_filepath,
-          "lineno":                  line_start+1, # key
-          "lines":                   lines,
-          "raw_statements":          statements1,
-          "included_linemaps":         included_linemaps,
-          "is_preprocessor_directive": is_preprocessor_directive,
-          "is_active":                region_stack1[-1],
-          # inout
-          "statements":              statements3,
-          "modified":                False,
-          # out
-          "prolog":                  [],
-          "epilog":                  []
-        }
+    for linemap, next_line_start in _intrnl_generate_linemaps(fortran_file_lines,buffer,offsets,fortran_filepath,macro_stack,region_stack1,region_stack2):
         linemaps.append(linemap)
+        if checkpoints != None:
+            _intrnl_add_checkpoint(checkpoints,linemap,next_line_start,len(linemaps),len(fortran_file_lines),macro_stack,region_stack1,region_stack2)
     
     utils.logging.log_leave_function(LOG_PREFIX,"preprocess_and_normalize")
     return linemaps
@@ -583,62 +1013,88 @@ def read_file(fortran_filepath,options=""):
     except Exception as e:
         raise e
 
-def write_modified_file(outfile_path,infile_path,linemaps,preamble=""):
-    """TODO docu"""
-    global LINE_GROUPING_WRAP_IN_IFDEF
-    global LINE_GROUPING_MACRO
+def read_file_incrementally(fortran_filepath,options="",previous=None):
+    """
+    Like read_file but re-normalizes only the changed part of the file if a snapshot of a previous call is passed.
+    The preprocessor state (macro and region stacks) is checkpointed behind include directives and every CHECKPOINT_INTERVAL lines.
+    Normalization restarts at the last checkpoint in front of the first changed line, and the linemaps of the snapshot
+    are reused behind the changed lines as soon as the preprocessor state matches the state of the snapshot again.
+    The whole file is normalized if the options, the user-defined macros, the linemapper options or an included file have changed.
+    :param previous: Snapshot returned by a previous call for the same file, or None.
+    :return: Tuple of the linemaps, a snapshot that can be passed to the next call, and per linemap the index of the linemap
+             of the previous snapshot that has been reused, or None if the linemap has been (re-)created.
+    :throws: IOError if the specified file cannot be found/accessed.
+    """
+    utils.logging.log_enter_function(LOG_PREFIX,"read_file_incrementally",{
+      "fortran_filepath":fortran_filepath,
+      "options":options
+    })
+
+    macro_stack = init_macros(options)
+    fingerprint = (fortran_filepath,_intrnl_include_cache_options(),
+                   _intrnl_preprocessor_state(_intrnl_checkpoint(0,0,macro_stack,[True],[True])))
+    if previous != None:
+        try:
+            if previous["fingerprint"] != fingerprint or\
+               any(_intrnl_stat_file(file_info[0]) != file_info for file_info in previous["files"]):
+                previous = None
+        except OSError:
+            previous = None
+    with open(fortran_filepath,"r") as infile:
+        fortran_file_lines = infile.readlines()
+    __include_recorders.append({ "files": [], "identifiers": set() })
+    try:
+        if previous != None:
+            linemaps, checkpoints, reused = _intrnl_renormalize(fortran_file_lines,fortran_filepath,previous)
+            files = list(previous["files"])
+        else:
+            checkpoints = []
+            linemaps = preprocess_and_normalize(fortran_file_lines,fortran_filepath,macro_stack,[True],[True],checkpoints)
+            reused   = [None]*len(linemaps)
+            files    = []
+    finally:
+        recorder = __include_recorders.pop()
+    snapshot = {
+      "fingerprint": fingerprint,
+      "lines":       fortran_file_lines,
+      "linemaps":    _intrnl_copy_linemaps(linemaps),
+      "checkpoints": checkpoints,
+      "files":       files + [file_info for file_info in recorder["files"] if file_info not in files],
+    }
     
+    utils.logging.log_leave_function(LOG_PREFIX,"read_file_incrementally")
+    return linemaps, snapshot, reused
+
+def write_modified_file(outfile_path,infile_path,linemaps,preamble=""):
+    """
+    Write the modified source file. Contiguous modified linemaps are replaced by their statements
+    (and the original lines if LINE_GROUPING_WRAP_IN_IFDEF is set), prologs and epilogs are inserted.
+    The output is streamed block by block; unmodified lines are taken from the linemaps.
+    :param str infile_path: Path of the input file, only used for logging.
+    :param str preamble: Text to prepend to the file, or None.
+    """
     utils.logging.log_enter_function(LOG_PREFIX,"write_modified_file",\
       {"infile_path":infile_path,"outfile_path":outfile_path})
 
-    blocks = _intrnl_group_modified_linemaps(linemaps)
-
-    output      = ""
-    block_id     = 0
-    lines_to_skip = -1
-    with open(infile_path,"r") as infile:
-        for lineno,line in enumerate(infile.readlines(),start=1):
-            if block_id < len(blocks) and\
-               lineno == blocks[block_id]["min_lineno"]:
-                block       = blocks[block_id]
-                lines_to_skip = block["max_lineno"] - block["min_lineno"]
-                subst       = block["subst"].rstrip("\n")
-                original    = block["orig"].rstrip("\n")
-                if LINE_GROUPING_WRAP_IN_IFDEF:
-                    if block["only_epilog"]:
-                        output += "{2}\n#ifdef {0}\n{1}\n#endif\n".format(\
-                          LINE_GROUPING_IFDEF_MACRO,subst,original)
-                    elif block["only_prolog"]:
-                        output += "#ifdef {0}\n{1}\n#endif\n{2}\n".format(\
-                          LINE_GROUPING_IFDEF_MACRO,subst,original)
-                    else:
-                        if len(block["subst"].strip(" \n\t")):
-                            output += "#ifdef {0}\n{1}\n#else\n{2}\n#endif\n".format(\
-                              LINE_GROUPING_IFDEF_MACRO,subst,original)
-                        else:
-                            output += "#ifndef {0}\n{2}\n#endif\n".format(\
-                              LINE_GROUPING_IFDEF_MACRO,subst,original)
-                else:
-                    if block["only_epilog"]:
-                        output += original + "\n" + subst + "\n"
-                    elif block["only_prolog"]:
-                        output += subst + "\n" + original + "\n"
-                    else:
-                        output += subst + "\n"
-                block_id +=1
-            elif lines_to_skip > 0:
-                lines_to_skip -= 1
-            else:
-                output += line
-    if preamble != None and len(preamble):
-        if LINE_GROUPING_WRAP_IN_IFDEF:
-            preamble2 = "#ifdef {}\n{}\n#endif".format(\
-              LINE_GROUPING_IFDEF_MACRO,preamble.rstrip("\n"))
-        else:
-            preamble2 = preamble.rstrip("\n")
-        output = preamble2+"\n" + output
+    utils.fileutils.prepare_output_file(outfile_path)
     with open(outfile_path,"w") as outfile:
-        outfile.write(output.rstrip("\n"))
+        pending_line_breaks = "" # trailing line breaks of the file are dropped
+        def write_(chunk):
+            nonlocal pending_line_breaks
+            text = chunk.rstrip("\n")
+            if len(text):
+                outfile.write(pending_line_breaks)
+                outfile.write(text)
+                pending_line_breaks = chunk[len(text):]
+            else:
+                pending_line_breaks += chunk
+        if preamble != None and len(preamble):
+            if LINE_GROUPING_WRAP_IN_IFDEF:
+                write_("#ifdef {}\n{}\n#endif\n".format(LINE_GROUPING_IFDEF_MACRO,preamble.rstrip("\n")))
+            else:
+                write_(preamble.rstrip("\n")+"\n")
+        for chunk in _intrnl_generate_modified_file_chunks(linemaps):
+            write_(chunk)
     
     utils.logging.log_leave_function(LOG_PREFIX,"write_modified_file")
 
@@ -658,13 +1114,13 @@ def render_file(linemaps,stage="statements",include_inactive=False,include_prepr
 
         result = ""
         for linemap in linemaps:
-            condition1 = include_inactive or (linemap["is_active"])
-            condition2 = include_preprocessor_directives or (len(linemap["included_linemaps"]) or not linemap["is_preprocessor_directive"])
+            condition1 = include_inactive or (linemap.is_active)
+            condition2 = include_preprocessor_directives or (len(linemap.included_linemaps) or not linemap.is_preprocessor_directive)
             if condition1 and condition2:
-                if len(linemap["included_linemaps"]):
-                    result += render_file_(linemap["included_linemaps"])
+                if len(linemap.included_linemaps):
+                    result += render_file_(linemap.included_linemaps)
                 else:
-                    result += "".join(linemap[stage])
+                    result += "".join(getattr(linemap,stage))
         return result
 
     utils.logging.log_leave_function(LOG_PREFIX,"render_file")
@@ -7,6 +7,7 @@ import copy
 import argparse
 import itertools
 import hashlib
+import pickle
 from collections import Iterable # < py38
 import importlib
 import logging
@@ -17,24 +18,71 @@ import re
 import addtoplevelpath
 import translator.translator as translator
 import indexer.scoper as scoper
+import utils.codecache
 import utils.pyparsingutils
 #import scanner.normalizer as normalizer
 
 SCANNER_ERROR_CODE = 1000
+
+# Scanner tree extension and backends per source dialect.
+# They are only loaded for the source and destination dialects that are in use, see `load_dialects`.
+__DIALECT_FILES = {
+  "acc" : ("openacc/scanner_tree_acc.py.in", {
+            "omp"            : "openacc/scanner_tree_acc2omp.py.in",
+            "hip-gpufort-rt" : "openacc/scanner_tree_acc2hipgpufortrt.py.in",
+            "hip-gcc-rt"     : "openacc/scanner_tree_acc2hipgccrt.py.in",
+          }),
+  "cuf" : ("cudafortran/scanner_tree_cuf.py.in", {
+            "omp" : "cudafortran/scanner_tree_cuf2omp.py.in",
+            "hip" : "cudafortran/scanner_tree_cuf2hip.py.in",
+          }),
+}
+__loaded_dialect_files = set()
+
+SUPPORTED_SOURCE_DIALECTS = list(__DIALECT_FILES.keys())
 #SUPPORTED_DESTINATION_DIALECTS = ["omp","hip-gpufort-rt","hip-gcc-rt","hip-hpe-rt","hip"]
-SUPPORTED_DESTINATION_DIALECTS = []
+SUPPORTED_DESTINATION_DIALECTS = list(dict.fromkeys(destination_dialect\
+  for _, backend_files in __DIALECT_FILES.values() for destination_dialect in backend_files))
 RUNTIME_MODULE_NAMES = {}
 
-# dirty hack that allows us to load independent versions of the grammar module
-#from grammar import *
-CASELESS    = True
-GRAMMAR_DIR = os.path.join(os.path.dirname(__file__),"../grammar")
-exec(open("{0}/grammar.py".format(GRAMMAR_DIR)).read())
+# The scanner registers its parse actions at the shared caseless grammar variant,
+# they are only run while the scanner is the active consumer
+import grammar.grammar as grammar
+globals().update(grammar.get_grammar(caseless=True))
 scanner_dir = os.path.dirname(__file__)
-exec(open("{0}/scanner_options.py.in".format(scanner_dir)).read())
-exec(open("{0}/scanner_tree.py.in".format(scanner_dir)).read())
-exec(open("{0}/openacc/scanner_tree_acc.py.in".format(scanner_dir)).read())
-exec(open("{0}/cudafortran/scanner_tree_cuf.py.in".format(scanner_dir)).read())
+utils.codecache.exec_file(os.path.join(scanner_dir,"scanner_options.py.in"),globals())
+utils.codecache.exec_file(os.path.join(scanner_dir,"scanner_tree.py.in"),globals())
+
+def _intrnl_exec_dialect_file(filename):
+    """Execute a dialect-specific file once. Options that have already been set,
+    e.g. by a config file, are not overwritten by the defaults in the file."""
+    global __loaded_dialect_files
+    if not filename in __loaded_dialect_files:
+        __loaded_dialect_files.add(filename)
+        options = { key: value for key,value in globals().items() if key.isupper() }
+        utils.codecache.exec_file(os.path.join(scanner_dir,filename),globals())
+        globals().update(options)
+
+def load_dialect(source_dialect,destination_dialect=None):
+    """
+    Load the scanner tree extension of a source dialect and, optionally,
+    the backend that translates it to the destination dialect.
+    Calls for dialect combinations that have already been loaded return immediately.
+    :param str source_dialect: One of the keys of `__DIALECT_FILES`, e.g. 'acc' or 'cuf'.
+    :param str destination_dialect: A destination dialect; nothing is loaded if there is no 
+                                    backend for the source dialect. 
+    """
+    tree_file, backend_files = __DIALECT_FILES[source_dialect]
+    translator.load_dialect(source_dialect)
+    _intrnl_exec_dialect_file(tree_file)
+    if destination_dialect in backend_files:
+        _intrnl_exec_dialect_file(backend_files[destination_dialect])
+
+def load_dialects():
+    """Load scanner tree extensions and backends for SOURCE_DIALECTS and DESTINATION_DIALECT."""
+    for source_dialect in SOURCE_DIALECTS:
+        if source_dialect in __DIALECT_FILES:
+            load_dialect(source_dialect,DESTINATION_DIALECT)
 
 def check_destination_dialect(destination_dialect):
     if destination_dialect in SUPPORTED_DESTINATION_DIALECTS:
@@ -62,7 +110,7 @@ def _intrnl_postprocess_acc(stree):
          # add acc use statements
          if not stnode is None:
              indent = stnode.first_line_indent()
-             acc_runtime_module_name = RUNTIME_MODULE_NAMES[DESTINATION_DIALECT]
+             acc_runtime_module_name = RUNTIME_MODULE_NAMES.get(DESTINATION_DIALECT)
              if acc_runtime_module_name != None and len(acc_runtime_module_name):
                  stnode.add_to_prolog("{0}use {1}\n{0}use iso_c_binding\n".format(indent,acc_runtime_module_name))
         #if type(directive._parent
@@ -100,13 +148,138 @@ def _intrnl_postprocess_cuf(stree):
 # API
 
 # Pyparsing actions that create scanner tree (ST)
+def _intrnl_node_path(node):
+    """:return: Indices of the node and of its ancestors in the children of their parents, starting below the root."""
+    path = []
+    while node._parent is not None:
+        siblings = node._parent._children
+        path.insert(0,next(j for j in reversed(range(len(siblings))) if siblings[j] is node))
+        node = node._parent
+    return path
+
+def _intrnl_node_signature(node):
+    """:return: Type, kind and name of the node and of its ancestors, which determine how the scanner treats the children of the node."""
+    result = []
+    while node is not None:
+        result.append((type(node).__name__,node.kind,node.name))
+        node = node._parent
+    return result
+
+def _intrnl_boundary(linemap_index,node,do_loop_ctr,translation_enabled,directive_no):
+    """:return: Scanner state in front of a linemap that is not recorded by a node, i.e. in front of subtrees of 'node' that can be reused."""
+    return { "linemap": linemap_index, "path": _intrnl_node_path(node), "children": len(node._children),
+             "do_loop_ctr": do_loop_ctr, "translation_enabled": translation_enabled, "directive_no": directive_no }
+
+def _intrnl_relink_linemaps(node,new_linemaps):
+    node._linemaps = [new_linemaps.get(id(linemap),linemap) for linemap in node._linemaps]
+    for child in node._children:
+        _intrnl_relink_linemaps(child,new_linemaps)
+
+def _intrnl_reuse_subtrees(previous,reused,linemaps,boundaries,node):
+    """
+    Move subtrees of a node of a previous scanner tree to 'node' if they have been created from 
+    the same linemaps (see: linemapper.read_file_incrementally), within an equivalent node, and with the same scanner state.
+    Subtrees can be modules and programs, subprograms below 'contains', loop kernels, and single statements.
+    The subtrees are associated with the new linemaps.
+    :param list boundaries: Boundaries of the new tree. The last one is the one in front of the subtrees. 
+                            The boundaries of the previous tree within the moved subtrees are appended.
+    :return: The boundary of the previous tree behind the moved subtrees or None if no subtrees can be reused.
+    """
+    boundary = boundaries[-1]
+    i = boundary["linemap"]
+    if previous == None or i >= len(reused) or reused[i] == None:
+        return None
+    k = previous["boundary_indices"].get(reused[i])
+    if k == None:
+        return None
+    old_boundaries = previous["boundaries"]
+    old_boundary   = old_boundaries[k]
+    if any(old_boundary[key] != boundary[key] for key in ["do_loop_ctr","translation_enabled","directive_no"]):
+        return None
+    path     = old_boundary["path"]
+    old_node = previous["stree"]
+    for j in path:
+        old_node = old_node._children[j]
+    if _intrnl_node_signature(old_node) != _intrnl_node_signature(node):
+        return None
+    # find the last boundary within the same node behind which all linemaps have been reused
+    old_first = old_boundary["linemap"]
+    m = None
+    for l in range(k+1,len(old_boundaries)):
+        a, b = old_boundaries[l-1]["linemap"], old_boundaries[l]["linemap"]
+        if old_boundaries[l]["path"][:len(path)] != path or\
+           reused[i+a-old_first:i+b-old_first] != list(range(a,b)):
+            break
+        if old_boundaries[l]["path"] == path:
+            m = l
+    if m == None:
+        return None
+    old_next_boundary = old_boundaries[m]
+    new_linemaps = { id(previous["linemaps"][j]): linemaps[i+j-old_first] for j in range(old_first,old_next_boundary["linemap"]) }
+    for child in old_node._children[old_boundary["children"]:old_next_boundary["children"]]:
+        _intrnl_relink_linemaps(child,new_linemaps)
+        child._parent = node
+        node.append(child)
+    # the moved subtrees might be reused by the next call too
+    offset = boundary["children"] - old_boundary["children"]
+    for old in old_boundaries[k+1:m]:
+        new = dict(old)
+        new["linemap"] = i + old["linemap"] - old_first
+        subpath = old["path"][len(path):]
+        if len(subpath):
+            new["path"] = boundary["path"] + [subpath[0]+offset] + subpath[1:]
+        else:
+            new["path"] = boundary["path"]
+            new["children"] = old["children"] + offset
+        boundaries.append(new)
+    return old_next_boundary
+
+def _intrnl_fingerprint(index_fingerprint):
+    return (index_fingerprint,list(SOURCE_DIALECTS),DESTINATION_DIALECT,TRANSLATION_ENABLED_BY_DEFAULT)
+
 def parse_file(linemaps,index,fortran_filepath):
     """
     Generate an object tree (OT). 
     """
+    return _intrnl_parse_file(linemaps,index,fortran_filepath)[0]
+
+def parse_file_incrementally(linemaps,index,fortran_filepath,previous=None,reused=None,index_fingerprint=None):
+    """
+    Like parse_file but reuses the subtrees, e.g. modules, programs, subprograms and loop kernels, of a previous scanner tree 
+    whose linemaps have been reused by linemapper.read_file_incrementally.
+    Subtrees are only reused if the index, the source and destination dialects, the enclosing nodes,
+    and the scanner state in front of the subtrees are the same as for the previous tree.
+    :param bytes previous: Snapshot returned by a previous call for the same file, or None.
+    :param list reused: Per linemap the index of the linemap of the previous call that has been reused, or None.
+    :param index_fingerprint: Picklable value that changes whenever the content of the index changes, 
+                              e.g. the result of indexer.fingerprint_gpufort_module_files, 
+                              or None if the previous snapshot must not be reused.
+    :return: The scanner tree and a snapshot (bytes) that can be passed to the next call.
+    :note: Must be called before the linemaps or the tree are modified, e.g. by postprocess.
+    """
+    load_dialects() # tree classes of the snapshot
+    fingerprint = _intrnl_fingerprint(index_fingerprint)
+    if previous != None and reused != None and index_fingerprint != None:
+        previous = pickle.loads(previous)
+        if previous["fingerprint"] == fingerprint:
+            previous["boundary_indices"] = { boundary["linemap"]: k for k,boundary in enumerate(previous["boundaries"]) }
+        else:
+            previous = None
+    else:
+        previous = None
+    stree, boundaries = _intrnl_parse_file(linemaps,index,fortran_filepath,previous,reused)
+    snapshot = pickle.dumps({ "fingerprint": fingerprint, "stree": stree, "linemaps": linemaps, "boundaries": boundaries },
+                            protocol=pickle.HIGHEST_PROTOCOL)
+    return stree, snapshot
+
+def _intrnl_parse_file(linemaps,index,fortran_filepath,previous=None,reused=None):
+    """
+    :return: The scanner tree and the scanner state in front of each linemap that is not recorded by a node and at the end of the file (see: _intrnl_boundary).
+    """
     utils.logging.log_enter_function(LOG_PREFIX,"parse_file",
         {"fortran_filepath":fortran_filepath})
 
+    load_dialects()
     translation_enabled = TRANSLATION_ENABLED_BY_DEFAULT
     
     current_node   = STRoot()
@@ -119,8 +292,8 @@ def parse_file(linemaps,index,fortran_filepath):
     def log_detection_(kind):
         nonlocal current_node
         nonlocal current_linemap
-        utils.logging.log_debug2(LOG_PREFIX,"parse_file","[current-node={}:{}] found {} in line {}: '{}'".format(\
-                current_node.kind,current_node.name,kind,current_linemap["lineno"],current_linemap["lines"][0].rstrip("\n")))
+        utils.logging.log_debug2(LOG_PREFIX,"parse_file","[current-node={}:{}] found {} in line {}: '{}'",\
+                current_node.kind,current_node.name,kind,current_linemap.lineno,current_linemap.lines[0].rstrip("\n"))
 
     def append_if_not_recording_(new):
         nonlocal current_node
@@ -134,15 +307,16 @@ def parse_file(linemaps,index,fortran_filepath):
         current_node.append(new)
         current_node=new
         
-        current_node_id = current_node.kind
-        if current_node.name != None:
-            current_node_id += " '"+current_node.name+"'"
-        parent_node_id = current_node._parent.kind
-        if current_node._parent.name != None:
-            parent_node_id += ":"+current_node._parent.name
-
-        utils.logging.log_debug(LOG_PREFIX,"parse_file","[current-node={0}] enter {1} in line {2}: '{3}'".format(\
-          parent_node_id,current_node_id,current_linemap["lineno"],current_linemap["lines"][0].rstrip("\n")))
+        if utils.logging.debug_level_enabled(1):
+            current_node_id = current_node.kind
+            if current_node.name != None:
+                current_node_id += " '"+current_node.name+"'"
+            parent_node_id = current_node._parent.kind
+            if current_node._parent.name != None:
+                parent_node_id += ":"+current_node._parent.name
+
+            utils.logging.log_debug1(LOG_PREFIX,"parse_file","[current-node={0}] enter {1} in line {2}: '{3}'",\
+              parent_node_id,current_node_id,current_linemap.lineno,current_linemap.lines[0].rstrip("\n"))
     def ascend_():
         nonlocal current_node
         nonlocal current_file
@@ -150,15 +324,16 @@ def parse_file(linemaps,index,fortran_filepath):
         nonlocal current_statement_no
         assert not current_node._parent is None, "In file {}: parent of {} is none".format(current_file,type(current_node))
         
-        current_node_id = current_node.kind
-        if current_node.name != None:
-            current_node_id += " '"+current_node.name+"'"
-        parent_node_id = current_node._parent.kind
-        if current_node._parent.name != None:
-            parent_node_id += ":"+current_node._parent.name
-        
-        utils.logging.log_debug(LOG_PREFIX,"parse_file","[current-node={0}] leave {1} in line {2}: '{3}'".format(\
-          parent_node_id,current_node_id,current_linemap["lineno"],current_linemap["lines"][0].rstrip("\n")))
+        if utils.logging.debug_level_enabled(1):
+            current_node_id = current_node.kind
+            if current_node.name != None:
+                current_node_id += " '"+current_node.name+"'"
+            parent_node_id = current_node._parent.kind
+            if current_node._parent.name != None:
+                parent_node_id += ":"+current_node._parent.name
+            
+            utils.logging.log_debug1(LOG_PREFIX,"parse_file","[current-node={0}] leave {1} in line {2}: '{3}'",\
+              parent_node_id,current_node_id,current_linemap.lineno,current_linemap.lines[0].rstrip("\n"))
         current_node = current_node._parent
    
     # parse actions
@@ -232,6 +407,7 @@ def parse_file(linemaps,index,fortran_filepath):
         nonlocal current_node
         nonlocal keep_recording
         return not keep_recording and\
+            "acc" in SOURCE_DIALECTS and\
             (type(current_node) is STAccDirective) and\
             (current_node.is_kernels_directive())
     def DoLoop_visit():
@@ -445,34 +621,34 @@ def parse_file(linemaps,index,fortran_filepath):
             translation_enabled = False
     
     # TODO completely remove / comment out !$acc end kernels
-    module_start.setParseAction(Module_visit)
-    program_start.setParseAction(Program_visit)
-    function_start.setParseAction(Function_visit)
-    subroutine_start.setParseAction(Subroutine_visit)
+    grammar.set_parse_action("scanner",module_start,Module_visit)
+    grammar.set_parse_action("scanner",program_start,Program_visit)
+    grammar.set_parse_action("scanner",function_start,Function_visit)
+    grammar.set_parse_action("scanner",subroutine_start,Subroutine_visit)
     
-    use.setParseAction(UseStatement)
+    grammar.set_parse_action("scanner",use,UseStatement)
     
     datatype_reg = Regex(r"\s*\b(type\s*\(\s*\w+\s*\)|character|integer|logical|real|complex|double\s+precision)\b") 
-    datatype_reg.setParseAction(Declaration)
+    grammar.set_parse_action("scanner",datatype_reg,Declaration)
     
-    attributes.setParseAction(Attributes)
-    ALLOCATED.setParseAction(Allocated)
-    ALLOCATE.setParseAction(Allocate)
-    DEALLOCATE.setParseAction(Deallocate)
-    memcpy.setParseAction(Memcpy)
+    grammar.set_parse_action("scanner",attributes,Attributes)
+    grammar.set_parse_action("scanner",ALLOCATED,Allocated)
+    grammar.set_parse_action("scanner",ALLOCATE,Allocate)
+    grammar.set_parse_action("scanner",DEALLOCATE,Deallocate)
+    grammar.set_parse_action("scanner",memcpy,Memcpy)
     #pointer_assignment.setParseAction(pointer_assignment)
-    non_zero_check.setParseAction(non_zero_check)
+    grammar.set_parse_action("scanner",non_zero_check,non_zero_check)
 
     # CUDA Fortran 
-    cuda_lib_call.setParseAction(CudaLibCall)
-    cuf_kernel_call.setParseAction(CudaKernelCall)
+    grammar.set_parse_action("scanner",cuda_lib_call,CudaLibCall)
+    grammar.set_parse_action("scanner",cuf_kernel_call,CudaKernelCall)
 
     # OpenACC
-    ACC_START.setParseAction(AccDirective)
-    assignment_begin.setParseAction(Assignment)
+    grammar.set_parse_action("scanner",ACC_START,AccDirective)
+    grammar.set_parse_action("scanner",assignment_begin,Assignment)
 
     # GPUFORT control
-    gpufort_control.setParseAction(GpufortControl)
+    grammar.set_parse_action("scanner",gpufort_control,GpufortControl)
 
     current_file = str(fortran_filepath)
     current_node._children.clear()
@@ -485,11 +661,12 @@ def parse_file(linemaps,index,fortran_filepath):
         nonlocal current_statement_no
         nonlocal current_statement
 
-        matched = len(expression.searchString(current_statement,1))
+        with grammar.active_consumer("scanner"):
+            matched = len(expression.searchString(current_statement,1))
         if matched:
-           utils.logging.log_debug3(LOG_PREFIX,"parse_file.scanString","found expression '{}' in line {}: '{}'".format(expression_name,current_linemap["lineno"],current_linemap["lines"][0].rstrip()))
+           utils.logging.log_debug3(LOG_PREFIX,"parse_file.scanString","found expression '{}' in line {}: '{}'",expression_name,current_linemap.lineno,current_linemap.lines[0].rstrip())
         else:
-           utils.logging.log_debug4(LOG_PREFIX,"parse_file.scanString","did not find expression '{}' in line {}: '{}'".format(expression_name,current_linemap["lineno"],current_linemap["lines"][0].rstrip()))
+           utils.logging.log_debug4(LOG_PREFIX,"parse_file.scanString","did not find expression '{}' in line {}: '{}'",expression_name,current_linemap.lineno,current_linemap.lines[0].rstrip())
         return matched
     
     def try_to_parse_string(expression_name,expression,parseAll=False):
@@ -504,12 +681,13 @@ def parse_file(linemaps,index,fortran_filepath):
         nonlocal current_statement_stripped_no_comments
         
         try:
-           expression.parseString(current_statement_stripped_no_comments,parseAll)
-           utils.logging.log_debug3(LOG_PREFIX,"parse_file.try_to_parse_string","found expression '{}' in line {}: '{}'".format(expression_name,current_linemap["lineno"],current_linemap["lines"][0].rstrip()))
+           with grammar.active_consumer("scanner"):
+               expression.parseString(current_statement_stripped_no_comments,parseAll)
+           utils.logging.log_debug3(LOG_PREFIX,"parse_file.try_to_parse_string","found expression '{}' in line {}: '{}'",expression_name,current_linemap.lineno,current_linemap.lines[0].rstrip())
            return True
         except ParseBaseException as e: 
-           utils.logging.log_debug4(LOG_PREFIX,"parse_file.try_to_parse_string","did not find expression '{}' in line '{}'".format(expression_name,current_linemap["lines"][0]))
-           utils.logging.log_debug5(LOG_PREFIX,"parse_file.try_to_parse_string",str(e))
+           utils.logging.log_debug4(LOG_PREFIX,"parse_file.try_to_parse_string","did not find expression '{}' in line '{}'",expression_name,current_linemap.lines[0])
+           utils.logging.log_debug5(LOG_PREFIX,"parse_file.try_to_parse_string","{}",e)
            return False
 
     def is_end_statement_(tokens,kind):
@@ -519,13 +697,28 @@ def parse_file(linemaps,index,fortran_filepath):
         return result
     
     # parser loop
-    for current_linemap in linemaps:
-        condition1 = current_linemap["is_active"]
-        condition2 = len(current_linemap["included_linemaps"]) or not current_linemap["is_preprocessor_directive"]
+    boundaries = []
+    skip_until = 0
+    for i,current_linemap in enumerate(linemaps):
+        if i < skip_until:
+            continue
+        if not keep_recording:
+            boundaries.append(_intrnl_boundary(i,current_node,do_loop_ctr,translation_enabled,directive_no))
+            old_next_boundary = _intrnl_reuse_subtrees(previous,reused,linemaps,boundaries,current_node)
+            if old_next_boundary != None:
+                skip_until          = i + old_next_boundary["linemap"] - reused[i]
+                do_loop_ctr         = old_next_boundary["do_loop_ctr"]
+                translation_enabled = old_next_boundary["translation_enabled"]
+                directive_no        = old_next_boundary["directive_no"]
+                utils.logging.log_debug1(LOG_PREFIX,"parse_file","reuse subtrees of lines {} to {}",
+                  current_linemap.lineno,linemaps[skip_until-1].lineno+len(linemaps[skip_until-1].lines)-1)
+                continue
+        condition1 = current_linemap.is_active
+        condition2 = len(current_linemap.included_linemaps) or not current_linemap.is_preprocessor_directive
         if condition1 and condition2:
-            for current_statement_no,current_statement in enumerate(current_linemap["statements"]):
-                utils.logging.log_debug4(LOG_PREFIX,"parse_file","parsing statement '{}' associated with lines [{},{}]".format(current_statement.rstrip(),\
-                    current_linemap["lineno"],current_linemap["lineno"]+len(current_linemap["lines"])-1))
+            for current_statement_no,current_statement in enumerate(current_linemap.statements):
+                utils.logging.log_debug4(LOG_PREFIX,"parse_file","parsing statement '{}' associated with lines [{},{}]",current_statement.rstrip(),\
+                    current_linemap.lineno,current_linemap.lineno+len(current_linemap.lines)-1)
                 
                 current_tokens                       = utils.parsingutils.tokenize(current_statement.lower(),padded_size=6)
                 current_statement_stripped           = " ".join(current_tokens)
@@ -595,8 +788,9 @@ def parse_file(linemaps,index,fortran_filepath):
                         current_node._last_statement_index = current_statement_no
 
     assert type(current_node) is STRoot
+    boundaries.append(_intrnl_boundary(len(linemaps),current_node,do_loop_ctr,translation_enabled,directive_no))
     utils.logging.log_leave_function(LOG_PREFIX,"parse_file")
-    return current_node
+    return current_node, boundaries
 
 def postprocess(stree,index,hip_module_suffix):
     """
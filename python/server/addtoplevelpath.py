@@ -0,0 +1,4 @@
+# SPDX-License-Identifier: MIT                                                
+# Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
+import sys,os
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
\ No newline at end of file
@@ -0,0 +1,197 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
+"""Translation server and thin client.
+
+The server is a long-running process that has already imported all modules and built
+the grammars. It accepts translation jobs over a Unix domain socket and uses asyncio to
+serve multiple clients at the same time. Each job runs in a child process that is forked
+from the server. The child inherits the warm state of the server, while
+modifications of the global options by a config file or the command line arguments of
+one job do not leak into other jobs.
+
+Protocol: The client sends a single JSON line with the fields 'argv' (list of str) and 'cwd' (str).
+The server answers with a sequence of JSON lines of the form {"stdout": str}, {"stderr": str}
+and finally {"exit_code": int}.
+
+This module only depends on the Python standard library so that the client starts fast.
+"""
+import os, sys
+import json
+import codecs
+import socket
+import signal
+import asyncio
+import traceback
+
+import utils.codecache
+
+utils.codecache.exec_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "server_options.py.in"),globals())
+
+__READ_CHUNK_SIZE = 65536
+
+def _intrnl_exit_code_from_status(status):
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+def _intrnl_run_job_in_child(job,request,stdout_fd,stderr_fd):
+    """Run a job in the forked child process. Never returns."""
+    exit_code = 0
+    try:
+        # the signal handling of the server's event loop must not be inherited
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGINT,signal.default_int_handler)
+        signal.signal(signal.SIGTERM,signal.SIG_DFL)
+        os.dup2(stdout_fd,1)
+        os.dup2(stderr_fd,2)
+        os.chdir(request["cwd"])
+        sys.argv = [sys.argv[0]] + list(request["argv"])
+        job()
+    except SystemExit as e:
+        if e.code is None:
+            exit_code = 0
+        elif isinstance(e.code,int):
+            exit_code = e.code
+        else:
+            print(e.code,file=sys.stderr)
+            exit_code = 1
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(exit_code)
+
+def _intrnl_fork_job(job,request):
+    """
+    :return: Process id of the child and the read ends of its stdout and stderr pipes.
+    """
+    stdout_read, stdout_write = os.pipe()
+    stderr_read, stderr_write = os.pipe()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    pid = os.fork()
+    if pid == 0:
+        os.close(stdout_read)
+        os.close(stderr_read)
+        _intrnl_run_job_in_child(job,request,stdout_write,stderr_write)
+    os.close(stdout_write)
+    os.close(stderr_write)
+    return pid, stdout_read, stderr_read
+
+async def _intrnl_forward_pipe(fd,key,writer,write_lock):
+    loop   = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    transport, _ = await loop.connect_read_pipe(
+      lambda: asyncio.StreamReaderProtocol(reader),os.fdopen(fd,"rb"))
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    try:
+        while True:
+            data = await reader.read(__READ_CHUNK_SIZE)
+            text = decoder.decode(data,final=not data)
+            if text:
+                async with write_lock:
+                    writer.write(json.dumps({key: text}).encode()+b"\n")
+                    await writer.drain()
+            if not data:
+                break
+    finally:
+        transport.close()
+
+async def _intrnl_handle_client(job,job_slots,reader,writer):
+    loop = asyncio.get_running_loop()
+    try:
+        request = json.loads(await reader.readline())
+        async with job_slots:
+            pid, stdout_read, stderr_read = _intrnl_fork_job(job,request)
+            write_lock = asyncio.Lock()
+            try:
+                await asyncio.gather(
+                  _intrnl_forward_pipe(stdout_read,"stdout",writer,write_lock),
+                  _intrnl_forward_pipe(stderr_read,"stderr",writer,write_lock))
+            except (ConnectionError,OSError):
+                pass # client is gone, still reap the child
+            _, status = await loop.run_in_executor(None,os.waitpid,pid,0)
+        writer.write(json.dumps({"exit_code": _intrnl_exit_code_from_status(status)}).encode()+b"\n")
+        await writer.drain()
+    except (ConnectionError,ValueError,KeyError):
+        pass
+    finally:
+        writer.close()
+
+async def _intrnl_serve(job,socket_path,max_concurrent_jobs):
+    job_slots = asyncio.Semaphore(max_concurrent_jobs)
+    server = await asyncio.start_unix_server(
+      lambda reader,writer: _intrnl_handle_client(job,job_slots,reader,writer),path=socket_path)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT,signal.SIGTERM):
+        loop.add_signal_handler(sig,stop.set)
+    print("gpufort server: listening on '{}'".format(socket_path),file=sys.stderr)
+    async with server:
+        await stop.wait()
+    print("gpufort server: shut down",file=sys.stderr)
+
+# API
+def serve(job,socket_path=None,max_concurrent_jobs=None):
+    """
+    Run the translation server until it receives SIGINT or SIGTERM.
+
+    :param job: Callable without arguments that runs a translation. It is called in a forked
+                child process after 'sys.argv' and the working directory of the child have been set
+                to the values of the request.
+    :param str socket_path: Path of the Unix domain socket, defaults to SOCKET_PATH.
+    :param int max_concurrent_jobs: Defaults to MAX_CONCURRENT_JOBS.
+    """
+    if socket_path == None:
+        socket_path = SOCKET_PATH
+    if max_concurrent_jobs == None:
+        max_concurrent_jobs = MAX_CONCURRENT_JOBS
+    if os.path.exists(socket_path):
+        # only remove the socket if no other server is listening on it
+        if run_client_request(socket_path,None) != None:
+            print("ERROR: a server is already listening on '{}'".format(socket_path),file=sys.stderr)
+            sys.exit(2)
+        os.remove(socket_path)
+    try:
+        asyncio.run(_intrnl_serve(job,socket_path,max_concurrent_jobs))
+    finally:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def run_client_request(socket_path,argv,cwd=None):
+    """
+    Send a translation request to the server and forward the server's output
+    to this process' stdout and stderr.
+
+    :param list argv: Command line arguments of the translation job. If None,
+                      only check if a server is listening.
+    :return: Exit code of the job or None if no server is listening on 'socket_path'.
+    """
+    sock = socket.socket(socket.AF_UNIX,socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    if argv == None:
+        sock.close()
+        return 0
+    with sock, sock.makefile("rwb") as stream:
+        stream.write(json.dumps({"argv": list(argv), "cwd": cwd or os.getcwd()}).encode()+b"\n")
+        stream.flush()
+        for line in stream:
+            message = json.loads(line)
+            if "stdout" in message:
+                sys.stdout.write(message["stdout"])
+                sys.stdout.flush()
+            elif "stderr" in message:
+                sys.stderr.write(message["stderr"])
+                sys.stderr.flush()
+            elif "exit_code" in message:
+                return message["exit_code"]
+    print("ERROR: connection to server at '{}' closed unexpectedly".format(socket_path),file=sys.stderr)
+    return 1
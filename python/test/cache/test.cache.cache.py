@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+import os,sys
+import time
+import shutil
+import tempfile
+import unittest
+
+import addtoplevelpath
+import cache.cache as cache
+import utils.fileutils
+
+def write_file(filepath,content):
+    utils.fileutils.prepare_output_file(filepath)
+    with open(filepath,"w") as outfile:
+        outfile.write(content)
+
+def read_file(filepath):
+    with open(filepath,"r") as infile:
+        return infile.read()
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self._started_at = time.time()
+        self._tmp_dir    = tempfile.mkdtemp()
+        self._output_dir = os.path.join(self._tmp_dir,"output")
+        os.makedirs(self._output_dir)
+        cache.CACHE_DIR    = os.path.join(self._tmp_dir,"cache")
+        cache.MAX_SIZE     = 1024**2
+        cache.RESTORE_MODE = "copy"
+    def tearDown(self):
+        shutil.rmtree(self._tmp_dir)
+        elapsed = time.time() - self._started_at
+        print('{} ({}s)'.format(self.id(), round(elapsed, 6)))
+    def _translate(self,name,content):
+        """Writes two output files and records them."""
+        filepaths = []
+        utils.fileutils.record_output_files(filepaths)
+        for ext in [".hip.cpp",".f08"]:
+            write_file(os.path.join(self._output_dir,name+ext),content)
+        utils.fileutils.record_output_files(None)
+        return filepaths
+    def test_0_make_key(self):
+        key1 = cache.make_key({"a": {"x","y","z"}, "b": {"c": 1, "d": [1,2]}})
+        key2 = cache.make_key({"b": {"d": [1,2], "c": 1}, "a": {"z","y","x"}})
+        key3 = cache.make_key({"b": {"d": [2,1], "c": 1}, "a": {"z","y","x"}})
+        self.assertEqual(key1,key2)
+        self.assertNotEqual(key1,key3)
+        self.assertNotEqual(cache.make_key({"f": lambda x: x+1}),cache.make_key({"f": lambda x: x+2}))
+    def test_1_store_and_restore(self):
+        self.assertEqual(cache.restore("a"*64),None)
+        filepaths = self._translate("file","content")
+        self.assertEqual(len(filepaths),2)
+        cache.store("a"*64,filepaths)
+        for filepath in filepaths:
+            os.remove(filepath)
+        self.assertEqual(cache.restore("a"*64),filepaths)
+        for filepath in filepaths:
+            self.assertEqual(read_file(filepath),"content")
+        stats = cache.stats()
+        self.assertEqual((stats["entries"],stats["hits"],stats["misses"],stats["stores"]),(1,1,1,1))
+    def test_2_hardlinks_are_not_written_through(self):
+        cache.RESTORE_MODE = "hardlink"
+        filepaths = self._translate("file","content")
+        cache.store("b"*64,filepaths)
+        cache.restore("b"*64)
+        self.assertEqual(os.stat(filepaths[0]).st_nlink,2)
+        self._translate("file","modified")
+        self.assertEqual(read_file(filepaths[0]),"modified")
+        cache.restore("b"*64)
+        self.assertEqual(read_file(filepaths[0]),"content")
+    def test_3_lru_eviction(self):
+        cache.MAX_SIZE = 15000
+        for i, key in enumerate(["c"*64,"d"*64,"e"*64]):
+            cache.store(key,self._translate("file{}".format(i),"x"*2000))
+            time.sleep(0.01)
+        self.assertNotEqual(cache.restore("c"*64),None) # "d" becomes the least recently used entry
+        cache.store("f"*64,self._translate("file3","x"*2000))
+        self.assertEqual(cache.restore("d"*64),None)
+        for key in ["c"*64,"e"*64,"f"*64]:
+            self.assertNotEqual(cache.restore(key),None)
+        stats = cache.stats()
+        self.assertEqual((stats["entries"],stats["evictions"]),(3,1))
+        self.assertLessEqual(stats["size"],cache.MAX_SIZE)
+
+if __name__ == '__main__':
+    unittest.main()
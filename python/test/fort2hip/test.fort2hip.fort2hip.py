@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+import os,sys
+import time
+import tempfile
+import subprocess
+import unittest
+
+import addtoplevelpath
+import scanner.scanner as scanner
+
+GPUFORT = os.path.join(os.path.dirname(os.path.abspath(addtoplevelpath.__file__)),"../../gpufort.py")
+
+cuf_kernel_module = """\
+module kernels
+  use cudafor
+  implicit none
+contains
+  attributes(global) subroutine axpy(a,x,y,n)
+    implicit none
+    integer, value :: n
+    real, value :: a
+    real :: x(n), y(n)
+    integer :: i
+    i = threadIdx%x + (blockIdx%x-1)*blockDim%x
+    if (i <= n) y(i) = y(i) + a*x(i)
+  end subroutine
+end module kernels
+"""
+
+class TestFort2Hip(unittest.TestCase):
+    def setUp(self):
+        self._started_at = time.time()
+        self._tmpdir = tempfile.TemporaryDirectory()
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        elapsed = time.time() - self._started_at
+        print('{} ({}s)'.format(self.id(), round(elapsed, 6)))
+    def test_0_dev_var_name_without_dialects(self):
+        self.assertEqual(scanner.dev_var_name("a%b"),"dev_a_b")
+    def test_1_cuf_to_hip_kernel_with_array_arguments(self):
+        with open(os.path.join(self._tmpdir.name,"kernels.f90"),"w") as outfile:
+            outfile.write(cuf_kernel_module)
+        process = subprocess.run([sys.executable,GPUFORT,"-E","hip","kernels.f90"],
+          cwd=self._tmpdir.name,stdout=subprocess.DEVNULL,stderr=subprocess.PIPE,universal_newlines=True)
+        self.assertEqual(process.returncode,0,process.stderr)
+        with open(os.path.join(self._tmpdir.name,"kernels-fort2hip.hip.cpp"),"r") as infile:
+            self.assertIn("axpy",infile.read())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
+import addtoplevelpath
+import os,sys
+import time
+import unittest
+import grammar.grammar as grammar
+
+print("Running test '{}'".format(os.path.basename(__file__)),end="",file=sys.stderr)
+
+class TestGrammarConsumers(unittest.TestCase):
+    def setUp(self):
+        self._started_at = time.time()
+        self._grammar    = grammar.get_grammar(caseless=True)
+    def tearDown(self):
+        elapsed = time.time() - self._started_at
+        print('{} ({}s)'.format(self.id(), round(elapsed, 9)))
+    def test_0_variant_is_shared(self):
+        self.assertIs(grammar.get_grammar(caseless=True),self._grammar)
+        self.assertIsNot(grammar.get_grammar(caseless=False),self._grammar)
+    def test_1_actions_of_active_consumer_run(self):
+        identifier = self._grammar["identifier"].copy()
+        grammar.set_parse_action("test_a",identifier,lambda tokens: "a_"+tokens[0])
+        grammar.set_parse_action("test_b",identifier,lambda tokens: "b_"+tokens[0])
+        self.assertEqual(identifier.parseString("x")[0],"x")
+        with grammar.active_consumer("test_a"):
+            self.assertEqual(identifier.parseString("x")[0],"a_x")
+        with grammar.active_consumer("test_b"):
+            self.assertEqual(identifier.parseString("x")[0],"b_x")
+        self.assertEqual(identifier.parseString("x")[0],"x")
+    def test_2_actions_run_with_default_consumer_active(self):
+        identifier = self._grammar["identifier"].copy()
+        grammar.set_parse_action(grammar.DEFAULT_CONSUMER,identifier,lambda tokens: "default_"+tokens[0])
+        grammar.set_parse_action("test_a",identifier,lambda tokens: "a_"+identifier.parseString(tokens[0])[0])
+        with grammar.active_consumer("test_a"):
+            self.assertEqual(identifier.parseString("x")[0],"a_default_x")
+    def test_3_grammar_actions_run_without_consumer_actions(self):
+        matrix_range0 = self._grammar["matrix_range0"]
+        grammar.set_parse_action("test_a",matrix_range0,lambda tokens: "a")
+        self.assertEqual(matrix_range0.parseString(":").asList(),[None,None])
+        with grammar.active_consumer("test_a"):
+            self.assertEqual(matrix_range0.parseString(":")[0],"a")
+
+if __name__ == '__main__':
+    unittest.main()
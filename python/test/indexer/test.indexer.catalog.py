@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import os
+import time
+import hashlib
+import tempfile
+import unittest
+
+import orjson
+
+import addtoplevelpath
+import indexer.indexer as indexer
+import linemapper.linemapper as linemapper
+import utils.logging
+
+utils.logging.VERBOSE = False
+utils.logging.init_logging("log.log","[%(levelname)s]\tgpufort:%(message)s","warning")
+
+def module_(name,used_modules=[],kind="module"):
+    return { "kind": kind, "name": name, "variables": [], "types": [], "subprograms": [],
+             "used_modules": [ { "name": used_module, "only": [] } for used_module in used_modules ] }
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self._started_at = time.time()
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self._dirs   = []
+        for i in range(2):
+            self._dirs.append(os.path.join(self._tmpdir.name,str(i)))
+            os.mkdir(self._dirs[-1])
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        elapsed = time.time() - self._started_at
+        print('{} ({}s)'.format(self.id(), round(elapsed, 6)))
+    def read_catalog_(self,search_dir):
+        with open(os.path.join(search_dir,indexer.GPUFORT_MODULE_CATALOG_FILENAME),"rb") as infile:
+            return orjson.loads(infile.read())["modules"]
+    def test_0_catalog_is_updated_when_writing(self):
+        indexer.write_gpufort_module_files([module_("a"),module_("b",["a","iso_c_binding"])],self._dirs[0])
+        indexer.write_gpufort_module_files([module_("c",["b"])],self._dirs[0])
+        catalog = self.read_catalog_(self._dirs[0])
+        self.assertEqual(sorted(catalog.keys()),["a","b","c"])
+        filepath = os.path.join(self._dirs[0],"b"+indexer.GPUFORT_MODULE_FILE_SUFFIX)
+        with open(filepath,"rb") as infile:
+            content = infile.read()
+        self.assertEqual(catalog["b"]["sha256"],hashlib.sha256(content).hexdigest())
+        self.assertEqual(catalog["b"]["size"],len(content))
+        self.assertEqual(catalog["b"]["used_modules"],["a","iso_c_binding"])
+    def test_1_load_each_module_once(self):
+        indexer.write_gpufort_module_files([module_("a"),module_("b")],self._dirs[0])
+        indexer.write_gpufort_module_files([module_("a",["b"]),module_("c")],self._dirs[1])
+        index = [module_("c")]
+        indexer.load_gpufort_module_files(self._dirs,index)
+        self.assertEqual(sorted(mod["name"] for mod in index),["a","b","c"])
+        self.assertEqual(next(mod for mod in index if mod["name"] == "a")["used_modules"],[]) # first dir wins
+    def test_2_load_used_modules_only(self):
+        indexer.write_gpufort_module_files([module_("a"),module_("b",["a"]),module_("unused"),
+          module_("test",["b"],kind="program"),module_("sub",kind="subroutine")],self._dirs[0])
+        linemaps = linemapper.preprocess_and_normalize(["program test","  use b","end program test"],"test.f90")
+        index = []
+        indexer.load_gpufort_module_files(self._dirs,index,linemaps)
+        self.assertEqual([mod["name"] for mod in index],["b","test","a","sub"])
+        self.assertEqual([os.path.basename(filepath) for filepath in\
+          indexer.find_consulted_gpufort_module_files(linemaps,self._dirs)],["b.gpufort_mod","a.gpufort_mod","sub.gpufort_mod"])
+    def test_3_outdated_entries_are_recreated(self):
+        indexer.write_gpufort_module_files([module_("a"),module_("b")],self._dirs[0])
+        filepath = os.path.join(self._dirs[0],"a"+indexer.GPUFORT_MODULE_FILE_SUFFIX)
+        with open(filepath,"wb") as outfile: # written by another tool
+            outfile.write(orjson.dumps(module_("a",["b","c"])))
+        os.unlink(os.path.join(self._dirs[0],"b"+indexer.GPUFORT_MODULE_FILE_SUFFIX))
+        linemaps = linemapper.preprocess_and_normalize(["program test","  use a","end program test"],"test.f90")
+        self.assertEqual([os.path.basename(filepath) for filepath in\
+          indexer.find_consulted_gpufort_module_files(linemaps,self._dirs)],["a.gpufort_mod"])
+        catalog = self.read_catalog_(self._dirs[0])
+        self.assertEqual(sorted(catalog.keys()),["a"])
+        self.assertEqual(catalog["a"]["used_modules"],["b","c"])
+    def test_4_undecodable_module_files_are_skipped(self):
+        indexer.write_gpufort_module_files([module_("a"),module_("b")],self._dirs[0])
+        for name, content in [("b",b"\x00truncated"),("c",b"{\"kind\": "),("d",b"[]")]: # written by another tool
+            with open(os.path.join(self._dirs[0],name+indexer.GPUFORT_MODULE_FILE_SUFFIX),"wb") as outfile:
+                outfile.write(content)
+        index = []
+        indexer.load_gpufort_module_files(self._dirs,index)
+        self.assertEqual([mod["name"] for mod in index],["a"])
+        self.assertEqual(sorted(self.read_catalog_(self._dirs[0]).keys()),["a"])
+    def test_5_fingerprint_changes_with_consulted_module_files(self):
+        indexer.write_gpufort_module_files([module_("a"),module_("b",["a"]),module_("unused")],self._dirs[0])
+        linemaps = linemapper.preprocess_and_normalize(["program test","  use b","end program test"],"test.f90")
+        fingerprint = indexer.fingerprint_gpufort_module_files(linemaps,self._dirs)
+        self.assertEqual([os.path.basename(filepath) for filepath,_ in fingerprint],["b.gpufort_mod","a.gpufort_mod"])
+        indexer.write_gpufort_module_files([module_("unused",["a"])],self._dirs[0])
+        self.assertEqual(indexer.fingerprint_gpufort_module_files(linemaps,self._dirs),fingerprint)
+        indexer.write_gpufort_module_files([module_("a",["iso_c_binding"])],self._dirs[0])
+        self.assertNotEqual(indexer.fingerprint_gpufort_module_files(linemaps,self._dirs),fingerprint)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
+import os
 import time
+import tempfile
+import multiprocessing
 import unittest
 import cProfile,pstats,io
 
@@ -22,6 +25,11 @@ PROFILING_ENABLE          = False
 
 index = []
 
+def scan_file_(filepath):
+    result = []
+    indexer.scan_file(filepath,gfortran_options,result)
+    return result
+
 class TestIndexer(unittest.TestCase):
     def setUp(self):
         global index
@@ -39,12 +47,9 @@ class TestIndexer(unittest.TestCase):
         if PROFILING_ENABLE:
             profiler = cProfile.Profile()
             profiler.enable()
-        if USE_EXTERNAL_PREPROCESSOR:
-            indexer.scan_file("test_modules.f90",gfortran_options,self._index)
-            indexer.scan_file("test1.f90",gfortran_options,self._index)
-        else:
-            indexer.update_index_from_linemaps(linemapper.read_file("test_modules.f90",gfortran_options),self._index)
-            indexer.update_index_from_linemaps(linemapper.read_file("test1.f90",gfortran_options),self._index)
+        indexer.USE_EXTERNAL_PREPROCESSOR = USE_EXTERNAL_PREPROCESSOR
+        indexer.scan_file("test_modules.f90",gfortran_options,self._index)
+        indexer.scan_file("test1.f90",gfortran_options,self._index)
         if PROFILING_ENABLE:
             profiler.disable() 
             s = io.StringIO()
@@ -155,6 +160,63 @@ class TestIndexer(unittest.TestCase):
         self.assertEqual(func4["result_name"],"func4")
         self.assertEqual(len(func4["subprograms"]),0)
         self.assertEqual(func4["attributes"],["host","device"])
-      
+    def test_8_indexer_scan_file_without_subprocess(self):
+        for filepath in ["test_modules.f90","test1.f90"]:
+            index_from_linemaps = []
+            indexer.update_index_from_linemaps(linemapper.read_file(filepath,gfortran_options),index_from_linemaps)
+            indexer.USE_EXTERNAL_PREPROCESSOR = False
+            index_in_process = []
+            indexer.scan_file(filepath,gfortran_options,index_in_process)
+            indexer.USE_EXTERNAL_PREPROCESSOR = True
+            index_from_subprocess = []
+            indexer.scan_file(filepath,gfortran_options,index_from_subprocess)
+            indexer.USE_EXTERNAL_PREPROCESSOR = USE_EXTERNAL_PREPROCESSOR
+            self.assertEqual(index_in_process,index_from_linemaps)
+            self.assertEqual(index_in_process,index_from_subprocess)
+    def test_9_indexer_parse_declarations_in_process_pool(self):
+        serial_index = []
+        indexer.scan_file("test_modules.f90",gfortran_options,serial_index)
+        indexer.PARSE_VARIABLE_DECLARATIONS_WORKER_POOL_SIZE = 2
+        indexer.PARSE_VARIABLE_DECLARATIONS_CHUNK_SIZE = 3
+        parallel_index = []
+        indexer.scan_file("test_modules.f90",gfortran_options,parallel_index)
+        indexer.PARSE_VARIABLE_DECLARATIONS_WORKER_POOL_SIZE = 1
+        indexer.PARSE_VARIABLE_DECLARATIONS_CHUNK_SIZE = 512
+        self.assertEqual(parallel_index,serial_index)
+    def test_10_indexer_module_graph(self):
+        with tempfile.TemporaryDirectory() as project_dir:
+            sources = {
+              "a.f90": "module a\n  use iso_c_binding\nend module a\n",
+              "b.f90": "module b\n  use a, only: x ! use c\nend module b\n",
+              "c.f90": "program c\n  use b\n  use a\n  use mpi\nend program c\n",
+              "d.f90": "module d\n  use e\nend module d\n",
+              "e.f90": "module e\n  use d\nend module e\n",
+            }
+            for name, source in sources.items():
+                with open(os.path.join(project_dir,name),"w") as outfile:
+                    outfile.write(source)
+            a, b, c, d, e = [os.path.join(project_dir,name) for name in sorted(sources)]
+            input_filepaths = indexer.discover_input_files([project_dir])
+            self.assertEqual(input_filepaths,[a,b,c,d,e])
+            graph = indexer.create_module_graph(input_filepaths)
+            self.assertEqual(graph["modules"],{"a": a, "b": b, "d": d, "e": e})
+            self.assertEqual(graph["dependencies"],{a: [], b: [a], c: [a,b], d: [e], e: [d]})
+            self.assertEqual(graph["missing"],{c: ["mpi"]})
+            waves, cycles = indexer.schedule_in_waves(graph["dependencies"])
+            self.assertEqual(waves,[[a],[b],[c]])
+            self.assertEqual(cycles,[[d,e,d]])
+    def test_11_indexer_parse_declarations_in_daemonic_process(self):
+        serial_index = []
+        indexer.scan_file("test_modules.f90",gfortran_options,serial_index)
+        indexer.PARSE_VARIABLE_DECLARATIONS_WORKER_POOL_SIZE = 2
+        indexer.PARSE_VARIABLE_DECLARATIONS_CHUNK_SIZE = 3
+        try:
+            with multiprocessing.get_context("fork").Pool(1) as pool: # daemonic workers, as in batch runs
+                daemon_index = pool.apply(scan_file_,("test_modules.f90",))
+        finally:
+            indexer.PARSE_VARIABLE_DECLARATIONS_WORKER_POOL_SIZE = 1
+            indexer.PARSE_VARIABLE_DECLARATIONS_CHUNK_SIZE = 512
+        self.assertEqual(daemon_index,serial_index)
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import os
+import time
+import copy
+import pickle
+import tempfile
+import unittest
+
+import orjson
+
+import addtoplevelpath
+import indexer.indexer as indexer
+import indexer.modfile as modfile
+import utils.logging
+
+utils.logging.VERBOSE = False
+utils.logging.init_logging("log.log","[%(levelname)s]\tgpufort:%(message)s","warning")
+
+record = {
+  "kind": "module", "name": "simple",
+  "variables": [
+    { "name": "a", "f_type": "integer", "kind": None, "bytes_per_element": 4, "rank": 0,
+      "qualifiers": [], "declare_on_target": False },
+    { "name": "c", "f_type": "real", "kind": "8", "bytes_per_element": 8, "rank": 2,
+      "qualifiers": ["device"], "declare_on_target": "alloc", "counts": ["n","n"] },
+  ],
+  "types": [ { "name": "mytype", "kind": "type", "variables": [ { "name": "b", "kind": None, "rank": 1 } ], "types": [] } ],
+  "subprograms": [
+    { "kind": "function", "name": "func", "attributes": ["host","device"], "dummy_args": ["x"],
+      "variables": [], "types": [], "subprograms": [], "used_modules": [], "result_name": "func" } ],
+  "used_modules": [ { "name": "iso_c_binding", "only": [ { "original": "c_ptr", "renamed": "c_ptr" } ] } ],
+}
+
+class TestModfile(unittest.TestCase):
+    def setUp(self):
+        self._started_at = time.time()
+    def tearDown(self):
+        elapsed = time.time() - self._started_at
+        print('{} ({}s)'.format(self.id(), round(elapsed, 6)))
+    def test_0_round_trip(self):
+        data = modfile.dumps(record)
+        self.assertTrue(modfile.is_binary(data))
+        loaded = modfile.loads(data)
+        self.assertEqual(loaded,record)
+        self.assertEqual(orjson.dumps(modfile.materialize(loaded)),orjson.dumps(record)) # same key order
+    def test_1_lazy_decoding(self):
+        loaded = modfile.loads(modfile.dumps(record))
+        self.assertEqual(dict.keys(loaded),{"name","kind"})
+        variables = loaded["variables"]
+        self.assertEqual([dict.keys(var) for var in variables],[{"name"},{"name"}])
+        self.assertEqual(variables[1]["counts"],["n","n"])
+        self.assertEqual(dict.keys(variables[0]),{"name"})
+        self.assertEqual(loaded["subprograms"][0]["kind"],"function")
+        self.assertEqual(dict.keys(loaded["subprograms"][0]),{"name","kind"})
+    def test_2_copies(self):
+        loaded = modfile.loads(modfile.dumps(record))
+        copied = copy.deepcopy(loaded["variables"][1])
+        copied["name"] = "renamed"
+        self.assertEqual(copied["qualifiers"],["device"])
+        self.assertEqual(copied["name"],"renamed")
+        self.assertEqual(loaded["variables"][1]["name"],"c")
+        self.assertEqual(pickle.loads(pickle.dumps(modfile.loads(modfile.dumps(record)))),record)
+        self.assertEqual(dict(modfile.loads(modfile.dumps(record))),record)
+    def test_3_unsupported_data(self):
+        with self.assertRaises(ValueError):
+            modfile.loads(orjson.dumps(record))
+        data = bytearray(modfile.dumps(record))
+        data[len(modfile.MAGIC)] += 1 # version
+        with self.assertRaises(ValueError):
+            modfile.loads(bytes(data))
+    def test_4_write_load_and_export(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            indexer.write_gpufort_module_files([record],tmpdir)
+            filepath = os.path.join(tmpdir,"simple"+indexer.GPUFORT_MODULE_FILE_SUFFIX)
+            index = []
+            indexer.load_gpufort_module_files([tmpdir],index)
+            self.assertEqual(index,[record])
+            indexer.export_gpufort_module_file(filepath,filepath)
+            with open(filepath,"rb") as infile:
+                self.assertEqual(orjson.loads(infile.read()),record)
+            index.clear()
+            indexer.load_gpufort_module_files([tmpdir],index) # JSON files can still be loaded
+            self.assertEqual(index,[record])
+    def test_5_deferred_decoding(self):
+        loaded = modfile.loads_deferred(memoryview(modfile.dumps(record)),"simple","module")
+        self.assertEqual(dict.keys(loaded),{"name","kind"})
+        self.assertEqual(loaded["variables"][0]["name"],"a")
+        self.assertEqual(loaded,record)
+        with self.assertRaises(ValueError):
+            modfile.loads_deferred(orjson.dumps(record),"simple","module")
+    def test_6_shared_module_files(self):
+        other = dict(record,name="other",used_modules=[])
+        with tempfile.TemporaryDirectory() as tmpdir:
+            indexer.write_gpufort_module_files([record,other],tmpdir)
+            indexer.export_gpufort_module_file(os.path.join(tmpdir,"other"+indexer.GPUFORT_MODULE_FILE_SUFFIX),
+              os.path.join(tmpdir,"other"+indexer.GPUFORT_MODULE_FILE_SUFFIX)) # JSON files are converted
+            shared = indexer.share_gpufort_module_files([tmpdir])
+        pid = os.fork()
+        if pid == 0:
+            index = [{ "kind": "module", "name": "other" }] # overlay
+            indexer.load_shared_gpufort_module_files(shared,index)
+            os._exit(0 if index[1] == record and len(index) == 2 else 1)
+        _, status = os.waitpid(pid,0)
+        self.assertEqual(os.WEXITSTATUS(status),0)
+        index = []
+        indexer.load_shared_gpufort_module_files(shared,index)
+        self.assertEqual([dict.keys(mod) for mod in index],[{"name","kind"},{"name","kind"}])
+        self.assertEqual(index,[other,record])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import time
+import pickle
 import unittest
 
 import addtoplevelpath
@@ -20,7 +21,7 @@ scoper.ERROR_HANDLING="strict"
 USE_EXTERNAL_PREPROCESSOR = False
 
 # scan index
-index = []
+index = scoper.Index()
 
 # main file
 class TestScoper(unittest.TestCase):
@@ -66,6 +67,20 @@ class TestScoper(unittest.TestCase):
     def test_5_scoper_search_for_top_level_subprograms(self):
         func2 = scoper.search_index_for_subprogram(index,"test1","top_level_subroutine")
         scoper.SCOPES.clear()
+    def test_6_index_lookup(self):
+        self.assertEqual(index.find("simple")["kind"],"module")
+        self.assertEqual([irecord["name"] for irecord in index.top_level_subprograms()],["top_level_subroutine"])
+        self.assertEqual(index.find_by_tag("nested_subprograms:func2:func4")["name"],"func4")
+        self.assertIsNone(index.find_by_tag("nested_subprograms:func3"))
+        self.assertIsNone(index.find("missing"))
+        copied = pickle.loads(pickle.dumps(index))
+        self.assertEqual(list(copied),list(index))
+        self.assertEqual(copied.find_by_tag("test1")["kind"],"program")
+        copied.append({ "kind": "module", "name": "simple", "variables": [] }) # first record wins
+        copied.insert(0,{ "kind": "function", "name": "func5", "variables": [] })
+        self.assertEqual(copied.find("simple")["kind"],"module")
+        self.assertIn("types",copied.find("simple"))
+        self.assertEqual([irecord["name"] for irecord in copied.top_level_subprograms()],["func5","top_level_subroutine"])
 
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
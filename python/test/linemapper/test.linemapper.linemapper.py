@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
+import os
 import time
+import tempfile
 import unittest
 import cProfile,pstats,io
 import json
@@ -89,6 +91,153 @@ class TestIndexer(unittest.TestCase):
         self.assertEqual(clean_(result_lines),clean_(testdata_lines))
         self.assertEqual(clean_(result_raw_statements),clean_(testdata_raw_statements))
         self.assertEqual(clean_(result_statements),clean_(testdata_statements))
-      
+    def test_2_macro_expansion(self):
+        macro_stack = [
+          { "name": "N",     "args": [],        "subst": "10" },
+          { "name": "M",     "args": [],        "subst": "N+1" },
+          { "name": "F",     "args": ["x"],     "subst": "(x*N)" },
+          { "name": "G",     "args": ["x","y"], "subst": "F(x)+y" },
+          { "name": "H",     "args": [],        "subst": "G" },
+          { "name": "R",     "args": [],        "subst": "R+1" },
+          { "name": "S",     "args": ["x"],     "subst": "S(x-1)" },
+          { "name": "N",     "args": [],        "subst": "20" }, # redefinition
+        ]
+        testdata = [
+          ("a = b",                         "a = b"),
+          ("x(N), y(N,M)",                  "x(20), y(20,20+1)"),    # macros in arguments of non-macros
+          ("NX = N + XN",                   "NX = 20 + XN"),         # only whole identifiers
+          ("a = F( M )",                    "a = (20+1*20)"),
+          ("a = G(F(1),(2,3))",             "a = ((1*20)*20)+(2,3)"), # nested invocations, parenthesized commas
+          ("a = H(1,2)",                    "a = (1*20)+2"),         # expansion rescanned with the remaining text
+          ("a = F",                         "a = F"),                # function-like macro without arguments
+          ("a = F(1,2)",                    "a = F(1,2)"),           # wrong number of arguments
+          ("a = N(1)",                      "a = 20(1)"),            # object-like macro followed by parentheses
+          ("a = R",                         "a = R+1"),              # no infinite recursion
+          ("a = S(3)",                      "a = S(3-1)"),
+          ("if (defined(N) .and. defined(X)) b = N", "if (1 .and. 0) b = 20"),
+        ]
+        for text, expected in testdata:
+            self.assertEqual(linemapper._intrnl_expand_macros(text,macro_stack),expected)
+        macro_stack.pop()
+        self.assertEqual(linemapper._intrnl_expand_macros("a = N",macro_stack),"a = 10")
+    def test_3_condition_evaluation(self):
+        macro_stack = [
+          { "name": "A", "args": [], "subst": "B" },
+          { "name": "B", "args": [], "subst": "1" },
+        ]
+        condition_results = getattr(linemapper,"__condition_results")
+        self.assertTrue(linemapper.evaluate_condition("defined(A) && A > 0",macro_stack))
+        num_results = len(condition_results)
+        macro_stack.append({ "name": "C", "args": [], "subst": "0" }) # not referenced
+        self.assertTrue(linemapper.evaluate_condition("defined(A) && A > 0",macro_stack))
+        self.assertEqual(len(condition_results),num_results) # memoized
+        macro_stack.append({ "name": "B", "args": [], "subst": "0" }) # referenced via A
+        self.assertFalse(linemapper.evaluate_condition("defined(A) && A > 0",macro_stack))
+        macro_stack.pop()
+        self.assertTrue(linemapper.evaluate_condition("defined(A) && A > 0",macro_stack))
+        self.assertFalse(linemapper.evaluate_condition("defined(D)",macro_stack))
+        macro_stack.append({ "name": "D", "args": [], "subst": "" })
+        self.assertTrue(linemapper.evaluate_condition("defined(D)",macro_stack))
+    def test_4_include_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            header_filepath = os.path.join(tmpdir,"header.h")
+            main_filepath   = os.path.join(tmpdir,"main.f90")
+            with open(header_filepath,"w") as outfile:
+                outfile.write("#ifndef HEADER\n#define HEADER\n#endif\ninteger :: a = VALUE\n")
+            with open(main_filepath,"w") as outfile:
+                outfile.write("program main\n#include \"header.h\"\n#include \"header.h\"\nend program main\n")
+            include_cache = getattr(linemapper,"__include_cache")
+            def included_statements_(linemaps):
+                return [linemap["included_linemaps"][-1]["statements"] for linemap in linemaps[1:3]]
+            linemaps1 = linemapper.read_file(main_filepath,"-DVALUE=1")
+            self.assertEqual(included_statements_(linemaps1),[["integer :: a = 1\n"]]*2)
+            self.assertEqual(len(include_cache[header_filepath]),2) # HEADER not defined, defined
+            linemaps1[1]["included_linemaps"][-1]["statements"][0] = "integer :: a = 0\n"
+            linemaps1[1]["included_linemaps"][-1]["modified"] = True
+            linemaps1[1]["included_linemaps"][-1]["prolog"].append("! prolog\n")
+            linemaps2 = linemapper.read_file(main_filepath,"-DVALUE=1")
+            self.assertEqual(len(include_cache[header_filepath]),2) # cache hits
+            self.assertEqual(included_statements_(linemaps2),[["integer :: a = 1\n"]]*2)
+            self.assertFalse(linemaps2[1]["included_linemaps"][-1]["modified"])
+            self.assertEqual(linemaps2[1]["included_linemaps"][-1]["prolog"],[])
+            linemaps3 = linemapper.read_file(main_filepath,"-DVALUE=2") # referenced macro changed
+            self.assertEqual(included_statements_(linemaps3),[["integer :: a = 2\n"]]*2)
+            self.assertEqual(len(include_cache[header_filepath]),4)
+            with open(header_filepath,"w") as outfile: # file changed
+                outfile.write("integer :: b = VALUE\n")
+            linemaps4 = linemapper.read_file(main_filepath,"-DVALUE=2")
+            self.assertEqual(included_statements_(linemaps4),[["integer :: b = 2\n"]]*2)
+    def test_5_linemap(self):
+        lines    = ["#define N 5\n","a = 1; b = 2\n","c = N\n","d = 4"]
+        linemaps = linemapper.preprocess_and_normalize(lines,"dummy.f90",[],[True],[True])
+        self.assertEqual([linemap.lines for linemap in linemaps],[[line] for line in lines])
+        self.assertEqual([linemap.statements for linemap in linemaps],[[],["a = 1","b = 2\n"],["c = 5\n"],["d = 4"]])
+        self.assertEqual([(linemap._raw_statements,linemap._statements) for linemap in linemaps[2:]],
+                         [(None,["c = 5\n"]),(None,None)]) # only store statements that differ
+        linemap = linemaps[3]
+        copy    = linemap.copy()
+        linemap.set_statement(0,None)
+        self.assertEqual((linemap.statements,linemap.raw_statements,copy.statements),([None],["d = 4"],["d = 4"]))
+        copy["statements"][0] = "e = 5" # dict-like access
+        copy["modified"] = True
+        self.assertEqual((copy.statements,copy.modified,copy.get("prolog"),"epilog" in copy),(["e = 5"],True,[],True))
+        self.assertEqual(linemaps[0].to_dict()["is_preprocessor_directive"],True)
+        # lines that cannot be recovered from their joined text
+        linemaps = linemapper.preprocess_and_normalize(["a = 1","b = 2"],"dummy.f90",[],[True],[True])
+        self.assertEqual([linemap.lines for linemap in linemaps],[["a = 1"],["b = 2"]])
+    def test_6_scan_buffer(self):
+        lines = ["program main\n","  a = 1; b = 2\n","  call f(a, &\n","    b) \t\n","  IF (a > 1) b = 3\n","  if (a > 1) then\n",
+                 "#define M(x) \\\n","  x\n","  c = 'if'\n","  end program"]
+        buffer, offsets = linemapper._intrnl_create_buffer(lines)
+        line_starts, convert_lines = linemapper._intrnl_scan_buffer(buffer,offsets)
+        self.assertEqual(line_starts,linemapper._intrnl_detect_line_starts(lines))
+        for i,line in enumerate(lines):
+            if i not in convert_lines:
+                self.assertEqual(linemapper._intrnl_convert_lines_to_statements([line]),[line])
+        self.assertEqual(sorted(convert_lines),[1,2,4,5]) # line 3 continues line 2
+    def test_7_read_file_incrementally(self):
+        checkpoint_interval = linemapper.CHECKPOINT_INTERVAL
+        linemapper.CHECKPOINT_INTERVAL = 2
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepath = os.path.join(tmpdir,"main.f90")
+            def read_(lines,previous):
+                with open(filepath,"w") as outfile:
+                    outfile.writelines(lines)
+                linemaps, snapshot, reused = linemapper.read_file_incrementally(filepath,"-DVALUE=1",previous)
+                self.assertEqual([linemap.to_dict() for linemap in linemaps],
+                                 [linemap.to_dict() for linemap in linemapper.read_file(filepath,"-DVALUE=1")])
+                return snapshot, reused
+            lines = ["program main\n","#define N 5\n","a = N\n","b = VALUE\n","#ifdef N\n","c = 1\n","#endif\n","d = N\n","end program\n"]
+            snapshot, reused = read_(lines,None)
+            self.assertEqual(reused,[None]*9)
+            snapshot, reused = read_(lines,snapshot)
+            self.assertEqual(reused,list(range(9)))
+            snapshot, reused = read_(lines[:3]+["a = 2; b = 3\n"]+lines[3:],snapshot) # insert line
+            self.assertEqual(reused,[0,1,None,None,None,4,5,6,7,8]) # restart at checkpoint in front of line 3
+            snapshot, reused = read_(lines[:1]+["#define N 6\n"]+lines[2:],snapshot) # state differs behind edit
+            self.assertEqual(reused,[None]*9) # restart at first line
+            self.assertEqual(read_(lines,snapshot)[1],[None]*9)
+        linemapper.CHECKPOINT_INTERVAL = checkpoint_interval
+    def test_8_write_modified_file(self):
+        lines    = ["program main\n","  a = 1\n","\n","  b = 2\n","\n","\n","  c = 3\n","end program\n"]
+        linemaps = linemapper.preprocess_and_normalize(lines,"dummy.f90",[],[True],[True])
+        linemaps[1].modified = True
+        linemaps[1].set_statement(0,"  a = 4\n")
+        linemaps[3].modified = True
+        linemaps[3].set_statement(0,None)
+        linemaps[6].prolog.append("  ! prolog\n")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filepath = os.path.join(tmpdir,"out.f90")
+            def write_(wrap_in_ifdef):
+                linemapper.LINE_GROUPING_WRAP_IN_IFDEF = wrap_in_ifdef
+                linemapper.write_modified_file(filepath,"dummy.f90",linemaps,"! preamble\n")
+                linemapper.LINE_GROUPING_WRAP_IN_IFDEF = False
+                with open(filepath,"r") as infile:
+                    return infile.read()
+            self.assertEqual(write_(False),"! preamble\nprogram main\n  a = 4\n\n\n\n\n  ! prolog\n  c = 3\nend program")
+            self.assertEqual(write_(True),"#ifdef __GPUFORT\n! preamble\n#endif\nprogram main\n"+
+              "#ifdef __GPUFORT\n  a = 4\n\n\n\n  ! prolog\n  c = 3\n#else\n  a = 1\n\n  b = 2\n\n\n  c = 3\n#endif\n"+ # blank lines join the blocks
+              "end program")
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import os,sys
+import io
+import time
+import tempfile
+import contextlib
+import multiprocessing
+import unittest
+
+import addtoplevelpath
+import server.server as server
+
+SOCKET_PATH = os.path.join(tempfile.gettempdir(),"gpufort-test-{}.sock".format(os.getpid()))
+
+# dummy job; the server calls it in a child process after setting sys.argv and the working directory
+EXAMPLE_JOB_GLOBAL = 0
+
+def example_job():
+    global EXAMPLE_JOB_GLOBAL
+    EXAMPLE_JOB_GLOBAL += 1 # must not leak into other jobs
+    args = sys.argv[1:]
+    print("cwd={} args={} global={}".format(os.getcwd()," ".join(args),EXAMPLE_JOB_GLOBAL))
+    print("message on stderr",file=sys.stderr)
+    if args[0] == "fail":
+        raise RuntimeError("job failed")
+    sys.exit(int(args[0]))
+
+def run_client_request(argv,cwd):
+    stdout, stderr = io.StringIO(), io.StringIO()
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        exit_code = server.run_client_request(SOCKET_PATH,argv,cwd)
+    return exit_code, stdout.getvalue(), stderr.getvalue()
+
+class TestServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._server = multiprocessing.get_context("fork").Process(
+          target=server.serve,args=(example_job,SOCKET_PATH,2))
+        cls._server.start()
+        for _ in range(100):
+            if server.run_client_request(SOCKET_PATH,None) != None:
+                break
+            time.sleep(0.05)
+    @classmethod
+    def tearDownClass(cls):
+        cls._server.terminate()
+        cls._server.join()
+    def setUp(self):
+        self._started_at = time.time()
+    def tearDown(self):
+        elapsed = time.time() - self._started_at
+        print('{} ({}s)'.format(self.id(), round(elapsed, 6)))
+    def test_0_no_server(self):
+        self.assertEqual(server.run_client_request(SOCKET_PATH+".none",["0"]),None)
+    def test_1_run_jobs(self):
+        cwd = tempfile.gettempdir()
+        for exit_code in [0,3,0]:
+            result = run_client_request([str(exit_code),"-w"],cwd)
+            self.assertEqual(result,(exit_code,
+              "cwd={} args={} -w global=1\n".format(os.path.realpath(cwd),exit_code),
+              "message on stderr\n"))
+    def test_2_failing_job(self):
+        exit_code, stdout, stderr = run_client_request(["fail"],os.getcwd())
+        self.assertEqual(exit_code,1)
+        self.assertIn("RuntimeError: job failed",stderr)
+    def test_3_concurrent_jobs(self):
+        with multiprocessing.get_context("fork").Pool(4) as pool:
+            results = pool.starmap(run_client_request,[([str(i)],os.getcwd()) for i in range(8)])
+        self.assertEqual([result[0] for result in results],list(range(8)))
+    def test_4_server_already_running(self):
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()):
+            server.serve(example_job,SOCKET_PATH)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: per-statement overhead of the logging calls in hot code paths
+when the log level is WARNING, i.e. when no debug message is logged.
+
+'before' replays the call sites and the logging function body as they were before
+the level flags were cached and the messages were formatted lazily;
+'after' uses the current API.
+"""
+import os,sys
+import re
+import logging
+import timeit
+
+import addtoplevelpath
+import utils.logging
+
+LOG_PREFIX = "bench"
+NUM_STATEMENTS = 100000
+
+# logging before: message formatted at the call site, filter evaluated before the logger checks the level 
+def legacy_log_debug(prefix,func_name,raw_msg,debug_level=1):
+    msg = prefix+"."+func_name+"(...):\t"+raw_msg
+    if utils.logging.LOG_FILTER == None or re.search(utils.logging.LOG_FILTER,msg):
+        if debug_level == 1:
+           logging.getLogger("").debug(msg)
+        elif debug_level == 2:
+           logging.getLogger("").debug2(msg)
+        else:
+           logging.getLogger("").debug3(msg)
+
+def legacy_log_enter_function(prefix,func_name,args={}):
+    if len(args):
+        addition = " [arguments: "+ ", ".join(a+"="+str(args[a]) for a in args.keys())+"]"
+    else:
+        addition = "" 
+    legacy_log_debug(prefix,func_name,"enter"+addition)
+
+def statement_before(statement,kind):
+    legacy_log_enter_function(LOG_PREFIX,"parse",{"statement":statement})
+    legacy_log_debug(LOG_PREFIX,"parse","process statement '{}'".format(statement),3)
+    legacy_log_debug(LOG_PREFIX,"parse","[current-node={}:{}] found {} in statement: '{}'".format(\
+      "module","mymod",kind,statement),2)
+    legacy_log_debug(LOG_PREFIX,"parse","return")
+
+def statement_after(statement,kind):
+    utils.logging.log_enter_function(LOG_PREFIX,"parse",{"statement":statement})
+    utils.logging.log_debug3(LOG_PREFIX,"parse","process statement '{}'",statement)
+    utils.logging.log_debug2(LOG_PREFIX,"parse","[current-node={}:{}] found {} in statement: '{}'",\
+      "module","mymod",kind,statement)
+    utils.logging.log_leave_function(LOG_PREFIX,"parse")
+
+def run(statement_func):
+    for i in range(NUM_STATEMENTS):
+        statement_func("integer :: a(n)","declaration")
+
+if __name__ == "__main__":
+    utils.logging.LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)))
+    for log_filter in [None,"parse"]:
+        utils.logging.init_logging("bench.log","%(levelname)s:%(message)s","warning")
+        utils.logging.LOG_FILTER = log_filter
+        print("LOG_FILTER={}:".format(log_filter))
+        results = {}
+        for name, func in [("before",statement_before),("after",statement_after)]:
+            results[name] = min(timeit.repeat(lambda: run(func),number=1,repeat=5))/NUM_STATEMENTS*1e9
+            print("  {:6s} {:8.1f} ns/statement".format(name,results[name]))
+        print("  speedup: {:.1f}x".format(results["before"]/results["after"]))
+    utils.logging.shutdown()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+import os,sys
+import time
+import tempfile
+import unittest
+
+import addtoplevelpath
+import utils.fileutils
+
+def chunks(fail):
+    yield "first chunk\n"
+    if fail:
+        raise RuntimeError("template failed")
+    yield "second chunk\n"
+
+class TestFileutils(unittest.TestCase):
+    def setUp(self):
+        self._started_at = time.time()
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self._filepath = os.path.join(self._tmpdir.name,"kernels.hip.cpp")
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        elapsed = time.time() - self._started_at
+        print('{} ({}s)'.format(self.id(), round(elapsed, 6)))
+    def read_(self):
+        with open(self._filepath,"r") as infile:
+            return infile.read()
+    def test_0_write_output_file(self):
+        utils.fileutils.write_output_file(self._filepath,chunks(fail=False))
+        self.assertEqual(self.read_(),"first chunk\nsecond chunk\n")
+        utils.fileutils.write_output_file(self._filepath,"content")
+        self.assertEqual(self.read_(),"content")
+    def test_1_failed_generation_leaves_no_partial_file(self):
+        with self.assertRaises(RuntimeError):
+            utils.fileutils.write_output_file(self._filepath,chunks(fail=True))
+        self.assertEqual(os.listdir(self._tmpdir.name),[])
+        utils.fileutils.write_output_file(self._filepath,"previous")
+        with self.assertRaises(RuntimeError):
+            utils.fileutils.write_output_file(self._filepath,chunks(fail=True))
+        self.assertEqual(self.read_(),"previous")
+        self.assertEqual(os.listdir(self._tmpdir.name),["kernels.hip.cpp"])
+    def test_2_write_binary_output_file(self):
+        utils.fileutils.write_output_file(self._filepath,b"\x00binary\n")
+        with open(self._filepath,"rb") as infile:
+            self.assertEqual(infile.read(),b"\x00binary\n")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import os,sys
+import time
+import unittest
+
+import addtoplevelpath
+import utils.logging
+
+LOG_DIR = os.path.dirname(os.path.abspath(__file__))
+
+utils.logging.LOG_DIR = LOG_DIR
+utils.logging.VERBOSE = False
+
+class Unprintable:
+    def __str__(self):
+        raise AssertionError("message must not be formatted")
+
+def read_log():
+    utils.logging.shutdown()
+    with open(os.path.join(LOG_DIR,"log.log"),"r") as infile:
+        return infile.read()
+
+class TestLogging(unittest.TestCase):
+    def setUp(self):
+        self._started_at = time.time()
+    def tearDown(self):
+        elapsed = time.time() - self._started_at
+        print('{} ({}s)'.format(self.id(), round(elapsed, 6)))
+    def test_0_disabled_levels_are_not_formatted(self):
+        utils.logging.init_logging("log.log","%(levelname)s:%(message)s","warning")
+        self.assertFalse(utils.logging.debug_level_enabled(1))
+        utils.logging.log_debug(LOG_PREFIX,"f","{}",args=(Unprintable(),))
+        utils.logging.log_debug3(LOG_PREFIX,"f","{}",Unprintable())
+        utils.logging.log_enter_function(LOG_PREFIX,"f",{"arg":Unprintable()})
+        utils.logging.log_leave_function(LOG_PREFIX,"f",lambda: {"arg":Unprintable()})
+        self.assertEqual(read_log(),"")
+    def test_1_enabled_levels(self):
+        utils.logging.init_logging("log.log","%(levelname)s:%(message)s","debug3")
+        self.assertTrue(utils.logging.debug_level_enabled(3))
+        self.assertFalse(utils.logging.debug_level_enabled(4))
+        utils.logging.log_debug3(LOG_PREFIX,"f","statement '{}' in line {}","a = 1",5)
+        utils.logging.log_debug2(LOG_PREFIX,"f","no format args: {}")
+        utils.logging.log_debug4(LOG_PREFIX,"f","{}",Unprintable())
+        utils.logging.log_enter_function(LOG_PREFIX,"f",lambda: {"arg":1})
+        self.assertEqual(read_log(),
+          "DEBUG3:test.f(...):\tstatement 'a = 1' in line 5\n"+
+          "DEBUG2:test.f(...):\tno format args: {}\n"+
+          "DEBUG:test.f(...):\tenter [arguments: arg=1]\n")
+    def test_2_log_filter(self):
+        utils.logging.init_logging("log.log","%(levelname)s:%(message)s","debug")
+        utils.logging.LOG_FILTER = "keep"
+        utils.logging.log_debug1(LOG_PREFIX,"f","{} this","keep")
+        utils.logging.log_debug1(LOG_PREFIX,"f","{} this","drop")
+        utils.logging.LOG_FILTER = None
+        self.assertEqual(read_log(),"DEBUG:test.f(...):\tkeep this\n")
+    def test_3_async_sink(self):
+        utils.logging.ASYNC = True
+        utils.logging.ASYNC_QUEUE_SIZE = 4 # forces the logging threads to block
+        utils.logging.init_logging("log.log","%(levelname)s:%(message)s","debug")
+        for i in range(10):
+            utils.logging.log_debug1(LOG_PREFIX,"f","parent {}",i)
+        pid = os.fork()
+        if pid == 0:
+            for i in range(10):
+                utils.logging.log_debug1(LOG_PREFIX,"f","child {}",i)
+            utils.logging.shutdown()
+            os._exit(0)
+        os.waitpid(pid,0)
+        utils.logging.log_debug1(LOG_PREFIX,"f","parent done")
+        utils.logging.ASYNC = False
+        self.assertEqual(read_log(),"".join(
+          ["DEBUG:test.f(...):\tparent {}\n".format(i) for i in range(10)]+
+          ["DEBUG:test.f(...):\tchild {}\n".format(i) for i in range(10)]+
+          ["DEBUG:test.f(...):\tparent done\n"]))
+
+LOG_PREFIX = "test"
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import os,sys
+import time
+import tempfile
+import threading
+import unittest
+
+import addtoplevelpath
+import utils.prefetch
+import utils.fileutils
+
+loaded_by = {}
+
+def load(filepath):
+    loaded_by[filepath] = threading.current_thread().name
+    with open(filepath,"r") as infile:
+        return infile.read()
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self._started_at = time.time()
+        self._tmpdir = tempfile.TemporaryDirectory()
+        loaded_by.clear()
+    def tearDown(self):
+        self._tmpdir.cleanup()
+        elapsed = time.time() - self._started_at
+        print('{} ({}s)'.format(self.id(), round(elapsed, 6)))
+    def write_(self,name,content):
+        filepath = os.path.join(self._tmpdir.name,name)
+        with open(filepath,"w") as outfile:
+            outfile.write(content)
+        return filepath
+    def test_0_prefetch_and_read(self):
+        filepath = self.write_("a.txt","a")
+        utils.prefetch.prefetch(filepath,load)
+        self.assertEqual(utils.prefetch.read(filepath,load),"a")
+        self.assertTrue(loaded_by[filepath].startswith("prefetch"))
+        self.assertEqual(utils.prefetch.read(filepath,load),"a") # consumed, read again
+        self.assertEqual(loaded_by[filepath],threading.current_thread().name)
+    def test_1_errors_are_raised_by_read(self):
+        filepath = os.path.join(self._tmpdir.name,"missing.txt")
+        utils.prefetch.prefetch(filepath,load)
+        with self.assertRaises(IOError):
+            utils.prefetch.read(filepath,load)
+    def test_2_discard_before_write(self):
+        filepath = self.write_("b.txt","old")
+        utils.prefetch.prefetch(filepath,load)
+        utils.fileutils.prepare_output_file(filepath)
+        self.write_("b.txt","new")
+        self.assertEqual(utils.prefetch.read(filepath,load),"new")
+    def test_3_read_all(self):
+        filepaths = [self.write_("{}.txt".format(i),str(i)) for i in range(3*utils.prefetch.MAX_PREFETCHED_FILES)]
+        self.assertEqual(list(utils.prefetch.read_all(filepaths,load)),[str(i) for i in range(len(filepaths))])
+    def test_4_forked_process(self):
+        filepath = self.write_("c.txt","c")
+        utils.prefetch.prefetch(filepath,load)
+        pid = os.fork()
+        if pid == 0:
+            utils.prefetch.prefetch(filepath,load)
+            os._exit(0 if utils.prefetch.read(filepath,load) == "c" else 1)
+        _, status = os.waitpid(pid,0)
+        self.assertEqual(os.WEXITSTATUS(status),0)
+        self.assertEqual(utils.prefetch.read(filepath,load),"c")
+    def test_5_discard_waits_for_background_tasks(self):
+        filepath = self.write_("d.txt","old")
+        def discover(filepath):
+            time.sleep(0.1) # e.g. scanning a file for the files to prefetch
+            utils.prefetch.prefetch(filepath,load)
+        utils.prefetch.run_in_background(discover,filepath)
+        utils.fileutils.prepare_output_file(filepath)
+        time.sleep(0.3) # e.g. generating the content
+        self.write_("d.txt","new")
+        self.assertEqual(utils.prefetch.read(filepath,load),"new")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+import os,sys
+import json
+import time
+import tempfile
+import unittest
+
+import addtoplevelpath
+import utils.timing
+
+class TestTiming(unittest.TestCase):
+    def setUp(self):
+        self._started_at = time.time()
+        utils.timing.clear()
+    def tearDown(self):
+        utils.timing.ENABLED = False
+        elapsed = time.time() - self._started_at
+        print('{} ({}s)'.format(self.id(), round(elapsed, 6)))
+    def test_0_disabled(self):
+        utils.timing.ENABLED = False
+        with utils.timing.timed("stage"):
+            pass
+        self.assertEqual(list(utils.timing.timed_iterations([1,2],"kernel")),[1,2])
+        self.assertEqual(utils.timing.events(),[])
+    def test_1_nested_stages_and_iterations(self):
+        utils.timing.ENABLED = True
+        with utils.timing.timed("outer",args={"input":"a.f90"}):
+            for i in utils.timing.timed_iterations([1,2,3],"iteration","kernel",lambda i: {"i":i}):
+                with utils.timing.timed("inner","kernel"):
+                    time.sleep(0.001)
+        events = utils.timing.events()
+        self.assertEqual([event["name"] for event in events],["inner","iteration"]*3+["outer"])
+        self.assertEqual([event["args"] for event in events if event["name"] == "iteration"],[{"i":1},{"i":2},{"i":3}])
+        summary = {total["name"]: total for total in utils.timing.summary()}
+        self.assertEqual(summary["inner"]["count"],3)
+        self.assertGreaterEqual(summary["outer"]["wall_time"],summary["iteration"]["wall_time"])
+        self.assertGreaterEqual(summary["iteration"]["wall_time"],summary["inner"]["wall_time"])
+    def test_2_write_timings_and_trace(self):
+        utils.timing.ENABLED = True
+        with utils.timing.timed("stage"):
+            pass
+        utils.timing.add_events([dict(utils.timing.events()[0],pid=0)]) # e.g. from a worker process
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            utils.timing.write_timings(os.path.join(tmp_dir,"timings.json"))
+            utils.timing.write_trace(os.path.join(tmp_dir,"trace.json"))
+            with open(os.path.join(tmp_dir,"timings.json"),"r") as infile:
+                timings = json.load(infile)
+            with open(os.path.join(tmp_dir,"trace.json"),"r") as infile:
+                trace = json.load(infile)
+        self.assertEqual(timings["summary"][0]["count"],2)
+        self.assertEqual(timings["events"][0]["start"],0.0)
+        self.assertEqual(sorted(event["pid"] for event in trace["traceEvents"]),[0,os.getpid()])
+        self.assertEqual({event["ph"] for event in trace["traceEvents"]},{"X"})
+
+if __name__ == '__main__':
+    unittest.main()
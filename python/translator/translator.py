@@ -10,20 +10,46 @@ import re
 
 # recursive inclusion
 import indexer.scoper as scoper
+import utils.codecache
 import utils.logging
 import utils.pyparsingutils 
 
-#from grammar import *
-CASELESS    = True
-GRAMMAR_DIR = os.path.join(os.path.dirname(__file__),"../grammar")
-exec(open("{0}/grammar.py".format(GRAMMAR_DIR)).read())
+import grammar.grammar as grammar
+
+# The translator registers its parse actions at the shared caseless grammar variant
+globals().update(grammar.get_grammar(caseless=True))
 
 TRANSLATOR_DIR = os.path.dirname(os.path.abspath(__file__))
-exec(open(os.path.join(TRANSLATOR_DIR, "translator_options.py.in")).read())
-exec(open(os.path.join(TRANSLATOR_DIR, "translator_base.py.in")).read())
-exec(open(os.path.join(TRANSLATOR_DIR, "translator_f03.py.in")).read())
-exec(open(os.path.join(TRANSLATOR_DIR, "translator_directives.py.in")).read())
-exec(open(os.path.join(TRANSLATOR_DIR, "translator_cuf.py.in")).read())
-exec(open(os.path.join(TRANSLATOR_DIR, "translator_acc.py.in")).read())
-exec(open(os.path.join(TRANSLATOR_DIR, "translator_parser.py.in")).read())
-exec(open(os.path.join(TRANSLATOR_DIR, "translator_api.py.in")).read())
\ No newline at end of file
+utils.codecache.exec_file(os.path.join(TRANSLATOR_DIR, "translator_options.py.in"),globals())
+utils.codecache.exec_file(os.path.join(TRANSLATOR_DIR, "translator_base.py.in"),globals())
+utils.codecache.exec_file(os.path.join(TRANSLATOR_DIR, "translator_f03.py.in"),globals())
+utils.codecache.exec_file(os.path.join(TRANSLATOR_DIR, "translator_directives.py.in"),globals())
+utils.codecache.exec_file(os.path.join(TRANSLATOR_DIR, "translator_cuf.py.in"),globals())
+utils.codecache.exec_file(os.path.join(TRANSLATOR_DIR, "translator_parser.py.in"),globals())
+utils.codecache.exec_file(os.path.join(TRANSLATOR_DIR, "translator_api.py.in"),globals())
+
+# Node families that are only required for certain source dialects.
+# The CUDA Fortran nodes are always loaded as they also cover generic statements such
+# as allocate and attributes.
+__DIALECT_FILES = {
+  "acc" : "translator_acc.py.in",
+}
+__loaded_dialects = set()
+
+def load_dialect(source_dialect):
+    """
+    Load the nodes of a source dialect and attach their parse actions 
+    to the grammar if this has not been done yet.
+    :param str source_dialect: A source dialect such as 'acc' or 'cuf'. 
+    """
+    global __loaded_dialects
+    if source_dialect in __DIALECT_FILES and not source_dialect in __loaded_dialects:
+        __loaded_dialects.add(source_dialect)
+        utils.codecache.exec_file(os.path.join(TRANSLATOR_DIR,__DIALECT_FILES[source_dialect]),globals())
+
+def __getattr__(name):
+    """Load the OpenACC nodes when one of them is accessed from outside for the first time."""
+    if name.startswith("TTAcc") and not "acc" in __loaded_dialects:
+        load_dialect("acc")
+        return globals()[name]
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__,name))
@@ -0,0 +1,65 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
+"""Bytecode cache for the '*.py.in' source files that are executed into module namespaces.
+
+Python's import system does not cache the bytecode of source that is passed to 'exec'.
+This module compiles such files once and stores the code object next to the
+file in the '__pycache__' directory. A cache entry is keyed on the hash of the file
+content and the interpreter's magic number, so a modified file or a different
+Python version simply leads to recompilation.
+"""
+import os
+import sys
+import hashlib
+import marshal
+import importlib.util
+
+CACHE_ENABLED = True # Set to False to always compile from source.
+
+__HEADER_SIZE = len(importlib.util.MAGIC_NUMBER) + hashlib.sha1().digest_size
+
+def _intrnl_cache_filepath(filepath):
+    dirname, basename = os.path.split(os.path.abspath(filepath))
+    return os.path.join(dirname,"__pycache__","{}.{}.pyc".format(
+      basename,sys.implementation.cache_tag))
+
+def _intrnl_write_cache_file(cache_filepath,header,code):
+    try:
+        os.makedirs(os.path.dirname(cache_filepath),exist_ok=True)
+        tmp_filepath = "{}.{}".format(cache_filepath,os.getpid())
+        with open(tmp_filepath,"wb") as outfile:
+            outfile.write(header)
+            marshal.dump(code,outfile)
+        os.replace(tmp_filepath,cache_filepath)
+    except OSError:
+        pass # e.g. read-only installation; keep working without cache
+
+def load_code(filepath):
+    """
+    :return: Code object for the Python source in 'filepath'.
+             Loaded from the bytecode cache if the file has not changed.
+    """
+    with open(filepath,"rb") as infile:
+        source = infile.read()
+    if not CACHE_ENABLED:
+        return compile(source,filepath,"exec")
+    header         = importlib.util.MAGIC_NUMBER + hashlib.sha1(source).digest()
+    cache_filepath = _intrnl_cache_filepath(filepath)
+    try:
+        with open(cache_filepath,"rb") as infile:
+            data = infile.read()
+        if data[:__HEADER_SIZE] == header:
+            return marshal.loads(data[__HEADER_SIZE:])
+    except (OSError,ValueError,EOFError,TypeError):
+        pass
+    code = compile(source,filepath,"exec")
+    if not sys.dont_write_bytecode:
+        _intrnl_write_cache_file(cache_filepath,header,code)
+    return code
+
+def exec_file(filepath,namespace):
+    """
+    Execute the Python source in 'filepath' in the given namespace (dict),
+    e.g. the 'globals()' of the calling module.
+    """
+    exec(load_code(filepath),namespace)
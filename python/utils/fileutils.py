@@ -1,12 +1,66 @@
 # SPDX-License-Identifier: MIT                                                
 # Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
 #!/usr/bin/env python3
+import os
 import subprocess
 import logging
 import sys
 
+import utils.timing
+import utils.prefetch
+
 #CLANG_FORMAT_STYLE="\"{BasedOnStyle: llvm, ColumnLimit: 140}\""
 
+__recorded_output_files = None
+
+def record_output_files(filepaths):
+    """
+    Append the paths of all output files that are prepared via 'prepare_output_file'
+    to the list 'filepaths'. Pass None to stop recording.
+    """
+    global __recorded_output_files
+    __recorded_output_files = filepaths
+
+def prepare_output_file(filepath):
+    """
+    Must be called before an output file is (over)written.
+    Unlinks the file if it has further hardlinks, e.g. into the translation cache,
+    so that writing the file does not modify the linked files. Records the file path
+    if recording is enabled. Drops prefetched content of the file.
+    """
+    utils.prefetch.discard(filepath)
+    try:
+        if os.stat(filepath).st_nlink > 1:
+            os.unlink(filepath)
+    except FileNotFoundError:
+        pass
+    if __recorded_output_files != None:
+        __recorded_output_files.append(os.path.abspath(filepath))
+
+def write_output_file(filepath,content):
+    """
+    Write the content to a temporary file in the directory of the output file
+    and move it into place once it has been written completely. If generating the content
+    fails, e.g. because a template raises, no truncated output file is left behind.
+    :param content: A string or an iterable of strings, e.g. the chunks generated by a model,
+                    or bytes, which are written in binary mode.
+    """
+    tmp_filepath = "{}.{}.tmp".format(filepath,os.getpid())
+    binary       = isinstance(content,(bytes,bytearray,memoryview))
+    try:
+        with open(tmp_filepath,"wb" if binary else "w") as outfile:
+            if binary or isinstance(content,str):
+                outfile.write(content)
+            else:
+                outfile.writelines(content)
+        os.replace(tmp_filepath,filepath)
+    except BaseException:
+        try:
+            os.unlink(tmp_filepath)
+        except OSError:
+            pass
+        raise
+
 def prettify_c_code(cCode,style):
     """
     Requires clang-format 7.0+.
@@ -25,7 +79,8 @@ def prettify_c_file(cPath,style):
     /opt/rocm-<suffix>/hcc/bin/clang-format"
     """
     command = "clang-format -i -style={1} {0}".format(cPath,style) # writes inplace
-    subprocess.check_output(command,shell=True).decode('ascii')
+    with utils.timing.timed("utils.fileutils.prettify_c_file",args={"file":cPath}):
+        subprocess.check_output(command,shell=True).decode('ascii')
 
 def prettify_f_code(fCode):
     """
@@ -39,8 +94,9 @@ def prettify_f_file(fPath):
     """
     Requires fprettify
     """
-    subprocess.check_call(["fprettify","-l 1000",fPath], stdout=subprocess.DEVNULL)
-    subprocess.check_call(r"sed -i 's,\s*\([<>]\)\s*[<>]\s*[<>]\s*,\1\1\1,g' {0}".format(fPath), shell=True, stdout=subprocess.DEVNULL)
+    with utils.timing.timed("utils.fileutils.prettify_f_file",args={"file":fPath}):
+        subprocess.check_call(["fprettify","-l 1000",fPath], stdout=subprocess.DEVNULL)
+        subprocess.check_call(r"sed -i 's,\s*\([<>]\)\s*[<>]\s*[<>]\s*,\1\1\1,g' {0}".format(fPath), shell=True, stdout=subprocess.DEVNULL)
     #return subprocess.check_output(command,shell=True).decode('ascii')
     #pass
 
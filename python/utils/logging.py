@@ -2,32 +2,114 @@
 # Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
 import os,sys
 import re
+import queue
+import atexit
 import logging
+import logging.handlers
 import traceback
 
-exec(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "logging_options.py.in")).read())
+import utils.codecache
+
+utils.codecache.exec_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "logging_options.py.in"),globals())
 
 __LOG_LEVEL              = "WARNING" # should only be modified by init_logging
 __LOG_LEVEL_AS_INT       = getattr(logging,__LOG_LEVEL)
 __LOG_FORMAT             = "%(levelname)s:%(message)s"
 __LOG_FILE_PATH          = None
 __LOGGING_IS_INITIALIZED = False
+__MAX_DEBUG_LEVEL        = 5
+
+# Cached level flags; the i-th entry is True if debug level i is enabled (entry 0 is unused).
+# Updated by init_logging and checked first by the debug logging functions so that
+# disabled log calls return before the message is formatted or filtered. 
+__DEBUG_LEVEL_ENABLED = [False]*(__MAX_DEBUG_LEVEL+1)
+__log_filter          = None # compiled LOG_FILTER
+__async_sink          = None # (queue handler, listener, file handler) if ASYNC is set
 
 ERR_UTILS_LOGGING_UNSUPPORTED_LOG_LEVEL  = 91001
 ERR_UTILS_LOGGING_LOG_DIR_DOES_NOT_EXIST = 91002
 
+class _intrnl_BlockingQueueHandler(logging.handlers.QueueHandler):
+    """Blocks if the queue is full instead of dropping records."""
+    def enqueue(self,record):
+        self.queue.put(record)
+    def prepare(self,record):
+        return record # the records are handled in this process; no need to copy/pickle them
+
+class _intrnl_QueueDrainingFileHandler(logging.FileHandler):
+    """Only flushes the file if no further records are pending, i.e. writes records in batches."""
+    def __init__(self,filename,mode,log_queue):
+        logging.FileHandler.__init__(self,filename,mode)
+        self._log_queue = log_queue
+    def flush(self):
+        if self._log_queue.empty():
+            logging.FileHandler.flush(self)
+
+def _intrnl_start_async_sink(formatter):
+    """Route all records through a bounded queue to a background thread that appends them to the log file."""
+    global __async_sink
+    log_queue     = queue.Queue(ASYNC_QUEUE_SIZE)
+    file_handler  = _intrnl_QueueDrainingFileHandler(__LOG_FILE_PATH,"a",log_queue)
+    file_handler.setFormatter(formatter)
+    queue_handler = _intrnl_BlockingQueueHandler(log_queue)
+    listener      = logging.handlers.QueueListener(log_queue,file_handler)
+    listener.start()
+    __async_sink  = (queue_handler,listener,file_handler)
+    root = logging.getLogger("")
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(queue_handler)
+
+def _intrnl_stop_async_sink():
+    """
+    Write all pending records and stop the background thread.
+    Records that are logged afterwards are written synchronously.
+    """
+    global __async_sink
+    if __async_sink != None:
+        queue_handler, listener, file_handler = __async_sink
+        __async_sink = None
+        listener.stop()
+        file_handler.close()
+        root = logging.getLogger("")
+        root.removeHandler(queue_handler)
+        sync_handler = logging.FileHandler(file_handler.baseFilename,"a")
+        sync_handler.setFormatter(file_handler.formatter)
+        root.addHandler(sync_handler)
+
+def _intrnl_flush_async_sink_before_fork():
+    if __async_sink != None:
+        queue_handler, _, file_handler = __async_sink
+        queue_handler.queue.join()
+        file_handler.flush()
+
+def _intrnl_restart_async_sink_after_fork():
+    """The background thread is not inherited by a forked child process; start a new one that appends to the same file."""
+    if __async_sink != None:
+        _, _, file_handler = __async_sink
+        _intrnl_start_async_sink(file_handler.formatter)
+
+os.register_at_fork(before=_intrnl_flush_async_sink_before_fork,
+                    after_in_child=_intrnl_restart_async_sink_after_fork)
+atexit.register(_intrnl_stop_async_sink) # runs before logging's own exit handler
+
 def shutdown():
+    """Write all pending log records and close the log file."""
+    _intrnl_stop_async_sink()
     logging.shutdown()
 
-def init_logging(logfile_basename="log.log",log_format=__LOG_FORMAT,log_level="warning"):
+def init_logging(logfile_basename="log.log",log_format=__LOG_FORMAT,log_level="warning",append=False):
     """
-    Init the logging infrastructure.
+    Init the logging infrastructure. A previous initialization is replaced.
 
     :param str log_format: The format that the log writer should use.
     :param str logfile_basename:  The base name of the log file that this logging module should use.
+    :param bool append: Append to the log file instead of overwriting it.
     :return 
     :note: Directory for storing the log file and further options can be specified
            via global variables before calling this method.
+    :note: If ASYNC is set, the log file is written by a background thread.
     """
     global __LOG_LEVEL
     global __LOG_LEVEL_AS_INT
@@ -59,8 +141,13 @@ def init_logging(logfile_basename="log.log",log_format=__LOG_FORMAT,log_level="w
         __LOG_FILE_PATH="{0}/{1}".format(log_dir,logfile_basename)
         __LOG_LEVEL_AS_INT       = getattr(logging,log_level.upper(),getattr(logging,"WARNING"))
         __LOG_LEVEL              = log_level
+        for debug_level in range(1,__MAX_DEBUG_LEVEL+1):
+            __DEBUG_LEVEL_ENABLED[debug_level] = __LOG_LEVEL_AS_INT <= logging.DEBUG-debug_level+1
         __LOGGING_IS_INITIALIZED = True
-        logging.basicConfig(format=log_format,filename=__LOG_FILE_PATH,filemode="w", level=__LOG_LEVEL_AS_INT)
+        _intrnl_stop_async_sink()
+        logging.basicConfig(format=log_format,filename=__LOG_FILE_PATH,filemode="a" if append else "w", level=__LOG_LEVEL_AS_INT,force=True)
+        if ASYNC:
+            _intrnl_start_async_sink(logging.getLogger("").handlers[0].formatter) # basicConfig has created/truncated the file
     except Exception as e:
         msg = "directory for storing log files '{}' cannot be accessed".format(log_dir)
         print("ERROR: "+msg,file=sys.stderr)
@@ -76,15 +163,24 @@ def _intrnl_register_additional_debug_levels(max_level=5):
          logging.addLevelName(level, label)
          setattr(logging, label, level)
          
-         def log_if_level_is_active_(self, message, *args, **kwargs):
-             nonlocal level
+         def log_if_level_is_active_(self, message, *args, level=level, **kwargs): # bind the current level
              if self.isEnabledFor(level):
                  self._log(level, message, args, **kwargs)
          setattr(logging.getLoggerClass(), label.lower(), log_if_level_is_active_)
 
-def _intrnl_make_message(prefix,func_name,raw_msg):
+def _intrnl_make_message(prefix,func_name,raw_msg,args=()):
+    if len(args):
+        raw_msg = raw_msg.format(*args)
     return prefix+"."+func_name+"(...):\t"+raw_msg
 
+def _intrnl_passes_filter(msg):
+    global __log_filter
+    if LOG_FILTER == None:
+        return True
+    if __log_filter == None or __log_filter.pattern != LOG_FILTER:
+        __log_filter = re.compile(LOG_FILTER)
+    return __log_filter.search(msg) != None
+
 def _intrnl_print_message(levelname,message):
     print(__LOG_FORMAT.replace("%(levelname)s",levelname).\
       replace("%(message)s",message),file=sys.stderr)
@@ -98,7 +194,7 @@ def log_info(prefix,func_name,raw_msg):
     if not __LOGGING_IS_INITIALIZED: init_logging()
 
     msg = _intrnl_make_message(prefix,func_name,raw_msg)
-    if LOG_FILTER == None or re.search(LOG_FILTER,msg):
+    if _intrnl_passes_filter(msg):
         logging.getLogger("").info(msg)
         if VERBOSE and __LOG_LEVEL_AS_INT <= getattr(logging,"INFO"):
             _intrnl_print_message("INFO",msg)
@@ -145,23 +241,36 @@ def log_warning(prefix,func_name,raw_msg):
     if not __LOGGING_IS_INITIALIZED: init_logging()
     
     msg = _intrnl_make_message(prefix,func_name,raw_msg)
-    if LOG_FILTER == None or re.search(LOG_FILTER,msg):
+    if _intrnl_passes_filter(msg):
         if TRACEBACK:
             stack = "".join(traceback.format_stack()[:-1])
             msg += "\n\n warning site:\n\n"+stack+"\n"
         logging.getLogger("").warning(msg)
         _intrnl_print_message("WARNING",msg)
 
-def log_debug(prefix,func_name,raw_msg,debug_level=1):
+def debug_level_enabled(debug_level=1):
+    """
+    :return: If messages of the given debug level are logged. 
+    :note: Use to guard expensive preparation of log messages in hot code paths.
+    """
+    return __DEBUG_LEVEL_ENABLED[debug_level]
+
+def log_debug(prefix,func_name,raw_msg,debug_level=1,args=()):
+    """
+    Log a debug message. Returns immediately if the debug level is not enabled.
+
+    :param raw_msg: The message or a format string for 'args'.
+    :param tuple args: Format arguments; the message is only formatted if it is logged.
+    """
     global __LOG_LEVEL_AS_INT
     global __LOGGING_IS_INITIALIZED
     global VERBOSE
-    global LOG_FILTER
     
+    if not __DEBUG_LEVEL_ENABLED[debug_level]: return
     if not __LOGGING_IS_INITIALIZED: init_logging()
    
-    msg = _intrnl_make_message(prefix,func_name,raw_msg)
-    if LOG_FILTER == None or re.search(LOG_FILTER,msg):
+    msg = _intrnl_make_message(prefix,func_name,raw_msg,args)
+    if _intrnl_passes_filter(msg):
         if debug_level == 1:
            logging.getLogger("").debug(msg)
         elif debug_level == 2:
@@ -174,20 +283,20 @@ def log_debug(prefix,func_name,raw_msg,debug_level=1):
            logging.getLogger("").debug5(msg)
         else:
             assert False, "debug level not supported"
-        if VERBOSE and __LOG_LEVEL_AS_INT <= getattr(logging,"DEBUG")-debug_level+1:
+        if VERBOSE:
             levelname =  "DEBUG" if ( debug_level == 1 ) else ("DEBUG"+str(debug_level))
             _intrnl_print_message(levelname,msg)
 
-def log_debug1(prefix,func_name,msg):
-    log_debug(prefix,func_name,msg,1)
-def log_debug2(prefix,func_name,msg):
-    log_debug(prefix,func_name,msg,2)
-def log_debug3(prefix,func_name,msg):
-    log_debug(prefix,func_name,msg,3)
-def log_debug4(prefix,func_name,msg):
-    log_debug(prefix,func_name,msg,4)
-def log_debug5(prefix,func_name,msg):
-    log_debug(prefix,func_name,msg,5)
+def log_debug1(prefix,func_name,msg,*args):
+    if __DEBUG_LEVEL_ENABLED[1]: log_debug(prefix,func_name,msg,1,args)
+def log_debug2(prefix,func_name,msg,*args):
+    if __DEBUG_LEVEL_ENABLED[2]: log_debug(prefix,func_name,msg,2,args)
+def log_debug3(prefix,func_name,msg,*args):
+    if __DEBUG_LEVEL_ENABLED[3]: log_debug(prefix,func_name,msg,3,args)
+def log_debug4(prefix,func_name,msg,*args):
+    if __DEBUG_LEVEL_ENABLED[4]: log_debug(prefix,func_name,msg,4,args)
+def log_debug5(prefix,func_name,msg,*args):
+    if __DEBUG_LEVEL_ENABLED[5]: log_debug(prefix,func_name,msg,5,args)
     
 def log_enter_function(prefix,func_name,args={}):
     """
@@ -196,9 +305,11 @@ def log_enter_function(prefix,func_name,args={}):
     :param str prefix: (sub-)package name
     :param str func_name: name of the function
     :param dict args: arguments (identifier and value) that have a meaningful string representation.
+                      Can be a callable that returns the dict, which is then only called if the message is logged.
     """
-    if not __LOGGING_IS_INITIALIZED: init_logging()
-    
+    if not __DEBUG_LEVEL_ENABLED[1]: return
+    if callable(args):
+        args = args()
     if len(args):
         addition = " [arguments: "+ ", ".join(a+"="+str(args[a]) for a in args.keys())+"]"
     else:
@@ -211,11 +322,13 @@ def log_leave_function(prefix,func_name,return_vals={}):
     :param str prefix: (sub-)package name
     :param str func_name: name of the function
     :param dict ret_vals: arguments (identifier and value) that have a meaningful string representation.
+                          Can be a callable that returns the dict, which is then only called if the message is logged.
     """
-    if not __LOGGING_IS_INITIALIZED: init_logging()
-    
+    if not __DEBUG_LEVEL_ENABLED[1]: return
+    if callable(return_vals):
+        return_vals = return_vals()
     if len(return_vals):
         addition = " [return values: "+ ", ".join(a+"="+str(return_vals[a]) for a in return_vals.keys())+"]"
     else:
         addition = "" 
-    log_debug(prefix,func_name,"return"+addition)
\ No newline at end of file
+    log_debug(prefix,func_name,"return"+addition)
@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
+"""Read files ahead of time on a small pool of I/O threads.
+
+A consumer that knows which files it will need calls 'prefetch'; the pool threads
+open, read and decode the files while the consumer keeps working. 'read' returns
+the prefetched result or loads the file in the calling thread if it has not been
+prefetched. This hides the latency of open and stat calls on network and parallel
+file systems. A prefetched result is handed out once. Files that are about to be
+overwritten must be discarded (see: utils.fileutils.prepare_output_file).
+"""
+import os
+import threading
+import collections
+import concurrent.futures
+
+import utils.codecache
+
+utils.codecache.exec_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "prefetch_options.py.in"),globals())
+
+__executor = None                      # created on first use
+__futures  = collections.OrderedDict() # (filepath,load) -> future, oldest first
+__tasks    = []                        # futures of the background tasks that have not been waited for
+__lock     = threading.Lock()
+
+def _intrnl_get_executor():
+    global __executor
+    if __executor == None:
+        __executor = concurrent.futures.ThreadPoolExecutor(max_workers=NUM_THREADS,thread_name_prefix="prefetch")
+    return __executor
+
+def _intrnl_reset_after_fork():
+    """The threads of the pool do not survive a fork; forked processes, e.g. batch workers, create their own pool."""
+    global __executor
+    global __lock
+    __executor = None
+    __lock     = threading.Lock()
+    __futures.clear()
+    __tasks.clear()
+
+os.register_at_fork(after_in_child=_intrnl_reset_after_fork)
+
+# API
+def prefetch(filepath,load):
+    """
+    Load a file in the background unless it is already being loaded.
+    :param str filepath: Path of the file.
+    :param load: Thread-safe function that takes the path and returns the loaded, e.g. decoded, content.
+                 Must be the same function object that is later passed to 'read'.
+    """
+    if NUM_THREADS < 1:
+        return
+    key = (os.path.abspath(filepath),load)
+    with __lock:
+        if key not in __futures:
+            __futures[key] = _intrnl_get_executor().submit(load,filepath)
+            while len(__futures) > MAX_PREFETCHED_FILES:
+                __futures.popitem(last=False)[1].cancel()
+
+def run_in_background(task,*args):
+    """
+    Run an I/O-bound task on the pool, e.g. one that discovers the files to prefetch. Its result is dropped.
+    :note: 'discard' waits for the task to finish, so that the task cannot prefetch a file after it has been discarded.
+    """
+    if NUM_THREADS < 1:
+        return
+    with __lock:
+        __tasks.append(_intrnl_get_executor().submit(task,*args))
+
+def read(filepath,load):
+    """
+    :return: The result of 'load(filepath)'; taken from the prefetched results if available.
+    :throws: The exceptions raised by 'load', e.g. IOError.
+    """
+    with __lock:
+        future = __futures.pop((os.path.abspath(filepath),load),None)
+    if future != None and not future.cancelled():
+        return future.result()
+    return load(filepath)
+
+def discard(filepath):
+    """
+    Drop the prefetched results of a file, e.g. because it is about to be overwritten.
+    Waits for the background tasks first, as they might prefetch the file.
+    :note: Must not be called from a background task.
+    """
+    filepath = os.path.abspath(filepath)
+    with __lock:
+        tasks = list(__tasks)
+        __tasks.clear()
+    concurrent.futures.wait(tasks)
+    with __lock:
+        for key in [key for key in __futures if key[0] == filepath]:
+            __futures.pop(key).cancel()
+
+def read_all(filepaths,load):
+    """
+    :return: Generator that yields the result of 'load' for each file, in order, 
+             while the next files are prefetched.
+    """
+    filepaths = list(filepaths)
+    window    = max(1,MAX_PREFETCHED_FILES//2) # leave room for other prefetched files
+    for filepath in filepaths[:window]:
+        prefetch(filepath,load)
+    for i,filepath in enumerate(filepaths):
+        if i+window < len(filepaths):
+            prefetch(filepaths[i+window],load)
+        yield read(filepath,load)
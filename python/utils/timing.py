@@ -0,0 +1,128 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
+"""Wall-clock and CPU time measurements of pipeline stages.
+
+Wrap a stage into 'with timed(name,category,args):'. If ENABLED is not set,
+'timed' returns a shared no-op context manager. Measurements of forked worker
+processes must be passed back to the parent process (see: events, add_events).
+The measurements can be written as JSON summary (see: write_timings) or
+as Chrome trace timeline (see: write_trace), which can be opened in
+'chrome://tracing' or 'https://ui.perfetto.dev'.
+"""
+import os
+import json
+import time
+import threading
+
+import utils.codecache
+
+utils.codecache.exec_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "timing_options.py.in"),globals())
+
+__events = [] # dicts with name, category, pid, tid, start, wall_time, cpu_time, args
+
+class _intrnl_Timer():
+    __slots__ = ["_event","_start","_cpu_start"]
+    def __init__(self,name,category,args):
+        self._event = { "name": name, "category": category, "args": args }
+    def __enter__(self):
+        self._cpu_start = time.process_time()
+        self._start     = time.perf_counter()
+        return self
+    def __exit__(self,exc_type,exc_value,traceback):
+        wall_time = time.perf_counter() - self._start
+        self._event.update(pid=os.getpid(),tid=threading.get_native_id(),
+          start=self._start,wall_time=wall_time,cpu_time=time.process_time()-self._cpu_start)
+        _intrnl_record(self._event)
+        return False
+
+class _intrnl_NoTimer():
+    __slots__ = []
+    def __enter__(self):
+        return self
+    def __exit__(self,exc_type,exc_value,traceback):
+        return False
+
+__NO_TIMER = _intrnl_NoTimer()
+
+def _intrnl_record(event):
+    __events.append(event) # not in class scope; '__events' would be name-mangled there
+
+def _intrnl_relative_events():
+    """:return: Copies of the recorded events with start times relative to the first event."""
+    origin = min((event["start"] for event in __events),default=0.0)
+    return [dict(event,start=event["start"]-origin) for event in sorted(__events,key=lambda event: event["start"])]
+
+def _intrnl_write_json_file(filepath,content):
+    with open(filepath,"w") as outfile:
+        json.dump(content,outfile,indent=1)
+
+# API
+def timed(name,category="stage",args=None):
+    """
+    :param str name: Name of the measured stage, e.g. the name of the called function.
+    :param str category: Category of the stage, e.g. 'stage' or 'kernel'.
+    :param dict args: Additional JSON-serializable information, e.g. the input file.
+    :return: Context manager that records the wall-clock and CPU time of its body.
+    :note: The CPU time is the time of the whole process, including other threads.
+    """
+    if ENABLED:
+        return _intrnl_Timer(name,category,args or {})
+    else:
+        return __NO_TIMER
+
+def events():
+    """:return: The events that have been recorded by this process."""
+    return list(__events)
+
+def add_events(other_events):
+    """Add events that have been recorded by another process, e.g. a worker process."""
+    __events.extend(other_events)
+
+def clear():
+    """Remove all recorded events, e.g. the ones that a forked process has inherited."""
+    __events.clear()
+
+def summary():
+    """
+    :return: List of dicts with name, category, count and total wall-clock and CPU time of the
+             recorded stages, sorted by decreasing wall-clock time.
+    """
+    totals = {}
+    for event in __events:
+        key = (event["name"],event["category"])
+        total = totals.setdefault(key,{ "name": event["name"], "category": event["category"],
+                                        "count": 0, "wall_time": 0.0, "cpu_time": 0.0 })
+        total["count"]     += 1
+        total["wall_time"] += event["wall_time"]
+        total["cpu_time"]  += event["cpu_time"]
+    return sorted(totals.values(),key=lambda total: -total["wall_time"])
+
+def write_timings(filepath):
+    """
+    Write the summary and the recorded events as JSON file. Times are in seconds,
+    event start times are relative to the start of the first event.
+    """
+    _intrnl_write_json_file(filepath,{ "summary": summary(), "events": _intrnl_relative_events() })
+
+def write_trace(filepath):
+    """Write the recorded events as Chrome trace file (trace event format, complete events)."""
+    trace_events = []
+    for event in _intrnl_relative_events():
+        trace_events.append({ "name": event["name"], "cat": event["category"], "ph": "X",
+          "ts": event["start"]*1e6, "dur": event["wall_time"]*1e6,
+          "pid": event["pid"], "tid": event["tid"],
+          "args": dict(event["args"],cpu_time_us=event["cpu_time"]*1e6) })
+    _intrnl_write_json_file(filepath,{ "traceEvents": trace_events, "displayTimeUnit": "ms" })
+
+def timed_iterations(iterable,name,category="stage",get_args=None):
+    """
+    Yields the items of 'iterable' and records the time of each loop iteration,
+    i.e. of the loop body, as separate event.
+    :param get_args: Function that derives the args of an event from the item, or None.
+    """
+    for item in iterable:
+        if ENABLED:
+            with _intrnl_Timer(name,category,get_args(item) if get_args != None else {}):
+                yield item
+        else:
+            yield item
@@ -1,25 +1,28 @@
 #!/usr/bin/env python3
-import os
+import os,sys
 import pprint
 
 import jinja2
 
+# shared by all models; caches the compiled templates
+ENV = jinja2.Environment(loader=jinja2.FileSystemLoader(os.path.realpath(os.path.dirname(__file__))),
+        trim_blocks=True, lstrip_blocks=True, undefined=jinja2.StrictUndefined)
+
 class BaseModel():
     def __init__(self,template):
         self._template = template
-    def generate_code(self,context={}):
-        LOADER = jinja2.FileSystemLoader(os.path.realpath(os.path.dirname(__file__)))
-        ENV    = jinja2.Environment(loader=LOADER, trim_blocks=True, lstrip_blocks=True, undefined=jinja2.StrictUndefined)
-
-        template = ENV.get_template(self._template)
+    def generate_chunks(self,context={}):
+        """:return: Generator that renders the template piece by piece."""
         try:
-            return template.render(context)
+            yield from ENV.get_template(self._template).generate(context)
         except Exception as e:
             print("ERROR: could not render template '%s'" % self._template, file=sys.stderr)
             raise e
+    def generate_code(self,context={}):
+        return "".join(self.generate_chunks(context))
     def generate_file(self,output_file_path,context={}):
         with open(output_file_path, "w") as output:
-            output.write(self.generate_code(context))
+            output.writelines(self.generate_chunks(context))
 
 class Model(BaseModel):
     def __init__(self):
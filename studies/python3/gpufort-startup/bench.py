@@ -0,0 +1,45 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2021 Advanced Micro Devices, Inc. All rights reserved.
+"""Measures the time to import the gpufort modules in a fresh interpreter,
+i.e. the startup cost paid by every gpufort invocation.
+
+'uncached' compiles all '*.py.in' sources from scratch (previous behavior),
+'cached' loads their bytecode via utils.codecache.
+"""
+import os, sys
+import subprocess
+import statistics
+
+GPUFORT_PYTHON_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__),"..","..","..","python"))
+NUM_RUNS = int(os.environ.get("NUM_RUNS",10))
+
+SNIPPET = """
+import time
+t0 = time.perf_counter()
+import sys
+sys.path.insert(0,{python_dir!r})
+import utils.codecache
+utils.codecache.CACHE_ENABLED = {cache_enabled}
+import linemapper.linemapper, indexer.indexer, scanner.scanner, fort2hip.fort2hip
+print(time.perf_counter()-t0)
+"""
+
+def measure(cache_enabled):
+    snippet = SNIPPET.format(python_dir=GPUFORT_PYTHON_DIR,cache_enabled=cache_enabled)
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE",None)
+    subprocess.check_output([sys.executable,"-c",snippet],env=env) # warm up OS file cache and bytecode caches
+    timings = []
+    for i in range(0,NUM_RUNS):
+        output = subprocess.check_output([sys.executable,"-c",snippet],env=env)
+        timings.append(float(output.decode("utf-8").strip()))
+    return timings
+
+if __name__ == "__main__":
+    print("{:<10} {:>10} {:>10} {:>10}".format("mode","min [s]","median [s]","max [s]"))
+    results = {}
+    for label, cache_enabled in [("uncached",False),("cached",True)]:
+        timings = measure(cache_enabled)
+        results[label] = statistics.median(timings)
+        print("{:<10} {:>10.3f} {:>10.3f} {:>10.3f}".format(label,min(timings),results[label],max(timings)))
+    print("speedup (median): {:.2f}x".format(results["uncached"]/results["cached"]))